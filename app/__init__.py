@@ -1,6 +1,13 @@
+import logging
 from flask import Flask
 from app.config import load_configurations, configure_logging
 from .views import webhook_blueprint
+from .services.openai_service import agent_executor, session_store
+from .services.JobQueue import JobQueue
+from .services.DedupStore import create_dedup_store
+from .services.WhatsAppSender import WhatsAppSender
+from .services.Tracing import tracer
+from .utils.whatsapp_utils import process_whatsapp_message
 
 
 def create_app():
@@ -13,4 +20,40 @@ def create_app():
     # Import and register blueprints, if any
     app.register_blueprint(webhook_blueprint)
 
+    # Compile the SQL agent graph once, before the first message arrives
+    agent_executor.get_graph(asynchronous=agent_executor.use_async)
+    try:
+        agent_executor.sql_agent.noun_index.refresh()
+    except Exception as e:
+        logging.warning(f"Could not build the noun index at startup: {e}")
+
+    app.extensions["answer_cache"] = agent_executor.answer_cache
+    app.extensions["llm_memo"] = agent_executor.sql_agent.llm_manager.memo
+    app.extensions["sql_agent"] = agent_executor.sql_agent
+    app.extensions["prompt_tokens"] = agent_executor.sql_agent.llm_manager.prompt_tokens
+    app.extensions["model_usage"] = agent_executor.sql_agent.llm_manager.usage
+    app.extensions["relevance_filter"] = agent_executor.relevance_filter
+    app.extensions["session_store"] = session_store
+    app.extensions["tracer"] = tracer
+
+    # One pooled, retrying client for every outbound message
+    app.extensions["whatsapp_sender"] = WhatsAppSender.from_config(app.config)
+
+    # Webhook payloads are processed off the request thread, see views.handle_message
+    def process_in_app_context(body):
+        with app.app_context():
+            process_whatsapp_message(body)
+
+    job_queue = JobQueue(process_in_app_context, workers=app.config["JOB_QUEUE_WORKERS"])
+    job_queue.start()
+    app.extensions["job_queue"] = job_queue
+
+    # Meta redelivers slow webhooks; remember message ids so retries are skipped
+    app.extensions["dedup_store"] = create_dedup_store(
+        app.config["DEDUP_BACKEND"],
+        ttl=app.config["DEDUP_TTL_SECONDS"],
+        max_entries=app.config["DEDUP_MAX_ENTRIES"],
+        db_path=app.config["DEDUP_DB_PATH"],
+    )
+
     return app
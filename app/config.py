@@ -14,6 +14,30 @@ def load_configurations(app):
     app.config["VERSION"] = os.getenv("VERSION")
     app.config["PHONE_NUMBER_ID"] = os.getenv("PHONE_NUMBER_ID")
     app.config["VERIFY_TOKEN"] = os.getenv("VERIFY_TOKEN")
+    app.config["JOB_QUEUE_WORKERS"] = int(os.getenv("JOB_QUEUE_WORKERS", "4"))
+    app.config["DEDUP_BACKEND"] = os.getenv("DEDUP_BACKEND", "memory")
+    app.config["DEDUP_TTL_SECONDS"] = float(os.getenv("DEDUP_TTL_SECONDS", "86400"))
+    app.config["DEDUP_MAX_ENTRIES"] = int(os.getenv("DEDUP_MAX_ENTRIES", "10000"))
+    app.config["DEDUP_DB_PATH"] = os.getenv("DEDUP_DB_PATH", "dedup.db")
+    app.config["WHATSAPP_API_BASE_URL"] = os.getenv("WHATSAPP_API_BASE_URL", "https://graph.facebook.com")
+    app.config["WHATSAPP_MAX_RETRIES"] = int(os.getenv("WHATSAPP_MAX_RETRIES", "4"))
+    app.config["WHATSAPP_RATE_PER_SECOND"] = float(os.getenv("WHATSAPP_RATE_PER_SECOND", "80"))
+    app.config["WHATSAPP_RECIPIENT_RATE_PER_SECOND"] = float(os.getenv("WHATSAPP_RECIPIENT_RATE_PER_SECOND", "1"))
+    app.config["WHATSAPP_RECIPIENT_BURST"] = int(os.getenv("WHATSAPP_RECIPIENT_BURST", "10"))
+    app.config["REPLY_MODE"] = os.getenv("REPLY_MODE", "progressive")  # or "single"
+    app.config["REPLY_ACK"] = os.getenv("REPLY_ACK", "typing")  # "typing", "text" or "none"
+    app.config["REPLY_ACK_TEXT"] = os.getenv("REPLY_ACK_TEXT", "Looking that up for you...")
+    # CONVERSATION_DB_PATH / CONVERSATION_RECENT_TURNS / CONVERSATION_SUMMARY_TOKENS / CONVERSATION_TTL_SECONDS
+    # are read by ConversationMemory.from_env
+    # SQL_MAX_ROWS / SQL_MAX_BYTES / SQL_TIMEOUT_SECONDS / SQL_MAX_SCAN_ROWS / SQL_MAX_SCAN_FACTOR are read by DatabaseManager
+    # NOUN_INDEX_TOP_K / NOUN_INDEX_MAX_VALUES / NOUN_INDEX_REFRESH_SECONDS are read by NounIndex
+    # SESSION_DB_PATH / SESSION_TTL_SECONDS / SESSION_CACHE_SIZE are read by SessionStore.from_env
+    # TRACE_ENABLED / TRACE_EXPORT_PATH are read by Tracer.from_env
+    # WORKFLOW_MODE ("staged" or "fast") is read by Workflow when openai_service is imported
+    # LLM_ROUTING / LLM_ROUTES / LLM_SMALL_MODEL / LLM_LARGE_MODEL / LLM_LOCAL_BASE_URL / LLM_LOCAL_API_KEY
+    # are read by ModelRouter.from_env
+    # RELEVANCE_FILTER / RELEVANCE_MIN_SIMILARITY / RELEVANCE_OFF_TOPIC_MARGIN are read by RelevanceFilter.from_env
+    # SQL_TEMPLATES / SQL_TEMPLATES_MIN_OCCURRENCES are read by SQLTemplates.from_env
 
 
 def configure_logging():
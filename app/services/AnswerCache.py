@@ -0,0 +1,163 @@
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "what", "which", "who", "where", "whats", "me", "my", "i",
+    "can", "you", "tell", "give", "show", "please", "of", "in", "on", "at", "for", "to", "by", "with",
+    "and", "or", "do", "does", "there", "some", "any", "one", "ones", "list", "find",
+}
+
+# Words users swap freely when asking the same thing about restaurants.
+SYNONYMS = {
+    "top": "best", "highest": "best", "greatest": "best", "finest": "best", "good": "best",
+    "lowest": "worst", "bad": "worst", "rated": "rating", "rate": "rating", "ratings": "rating",
+    "place": "restaurant", "places": "restaurant", "restaurants": "restaurant", "eat": "restaurant",
+    "cheapest": "cheap", "inexpensive": "cheap", "affordable": "cheap",
+    "priciest": "expensive", "costly": "expensive",
+}
+
+
+def question_tokens(question: str) -> Tuple[str, ...]:
+    """Lowercase, strip punctuation and stopwords, fold plurals and synonyms."""
+    tokens = []
+    for word in re.findall(r"[\w']+", question.lower()):
+        word = word.replace("'", "")
+        if word in STOPWORDS:
+            continue
+        word = SYNONYMS.get(word, word)
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = SYNONYMS.get(word[:-1], word[:-1])
+        tokens.append(word)
+    return tuple(tokens)
+
+
+class AnswerCache:
+    """
+    Cache of SQL agent answers keyed on the user's question.
+
+    A lookup first tries the normalized question (sorted content tokens after
+    synonym folding) and then the most similar cached question by TF-IDF
+    cosine similarity, accepted only above ``threshold``. Questions that
+    differ in a protected term (numbers by default, plus whatever
+    ``is_protected`` flags, such as city or cuisine names) never match each
+    other. Entries expire after ``ttl`` seconds, the least recently used is
+    evicted beyond ``max_entries``, and everything is dropped when the data
+    version reported by the caller changes.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: float = 3600, threshold: float = 0.85,
+                 is_protected: Optional[Callable[[str], bool]] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.is_protected = is_protected or (lambda token: False)
+        # key -> (stored_at, token counts, protected terms, answer)
+        self._entries: "OrderedDict[Tuple[str, ...], Tuple[float, Counter, frozenset, Any]]" = OrderedDict()
+        self._document_frequency: Counter = Counter()
+        self._data_version: Optional[Hashable] = None
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def _protected(self, tokens: Iterable[str]) -> frozenset:
+        return frozenset(t for t in tokens if t.isdigit() or self.is_protected(t))
+
+    def _remove(self, key: Tuple[str, ...]) -> None:
+        _, counts, _, _ = self._entries.pop(key)
+        self._document_frequency.subtract(counts.keys())
+
+    def _check_version(self, data_version: Hashable) -> None:
+        if data_version != self._data_version:
+            if self._entries:
+                self.stats["invalidations"] += 1
+            self._entries.clear()
+            self._document_frequency = Counter()
+            self._data_version = data_version
+
+    def _expire(self, now: float) -> None:
+        expired = [key for key, (stored_at, _, _, _) in self._entries.items() if now - stored_at >= self.ttl]
+        for key in expired:
+            self._remove(key)
+            self.stats["expired"] += 1
+
+    def _vector(self, counts: Counter) -> Dict[str, float]:
+        documents = len(self._entries) + 1
+        return {
+            token: count * (math.log(documents / (1 + self._document_frequency[token])) + 1)
+            for token, count in counts.items()
+        }
+
+    @staticmethod
+    def _cosine(a: Dict[str, float], b: Dict[str, float]) -> float:
+        dot = sum(weight * b.get(token, 0.0) for token, weight in a.items())
+        norm = math.sqrt(sum(w * w for w in a.values())) * math.sqrt(sum(w * w for w in b.values()))
+        return dot / norm if norm else 0.0
+
+    def get(self, question: str, data_version: Hashable = None) -> Optional[Any]:
+        """Return a cached answer for question (or a close paraphrase), else None."""
+        tokens = question_tokens(question)
+        key = tuple(sorted(tokens))
+        protected = self._protected(tokens)
+        now = time.time()
+        with self._lock:
+            self._check_version(data_version)
+            self._expire(now)
+            if not key:
+                self.stats["misses"] += 1
+                return None
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.stats["exact_hits"] += 1
+                return self._entries[key][3]
+
+            counts = Counter(tokens)
+            query = self._vector(counts)
+            best_key, best_score = None, 0.0
+            for candidate, (_, candidate_counts, candidate_protected, _) in self._entries.items():
+                if candidate_protected != protected:
+                    continue
+                score = self._cosine(query, self._vector(candidate_counts))
+                if score > best_score:
+                    best_key, best_score = candidate, score
+            if best_key is not None and best_score >= self.threshold:
+                self._entries.move_to_end(best_key)
+                self.stats["similar_hits"] += 1
+                return self._entries[best_key][3]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, question: str, answer: Any, data_version: Hashable = None) -> None:
+        tokens = question_tokens(question)
+        key = tuple(sorted(tokens))
+        if not key:
+            return
+        # Computed once here rather than per entry on every lookup; is_protected may consult the noun index
+        protected = self._protected(tokens)
+        with self._lock:
+            self._check_version(data_version)
+            if key in self._entries:
+                self._remove(key)
+            counts = Counter(tokens)
+            self._entries[key] = (time.time(), counts, protected, answer)
+            self._document_frequency.update(counts.keys())
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._document_frequency = Counter()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.stats["exact_hits"] + self.stats["similar_hits"]
+            lookups = hits + self.stats["misses"]
+            return {
+                "entries": len(self._entries),
+                "hit_rate": hits / lookups if lookups else 0.0,
+                **self.stats,
+            }
@@ -0,0 +1,226 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from app.services.PromptBudget import count_tokens, truncate_text
+
+
+class ConversationMemory:
+    """
+    Per-wa_id conversation state carried between workflow runs.
+
+    The workflow graph is compiled with a LangGraph checkpointer keyed by
+    wa_id, so parsed_question, unique_nouns and sql_query from the previous
+    turn are still in the state when the next message arrives. start_turn
+    resets the per-turn channels and decides whether the message refines
+    the previous question; a refinement goes straight to generate_sql with
+    the cached context instead of re-running parse_question and
+    get_unique_nouns. end_turn keeps the last ``recent_turns`` turns
+    verbatim and folds older ones into a one-line-per-turn summary that is
+    kept under ``summary_tokens`` by dropping its oldest lines.
+
+    The checkpointer writes a checkpoint per graph step and never deletes
+    one. compact, called after every run, keeps only the latest checkpoint
+    of the thread (all the next message reads) and the writes that belong
+    to it. Threads idle for longer than ``ttl`` seconds are deleted, swept
+    at most once per ``expire_interval``; ``ttl`` 0 keeps them forever.
+    """
+
+    # Follow-ups are short and either open with a continuation or point back at the last answer
+    FOLLOW_UP_OPENERS = ("and ", "what about", "how about", "only ", "but ", "also ", "just ", "now ", "same ")
+    FOLLOW_UP_WORDS = {
+        "those", "these", "them", "they", "ones", "one", "it", "that", "there", "instead",
+        "cheaper", "pricier", "expensive", "better", "worse", "closer", "more", "less", "other", "else",
+    }
+    max_follow_up_words = 8
+
+    def __init__(
+        self,
+        db_path: str = "conversations.db",
+        recent_turns: int = 3,
+        summary_tokens: int = 300,
+        answer_chars: int = 200,
+        ttl: float = 30 * 86400,
+        expire_interval: float = 3600,
+    ):
+        self.db_path = db_path
+        self.recent_turns = recent_turns
+        self.summary_tokens = summary_tokens
+        self.answer_chars = answer_chars
+        self.ttl = ttl
+        self.expire_interval = expire_interval
+        self._last_expiry = 0.0
+        self._local = threading.local()
+
+    @classmethod
+    def from_env(cls) -> Optional["ConversationMemory"]:
+        """Build the memory from CONVERSATION_* settings; an empty CONVERSATION_DB_PATH disables it."""
+        db_path = os.getenv("CONVERSATION_DB_PATH", "conversations.db")
+        if not db_path:
+            return None
+        try:
+            import langgraph.checkpoint.sqlite  # noqa: F401
+        except ImportError:
+            logging.warning("langgraph-checkpoint-sqlite is not installed; conversation memory is disabled")
+            return None
+        return cls(
+            db_path=db_path,
+            recent_turns=int(os.getenv("CONVERSATION_RECENT_TURNS", "3")),
+            summary_tokens=int(os.getenv("CONVERSATION_SUMMARY_TOKENS", "300")),
+            ttl=float(os.getenv("CONVERSATION_TTL_SECONDS", str(30 * 86400))),
+        )
+
+    def checkpointer(self):
+        """SQLite checkpointer for the sync graph."""
+        from langgraph.checkpoint.sqlite import SqliteSaver
+        return SqliteSaver(sqlite3.connect(self.db_path, check_same_thread=False))
+
+    def async_checkpointer(self):
+        """SQLite checkpointer for the async graph; must be created on the loop that will run it."""
+        import aiosqlite
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+        return AsyncSqliteSaver(aiosqlite.connect(self.db_path))
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS thread_activity (thread_id TEXT PRIMARY KEY, last_seen REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS thread_activity_last_seen ON thread_activity (last_seen)")
+            self._local.connection = connection
+        return connection
+
+    def compact(self, wa_id: str) -> None:
+        """Drop every checkpoint of wa_id's thread but the latest, and sweep idle threads when one is due."""
+        now = time.time()
+        connection = self._connection()
+        # checkpoint ids are time-ordered (uuid6), so the latest is the largest
+        latest = (
+            "(SELECT MAX(latest.checkpoint_id) FROM checkpoints AS latest "
+            "WHERE latest.thread_id = {table}.thread_id AND latest.checkpoint_ns = {table}.checkpoint_ns)"
+        )
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for table in ("writes", "checkpoints"):
+                connection.execute(
+                    f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_id < {latest.format(table=table)}", (wa_id,)
+                )
+            connection.execute(
+                "INSERT INTO thread_activity (thread_id, last_seen) VALUES (?, ?) "
+                "ON CONFLICT(thread_id) DO UPDATE SET last_seen = excluded.last_seen",
+                (wa_id, now),
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        if self.ttl and now - self._last_expiry > self.expire_interval:
+            self._last_expiry = now
+            self.expire()
+
+    def expire(self) -> int:
+        """Delete threads idle for longer than the TTL; returns how many were removed."""
+        connection = self._connection()
+        cutoff = time.time() - self.ttl
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            # Threads checkpointed before activity was recorded start their TTL now
+            connection.execute(
+                "INSERT OR IGNORE INTO thread_activity (thread_id, last_seen) "
+                "SELECT DISTINCT thread_id, ? FROM checkpoints",
+                (time.time(),),
+            )
+            idle = "SELECT thread_id FROM thread_activity WHERE last_seen < ?"
+            for table in ("writes", "checkpoints"):
+                connection.execute(f"DELETE FROM {table} WHERE thread_id IN ({idle})", (cutoff,))
+            removed = connection.execute("DELETE FROM thread_activity WHERE last_seen < ?", (cutoff,)).rowcount
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        if removed:
+            logging.info(f"Expired {removed} idle conversation threads")
+        return removed
+
+    @staticmethod
+    def config(wa_id: str) -> Dict[str, Any]:
+        """The graph config that selects this user's checkpoint thread."""
+        return {"configurable": {"thread_id": wa_id}}
+
+    def looks_like_follow_up(self, question: str) -> bool:
+        """True if the wording refers back to an earlier turn (e.g. "and cheaper ones?")."""
+        text = question.strip().lower()
+        words = re.findall(r"\w+", text)
+        if not words or len(words) > self.max_follow_up_words:
+            return False
+        return text.startswith(self.FOLLOW_UP_OPENERS) or any(word in self.FOLLOW_UP_WORDS for word in words)
+
+    def start_turn(self, state: dict, lookup_nouns: Callable[[str, List[tuple]], List[str]]) -> dict:
+        """Reset the per-turn channels and mark whether the cached context can be reused."""
+        update = {
+            "results": [],
+            "results_truncated": False,
+            "error": "",
+            "sql_attempts": 0,
+            "answer": None,
+            "recommendation": None,
+            "recommendation_reason": None,
+            "follow_up": False,
+        }
+        parsed_question = state.get('parsed_question')
+        if not (parsed_question and parsed_question.get('is_relevant') and state.get('history')):
+            return update
+        if not self.looks_like_follow_up(state['question']):
+            return update
+        # "and in Barcelona?" names a new value in a column the previous turn already used
+        columns = [
+            (table_info['table_name'], column)
+            for table_info in parsed_question['relevant_tables']
+            for column in table_info.get('noun_columns', [])
+        ]
+        nouns = list(state.get('unique_nouns') or [])
+        if columns:
+            nouns.extend(noun for noun in lookup_nouns(state['question'], columns) if noun not in nouns)
+        update.update(follow_up=True, unique_nouns=nouns)
+        return update
+
+    def _summary_line(self, turn: Dict[str, str]) -> str:
+        answer = " ".join((turn.get('answer') or "").split())
+        return f"- asked: {turn['question']} | sql: {' '.join(turn.get('sql_query', '').split())} | answered: {answer}"
+
+    def _fit_summary(self, lines: List[str]) -> str:
+        while len(lines) > 1 and count_tokens("\n".join(lines)) > self.summary_tokens:
+            lines = lines[1:]
+        return truncate_text("\n".join(lines), self.summary_tokens) if lines else ""
+
+    def end_turn(self, state: dict) -> dict:
+        """Append this turn to the history, folding turns beyond recent_turns into the summary."""
+        turn = {
+            "question": state['question'],
+            "sql_query": state.get('sql_query') or "",
+            "answer": (state.get('answer') or "")[:self.answer_chars],
+        }
+        history = list(state.get('history') or []) + [turn]
+        summary = state.get('summary') or ""
+        if len(history) > self.recent_turns:
+            older, history = history[:-self.recent_turns], history[-self.recent_turns:]
+            lines = summary.splitlines() + [self._summary_line(old) for old in older]
+            summary = self._fit_summary(lines)
+        return {"history": history, "summary": summary}
+
+    @staticmethod
+    def render(state: dict) -> str:
+        """Earlier turns as prompt text, or "None" for the first message of a conversation."""
+        sections = []
+        if state.get('summary'):
+            sections.append(f"Earlier:\n{state['summary']}")
+        for turn in state.get('history') or []:
+            sections.append(f"User: {turn['question']}\nSQL: {turn['sql_query']}\nAnswer: {turn['answer']}")
+        return "\n\n".join(sections) or "None"
@@ -1,59 +1,367 @@
-from typing import List, Any
-from sqlalchemy import create_engine, inspect
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import List, Any, Dict, Iterator, Optional, Tuple
+from sqlalchemy import create_engine, event, inspect
 from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
 from sqlalchemy import text
-<<<<<<< HEAD
-from langchain_community.utilities import SQLDatabase
 
-
-class DatabaseManager:
-    
-    def __init__(self,db_path: str = "/Users/main/Desktop/chatbot/app/services/all_data.db"):
-=======
+from app.services.QueryLog import QueryLog
+from app.services.Tracing import tracer
 
 import json
 
+FETCH_BATCH_SIZE = 100
+
+_TABLE_REFERENCE = re.compile(r"(?:\bFROM|\bJOIN|,)\s*`?(\w+)`?(?:\s+(?:AS\s+)?`?(\w+)`?)?", re.IGNORECASE)
+_SQL_KEYWORDS = {
+    "WHERE", "JOIN", "INNER", "LEFT", "RIGHT", "CROSS", "OUTER", "NATURAL", "ON", "USING",
+    "GROUP", "ORDER", "LIMIT", "HAVING", "UNION", "EXCEPT", "INTERSECT", "WINDOW", "AS",
+}
+
+_ENGINES: Dict[Tuple[str, bool], Engine] = {}
+_ENGINES_LOCK = threading.Lock()
+
+# Read-side tuning applied to every pooled connection
+CONNECTION_PRAGMAS = (
+    "PRAGMA mmap_size = 268435456",  # map up to 256 MB of the file instead of read() calls
+    "PRAGMA cache_size = -65536",    # 64 MB page cache per connection
+    "PRAGMA temp_store = MEMORY",
+)
+
+
+def _check_journal_mode(db_path: str) -> None:
+    """
+    Warn if the database is not in WAL mode, in which readers can block on a writer.
+
+    The file is only read: switching the journal mode is a deployment
+    step (sqlite3 all_data.db "PRAGMA journal_mode=WAL;"), not something
+    a read-only application should do to its data file.
+    """
+    if not os.path.exists(db_path):
+        return
+    try:
+        connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=5)
+        try:
+            mode = connection.execute("PRAGMA journal_mode").fetchone()[0]
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        logging.warning(f"Could not read the journal mode of {db_path}: {e}")
+        return
+    if mode.lower() != "wal":
+        logging.warning(f"{db_path} uses journal_mode={mode}; readers may block on writers. "
+                        f"Run sqlite3 {db_path} \"PRAGMA journal_mode=WAL;\" once when deploying it.")
+
+
+def get_shared_engine(db_path: str, read_only: bool = True) -> Engine:
+    """
+    Return the process-wide engine for db_path, creating it on first use.
+
+    Every DatabaseManager for the same file shares one connection pool
+    (DB_POOL_SIZE connections, default 8) instead of building its own
+    engine. Read-only engines open the file in SQLite URI mode=ro, so
+    LLM-generated SQL cannot modify data. Each connection keeps a cache
+    of prepared statements for the queries the pipeline repeats.
+    """
+    path = os.path.abspath(db_path)
+    key = (path, read_only)
+    with _ENGINES_LOCK:
+        engine = _ENGINES.get(key)
+        if engine is not None:
+            return engine
+        _check_journal_mode(path)
+        url = f"sqlite:///file:{path}?mode=ro&uri=true" if read_only else f"sqlite:///{path}"
+        pool_size = int(os.getenv("DB_POOL_SIZE", "8"))
+        engine = create_engine(
+            url,
+            poolclass=QueuePool,
+            pool_size=pool_size,
+            max_overflow=pool_size,
+            pool_pre_ping=False,
+            connect_args={"check_same_thread": False, "cached_statements": 256},
+        )
+
+        @event.listens_for(engine, "connect")
+        def _tune_connection(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in CONNECTION_PRAGMAS:
+                cursor.execute(pragma)
+            if read_only:
+                cursor.execute("PRAGMA query_only = ON")
+            cursor.close()
+
+        _ENGINES[key] = engine
+        return engine
+
+
+class QueryRejected(Exception):
+    """A query stopped by a guard rather than by an SQL error.
+
+    reason is "timeout", "cost" or "rows"; the message says what to
+    change, so it can be handed back to the SQL generation step.
+    """
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+@dataclass(frozen=True)
+class ColumnInfo:
+    name: str
+    type: str
+    sample_values: List[str] = field(default_factory=list)
+
+
+@dataclass(frozen=True)
+class SchemaSnapshot:
+    """Structured view of the database schema plus the prompt string built from it."""
+    tables: Dict[str, List[ColumnInfo]]
+    version: Tuple[Optional[int], Optional[float]]
+    prompt: str
+
+    def table_names(self) -> List[str]:
+        return list(self.tables)
+
+    def column_names(self, table: str) -> List[str]:
+        return [col.name for col in self.tables.get(table, [])]
+
+    def has_column(self, table: str, column: str) -> bool:
+        return column in self.column_names(table)
+
+    def prompt_for(self, tables) -> str:
+        """The prompt string restricted to the given tables, or the full one if none of them exist."""
+        known = [table for table in tables if table in self.tables]
+        if not known:
+            return self.prompt
+        return "\n\n".join(
+            f"Table: {table}\nColumns: {', '.join(self.column_names(table))}" for table in known
+        )
 
 
 class DatabaseManager:
-    def __init__(self, db_path: str = "all_data.db"):
->>>>>>> 69a94044205ec7ebdabb3d49af6431e7c830a426
-        self.db_path = db_path
-        self.engine = create_engine(f"sqlite:///{db_path}")
+    SAMPLE_VALUES_PER_COLUMN = 3
+    # Upper bounds on what one query may pull into memory
+    max_rows = int(os.getenv("SQL_MAX_ROWS", "500"))
+    max_bytes = int(os.getenv("SQL_MAX_BYTES", "1000000"))
+    # Guards against runaway generated SQL
+    timeout_seconds = float(os.getenv("SQL_TIMEOUT_SECONDS", "5"))
+    # A fixed scan limit; by default it is scan_factor times the largest table, with a floor for tiny databases
+    max_scan_rows: Optional[int] = int(os.environ["SQL_MAX_SCAN_ROWS"]) if os.getenv("SQL_MAX_SCAN_ROWS") else None
+    scan_factor = float(os.getenv("SQL_MAX_SCAN_FACTOR", "10"))
+    min_scan_rows = 100000
 
-    def get_schema(self) -> str:
-        """Retrieve the database schema and format it as a string."""
+    def __init__(self, db_path: Optional[str] = None, read_only: bool = True):
+        self.db_path = db_path or os.getenv("DB_PATH", "all_data.db")
+        self.engine = get_shared_engine(self.db_path, read_only=read_only)
+        self._schema: Optional[SchemaSnapshot] = None
+        self._schema_lock = threading.Lock()
+        self._row_estimates: Dict[str, int] = {}
+        self._row_estimates_version = None
+        self.query_log = QueryLog.from_env()
+
+    def data_version(self) -> Tuple[Optional[int], Optional[float]]:
+        """Return (PRAGMA schema_version, file mtime); either changes when the schema or data might have."""
+        mtime = None
+        # In WAL mode writes land in the -wal file until a checkpoint, so watch both
+        for path in (self.db_path, f"{self.db_path}-wal"):
+            try:
+                mtime = max(mtime or 0.0, os.path.getmtime(path))
+            except OSError:
+                pass
+        with self.engine.connect() as connection:
+            schema_version = connection.execute(text("PRAGMA schema_version")).scalar()
+        return schema_version, mtime
+
+    def _load_schema(self, version: Tuple[Optional[int], Optional[float]]) -> SchemaSnapshot:
+        inspector = inspect(self.engine)
+        tables = {}
+        schema = []
+        with self.engine.connect() as connection:
+            for table in inspector.get_table_names():
+                columns = []
+                for col in inspector.get_columns(table):
+                    rows = connection.execute(text(
+                        f"SELECT DISTINCT `{col['name']}` FROM `{table}` "
+                        f"WHERE `{col['name']}` IS NOT NULL LIMIT {self.SAMPLE_VALUES_PER_COLUMN}"
+                    ))
+                    columns.append(ColumnInfo(
+                        name=col['name'],
+                        type=str(col['type']),
+                        sample_values=[str(row[0]) for row in rows],
+                    ))
+                tables[table] = columns
+                schema.append(f"Table: {table}\nColumns: {', '.join(col.name for col in columns)}")
+        return SchemaSnapshot(tables=tables, version=version, prompt="\n\n".join(schema))
+
+    def get_schema_snapshot(self) -> SchemaSnapshot:
+        """Return the cached schema, re-introspecting only if the database has changed."""
         try:
-<<<<<<< HEAD
-            db= SQLDatabase(engine=self.engine)
-            tables = db.get_usable_table_names()
-            return tables
-=======
-            inspector = inspect(self.engine)
-            tables = inspector.get_table_names()
-            schema = []
-            for table in tables:
-                columns = inspector.get_columns(table)
-                column_names = [col['name'] for col in columns]
-                schema.append(f"Table: {table}\nColumns: {', '.join(column_names)}")
-            return "\n\n".join(schema)
->>>>>>> 69a94044205ec7ebdabb3d49af6431e7c830a426
+            version = self.data_version()
+            snapshot = self._schema
+            if snapshot is not None and snapshot.version == version:
+                return snapshot
+            with self._schema_lock:
+                if self._schema is None or self._schema.version != version:
+                    self._schema = self._load_schema(version)
+                return self._schema
         except Exception as e:
             raise Exception(f"Error fetching schema: {str(e)}")
+
+    def invalidate_schema(self) -> None:
+        """Force the next get_schema call to re-introspect the database."""
+        with self._schema_lock:
+            self._schema = None
+
+    def get_schema(self) -> str:
+        """Retrieve the database schema and format it as a string."""
+        return self.get_schema_snapshot().prompt
         
-    def execute_query(self, query: str) -> List[Any]:
-        """Execute an SQL query on the database and return results."""
+    def execute_query(self, query: str, params: Optional[Dict[str, Any]] = None, max_rows: Optional[int] = None) -> List[Any]:
+        """
+        Execute an SQL query on the database and return all its rows.
+
+        Runs through stream_query, so it has the same time limit. A result
+        longer than max_rows (default max_rows) raises QueryRejected
+        instead of being loaded whole.
+        """
+        max_rows = max_rows if max_rows is not None else self.max_rows
+        with tracer.span("db.execute_query") as span:
+            rows = []
+            for batch in self.stream_query(query, params=params):
+                rows.extend(batch)
+                if len(rows) > max_rows:
+                    raise QueryRejected("rows", f"Query returned more than {max_rows:,} rows. Add a LIMIT or selective WHERE conditions.")
+            span.attributes["rows"] = len(rows)
+            return rows
+
+    def _table_rows(self, table: str) -> int:
+        """Approximate row count of a table (MAX(rowid)), cached until the data changes."""
+        version = self.data_version()
+        if self._row_estimates_version != version:
+            self._row_estimates = {}
+            self._row_estimates_version = version
+        if table not in self._row_estimates:
+            try:
+                with self.engine.connect() as connection:
+                    rows = connection.execute(text(f"SELECT MAX(rowid) FROM `{table}`")).scalar()
+            except Exception:
+                rows = 0  # views and virtual tables have no rowid
+            self._row_estimates[table] = rows or 0
+        return self._row_estimates[table]
+
+    def scan_limit(self) -> int:
+        """Most rows a query may scan: max_scan_rows if set, else scan_factor times the largest table."""
+        if self.max_scan_rows is not None:
+            return self.max_scan_rows
+        largest = max((self._table_rows(table) for table in self.get_schema_snapshot().table_names()), default=0)
+        return max(int(largest * self.scan_factor), self.min_scan_rows)
+
+    def estimate_scan_rows(self, query: str, params: Optional[Dict[str, Any]] = None) -> Tuple[int, List[str]]:
+        """
+        Estimate how many rows a query will scan from its EXPLAIN QUERY PLAN.
+
+        Tables scanned without an index in the same loop nest multiply (a
+        cartesian or unindexed join), while scans inside subqueries add.
+        Returns the estimate and the plan lines that are full scans.
+        """
+        with self.engine.connect() as connection:
+            plan = connection.execute(text(f"EXPLAIN QUERY PLAN {query}"), params or {}).fetchall()
+        # The plan names aliased tables by their alias
+        tables = {}
+        for table, alias in _TABLE_REFERENCE.findall(query):
+            tables[table] = table
+            if alias and alias.upper() not in _SQL_KEYWORDS:
+                tables[alias] = table
+        loops: Dict[int, int] = {}
+        scans = []
+        for node_id, parent, _, detail in plan:
+            match = re.match(r"SCAN (?:TABLE )?`?(\w+)`?", detail)
+            if not match or "USING INDEX" in detail or "USING COVERING INDEX" in detail or "USING INTEGER PRIMARY KEY" in detail:
+                continue
+            scans.append(detail)
+            table = tables.get(match.group(1), match.group(1))
+            loops[parent] = loops.get(parent, 1) * max(self._table_rows(table), 1)
+        return sum(loops.values()), scans
+
+    def check_query_cost(self, query: str, params: Optional[Dict[str, Any]] = None) -> List[str]:
+        """Raise QueryRejected if the plan would scan more than scan_limit() rows; else return its full scans."""
+        estimate, scans = self.estimate_scan_rows(query, params)
+        limit = self.scan_limit()
+        if estimate > limit:
+            raise QueryRejected(
+                "cost",
+                f"Query would scan about {estimate:,} rows (limit {limit:,}). "
+                f"Full scans: {'; '.join(scans)}. Add selective WHERE conditions, join on keys or avoid leading-wildcard LIKE.",
+            )
+        return scans
+
+    def stream_query(self, query: str, batch_size: int = FETCH_BATCH_SIZE, timeout: Optional[float] = None,
+                     params: Optional[Dict[str, Any]] = None) -> Iterator[List[Any]]:
+        """
+        Execute an SQL query, with its bound params, and yield its rows in fetchmany batches.
+
+        The whole execution, including fetching, is limited to timeout
+        seconds (default timeout_seconds) through SQLite's progress handler,
+        which aborts the statement once the deadline passes.
+        """
+        limit = timeout if timeout is not None else self.timeout_seconds
+        deadline = time.monotonic() + limit
         try:
             with self.engine.connect() as connection:
-                result = connection.execute(text(query))
-                return [row for row in result]
+                dbapi_connection = connection.connection.dbapi_connection
+                dbapi_connection.set_progress_handler(lambda: int(time.monotonic() > deadline), 1000)
+                try:
+                    result = connection.execution_options(stream_results=True).execute(text(query), params or {})
+                    while True:
+                        batch = result.fetchmany(batch_size)
+                        if not batch:
+                            break
+                        yield batch
+                finally:
+                    dbapi_connection.set_progress_handler(None, 0)
         except Exception as e:
+            if "interrupted" in str(e) and time.monotonic() > deadline:
+                raise QueryRejected("timeout", f"Query did not finish within {limit:g} seconds. Simplify it or add selective WHERE conditions.")
             raise Exception(f"Error executing query: {str(e)}")
-<<<<<<< HEAD
 
-db_manager= DatabaseManager()
-print(db_manager.get_schema())
-=======
+    def fetch_bounded(self, query: str, max_rows: Optional[int] = None, max_bytes: Optional[int] = None,
+                      params: Optional[Dict[str, Any]] = None) -> Tuple[List[Any], bool]:
+        """
+        Execute an SQL query, keeping at most max_rows rows and roughly max_bytes of data.
+
+        Rows are read in batches and the cursor is closed as soon as a cap is
+        reached, so memory stays bounded whatever the query selects. The plan
+        is checked with check_query_cost first and execution is time-limited,
+        either of which raises QueryRejected. ``params`` are bound to the
+        query's :name placeholders. Returns the rows and whether the result
+        was truncated.
+        """
+        with tracer.span("db.fetch_bounded") as span:
+            max_rows = max_rows if max_rows is not None else self.max_rows
+            max_bytes = max_bytes if max_bytes is not None else self.max_bytes
+            full_scans = self.check_query_cost(query, params)
+            started = time.perf_counter()
+            rows, size, truncated = [], 0, False
+            for batch in self.stream_query(query, batch_size=min(FETCH_BATCH_SIZE, max_rows + 1), params=params):
+                for row in batch:
+                    size += sum(len(str(value)) for value in row)
+                    if len(rows) >= max_rows or size > max_bytes:
+                        truncated = True
+                        break
+                    rows.append(row)
+                if truncated:
+                    break
+            if self.query_log is not None:
+                self.query_log.record(query, time.perf_counter() - started, full_scans)
+            span.attributes.update(rows=len(rows), truncated=truncated, full_scans=len(full_scans))
+        return rows, truncated
         
         
     def get_engine(self) -> Engine:
@@ -66,4 +374,3 @@ if __name__=="__main__":
         print(db_manager.get_schema())
     except Exception as e:
         print(e)
->>>>>>> 69a94044205ec7ebdabb3d49af6431e7c830a426
@@ -0,0 +1,107 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict
+
+
+class MessageDedupStore:
+    """
+    Bounded in-memory record of WhatsApp message ids seen recently.
+
+    Meta redelivers a webhook when it is not acknowledged fast enough; the
+    redelivery carries the same messages[0].id. Ids are kept for ``ttl``
+    seconds and at most ``max_entries`` are held, oldest evicted first.
+    """
+
+    def __init__(self, ttl: float = 86400, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.suppressed = 0
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check_and_mark(self, message_id: str) -> bool:
+        """Record message_id and return True if it was already seen within the TTL."""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if message_id in self._seen:
+                self.suppressed += 1
+                return True
+            self._seen[message_id] = now
+            if len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+            return False
+
+    def _expire(self, now: float) -> None:
+        while self._seen:
+            oldest_id, seen_at = next(iter(self._seen.items()))
+            if now - seen_at < self.ttl:
+                break
+            del self._seen[oldest_id]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._seen)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"backend": "memory", "entries": len(self), "suppressed_duplicates": self.suppressed}
+
+
+class SQLiteDedupStore(MessageDedupStore):
+    """
+    SQLite-backed variant for deployments running several worker processes.
+
+    The insert is the check: the primary key makes a second insert of the
+    same id fail, so two processes cannot both claim a message.
+    """
+
+    def __init__(self, db_path: str = "dedup.db", ttl: float = 86400, max_entries: int = 100000):
+        super().__init__(ttl=ttl, max_entries=max_entries)
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS seen_messages (message_id TEXT PRIMARY KEY, seen_at REAL NOT NULL)"
+        )
+        self._connection().execute("CREATE INDEX IF NOT EXISTS seen_messages_seen_at ON seen_messages (seen_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def check_and_mark(self, message_id: str) -> bool:
+        now = time.time()
+        connection = self._connection()
+        connection.execute("DELETE FROM seen_messages WHERE seen_at < ?", (now - self.ttl,))
+        try:
+            connection.execute("INSERT INTO seen_messages (message_id, seen_at) VALUES (?, ?)", (message_id, now))
+        except sqlite3.IntegrityError:
+            with self._lock:
+                self.suppressed += 1
+            return True
+        connection.execute(
+            "DELETE FROM seen_messages WHERE message_id IN ("
+            "SELECT message_id FROM seen_messages ORDER BY seen_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        return False
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM seen_messages").fetchone()[0]
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"backend": "sqlite", "entries": len(self), "suppressed_duplicates": self.suppressed}
+
+
+def create_dedup_store(backend: str, ttl: float, max_entries: int, db_path: str) -> MessageDedupStore:
+    """Build the dedup store selected by the DEDUP_BACKEND setting."""
+    if backend == "sqlite":
+        return SQLiteDedupStore(db_path=db_path, ttl=ttl, max_entries=max_entries)
+    if backend == "memory":
+        return MessageDedupStore(ttl=ttl, max_entries=max_entries)
+    raise ValueError(f"Unknown dedup backend: {backend}")
@@ -0,0 +1,200 @@
+"""
+Index advisor for the restaurant database.
+
+Reads the queries recorded in the query log (see QueryLog), looks at
+their plans and proposes indexes for the columns they filter, sort and
+aggregate on. With --apply the indexes are created, and the logged
+queries are replayed before and after to report the latency change.
+Text columns searched with a leading-wildcard LIKE are reported as FTS5
+advice only: an FTS5 table needs sync triggers on its content table and
+queries rewritten to MATCH, and generate_sql writes LIKE, so creating one
+would only add write cost. Prepared statements from the SQL template
+library are planned and replayed with a representative noun index value
+of the matching column bound to each :name placeholder.
+
+Usage (from the repository root):
+    python -m app.services.IndexAdvisor --db all_data.db --log query_log.db [--apply]
+"""
+import argparse
+import re
+import statistics
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.services.DatabaseManager import DatabaseManager
+from app.services.NounIndex import NounIndex
+from app.services.QueryLog import QueryLog
+from app.services.SQLTemplates import CONSTANT_LITERALS, slot_name
+
+_TABLES = re.compile(r"(?:\bFROM|\bJOIN)\s+`?(\w+)`?", re.IGNORECASE)
+_EQUALITY = re.compile(r"`?(\w+)`?\s*(?:=|\bIN\b|\bIS\b)(?!\s*\(\s*SELECT)", re.IGNORECASE)
+_RANGE = re.compile(r"`?(\w+)`?\s*(?:<=|>=|<|>|\bBETWEEN\b)", re.IGNORECASE)
+_PREFIX_LIKE = re.compile(r"`?(\w+)`?\s+LIKE\s+'[^%_']", re.IGNORECASE)
+_WILDCARD_LIKE = re.compile(r"`?(\w+)`?\s+LIKE\s+'%", re.IGNORECASE)
+_MIN_MAX = re.compile(r"\b(?:MIN|MAX)\s*\(\s*`?(\w+)`?\s*\)", re.IGNORECASE)
+_ORDER_BY = re.compile(r"\bORDER\s+BY\s+(.+?)(?:\bLIMIT\b|\)|$)", re.IGNORECASE | re.DOTALL)
+_SELECT_LIST = re.compile(r"^\s*SELECT\s+(?:DISTINCT\s+)?(.+?)\s+FROM\b", re.IGNORECASE | re.DOTALL)
+_BIND = re.compile(r"(?<![:\w]):(\w+)")
+
+
+@dataclass
+class Suggestion:
+    table: str
+    columns: Tuple[str, ...]
+    kind: str = "index"  # "index" or "fts5" (advice only)
+    queries: List[str] = field(default_factory=list)
+    runs: int = 0
+
+    @property
+    def name(self) -> str:
+        suffix = "fts" if self.kind == "fts5" else "idx"
+        return f"{self.table}_{'_'.join(self.columns)}_{suffix}"
+
+    def ddl(self) -> List[str]:
+        """Statements that create the suggestion; none for FTS5 advice."""
+        if self.kind == "fts5":
+            return []
+        columns = ", ".join(f'"{column}"' for column in self.columns)
+        return [f'CREATE INDEX IF NOT EXISTS "{self.name}" ON "{self.table}" ({columns})']
+
+    def advice(self) -> str:
+        columns = ", ".join(self.columns)
+        return (f"-- {self.table}({columns}) is searched with LIKE '%...'; an FTS5 table kept in sync by "
+                f"INSERT/UPDATE/DELETE triggers, queried with MATCH, would avoid the scan (not created)")
+
+
+class IndexAdvisor:
+    """Turns logged queries into index suggestions and FTS5 advice, and measures the indexes' effect."""
+
+    # Covering indexes only add selected columns while the index stays this narrow
+    max_index_columns = 5
+
+    def __init__(self, db_manager: DatabaseManager, query_log: QueryLog, noun_index: Optional[NounIndex] = None):
+        self.db_manager = db_manager
+        self.query_log = query_log
+        self.noun_index = noun_index if noun_index is not None else NounIndex(db_manager)
+
+    def _params(self, query: str) -> Dict[str, Optional[str]]:
+        """A representative value (the median indexed value) of the column each :name placeholder binds."""
+        tables = set(_TABLES.findall(query))
+        columns = sorted(self.noun_index.columns(), key=lambda key: key[0] not in tables)
+        params = {}
+        for name in _BIND.findall(query):
+            column = next((key for key in columns if slot_name(key[1]) == name), None)
+            values = [value for value in self.noun_index.values(*column) if value not in CONSTANT_LITERALS] if column else []
+            params[name] = values[len(values) // 2] if values else None
+        return params
+
+    def _columns_of(self, table: str, names) -> List[str]:
+        known = self.db_manager.get_schema_snapshot().column_names(table)
+        seen = []
+        for name in names:
+            if name in known and name not in seen:
+                seen.append(name)
+        return seen
+
+    def _index_for(self, query: str, table: str) -> Optional[Tuple[str, ...]]:
+        """Equality columns first, then one range/sort column, then selected columns to cover the query."""
+        equality = self._columns_of(table, _EQUALITY.findall(query) + _PREFIX_LIKE.findall(query))
+        order = _ORDER_BY.search(query)
+        sort_names = re.findall(r"`?(\w+)`?(?:\s+(?:ASC|DESC))?\s*(?:,|$)", order.group(1).strip()) if order else []
+        ranged = self._columns_of(table, sort_names + _MIN_MAX.findall(query) + _RANGE.findall(query))
+        key = equality + [column for column in ranged[:1] if column not in equality]
+        if not key:
+            return None
+        select = _SELECT_LIST.search(query)
+        selected = self._columns_of(table, re.findall(r"`?(\w+)`?", select.group(1))) if select else []
+        covering = key + [column for column in selected if column not in key]
+        return tuple(covering if len(covering) <= self.max_index_columns else key)
+
+    def suggest(self) -> List[Suggestion]:
+        """Suggestions for the logged queries, most frequently needed first."""
+        snapshot = self.db_manager.get_schema_snapshot()
+        suggestions: Dict[Tuple[str, str, Tuple[str, ...]], Suggestion] = {}
+
+        def add(table, columns, kind, query, runs):
+            suggestion = suggestions.setdefault((table, kind, columns), Suggestion(table, columns, kind))
+            suggestion.queries.append(query)
+            suggestion.runs += runs
+
+        for query, runs in self.query_log.queries():
+            params = self._params(query)
+            try:
+                _, scans = self.db_manager.estimate_scan_rows(query, params)
+                with self.db_manager.get_engine().connect() as connection:
+                    plan = " ".join(row[3] for row in connection.execute(text(f"EXPLAIN QUERY PLAN {query}"), params))
+            except Exception:
+                continue  # the schema changed since the query was logged
+            if not scans and "TEMP B-TREE" not in plan:
+                continue
+            for table in dict.fromkeys(_TABLES.findall(query)):
+                if table not in snapshot.tables:
+                    continue
+                columns = self._index_for(query, table)
+                if columns:
+                    add(table, columns, "index", query, runs)
+                text_columns = self._columns_of(table, _WILDCARD_LIKE.findall(query))
+                if text_columns:
+                    add(table, tuple(text_columns), "fts5", query, runs)
+        return sorted(suggestions.values(), key=lambda s: -s.runs)
+
+    def replay(self, queries: List[str], repeat: int = 5) -> Dict[str, float]:
+        """Median latency in seconds of each query over repeat runs."""
+        timings = {}
+        with self.db_manager.get_engine().connect() as connection:
+            for query in queries:
+                params = self._params(query)
+                samples = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    connection.execute(text(query), params).fetchall()
+                    samples.append(time.perf_counter() - started)
+                timings[query] = statistics.median(samples)
+        return timings
+
+    def apply(self, suggestions: List[Suggestion]) -> None:
+        """Create the suggested indexes (needs a writable DatabaseManager); FTS5 advice creates nothing."""
+        with self.db_manager.get_engine().begin() as connection:
+            for suggestion in suggestions:
+                for statement in suggestion.ddl():
+                    connection.execute(text(statement))
+        self.db_manager.invalidate_schema()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Suggest (and optionally create) indexes for logged queries.")
+    parser.add_argument("--db", default=None, help="database path (default: DB_PATH or all_data.db)")
+    parser.add_argument("--log", default="query_log.db", help="query log written by DatabaseManager")
+    parser.add_argument("--apply", action="store_true", help="create the suggestions and report before/after latency")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per query when replaying")
+    args = parser.parse_args()
+
+    advisor = IndexAdvisor(DatabaseManager(args.db, read_only=not args.apply), QueryLog(args.log))
+    suggestions = advisor.suggest()
+    if not suggestions:
+        print("No suggestions: the logged queries do not scan or sort without an index.")
+        return
+    for suggestion in suggestions:
+        print(f"-- {suggestion.kind} for {len(suggestion.queries)} queries run {suggestion.runs} times")
+        if suggestion.kind == "fts5":
+            print(suggestion.advice())
+        for statement in suggestion.ddl():
+            print(statement + ";")
+    if not args.apply:
+        return
+
+    queries = [query for query, _ in advisor.query_log.queries()]
+    before = advisor.replay(queries, args.repeat)
+    advisor.apply(suggestions)
+    after = advisor.replay(queries, args.repeat)
+    print("\nmedian latency before -> after")
+    for query in queries:
+        print(f"{before[query] * 1000:9.2f} ms -> {after[query] * 1000:9.2f} ms  {' '.join(query.split())[:90]}")
+    print(f"total: {sum(before.values()) * 1000:.2f} ms -> {sum(after.values()) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import logging
+import queue
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional
+
+
+class _Timing:
+    """Running count/total/max for one duration metric."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "avg_seconds": self.total / self.count if self.count else 0.0,
+            "max_seconds": self.max,
+        }
+
+
+class JobQueue:
+    """
+    In-process job queue that lets the webhook acknowledge Meta immediately.
+
+    Each job carries a key (the sender's wa_id). Jobs are routed to a worker
+    by hashing that key, so messages from the same user are handled one at a
+    time and in arrival order while different users are processed in
+    parallel. With ``workers=0`` jobs run inline on the calling thread.
+    """
+
+    def __init__(self, handler: Callable[[Any], None], workers: int = 4):
+        self.handler = handler
+        self.workers = workers
+        self._queues: List[queue.Queue] = [queue.Queue() for _ in range(workers)]
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._enqueued = 0
+        self._processed = 0
+        self._failed = 0
+        self._wait = _Timing()
+        self._processing = _Timing()
+
+    def start(self) -> None:
+        """Start the worker threads; calling it again is a no-op."""
+        with self._lock:
+            if self._threads:
+                return
+            for i, jobs in enumerate(self._queues):
+                thread = threading.Thread(target=self._work, args=(jobs,), name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Let the workers finish what is queued, then stop them."""
+        for jobs in self._queues:
+            jobs.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def enqueue(self, key: str, payload: Any) -> None:
+        """Queue a payload for processing; returns without waiting for it."""
+        with self._lock:
+            self._enqueued += 1
+        if not self.workers:
+            self._run(payload, time.monotonic())
+            return
+        index = zlib.crc32(key.encode("utf-8")) % self.workers
+        self._queues[index].put((payload, time.monotonic()))
+
+    def _work(self, jobs: queue.Queue) -> None:
+        while True:
+            job = jobs.get()
+            try:
+                if job is None:
+                    return
+                self._run(*job)
+            finally:
+                jobs.task_done()
+
+    def _run(self, payload: Any, enqueued_at: float) -> None:
+        started_at = time.monotonic()
+        try:
+            self.handler(payload)
+            failed = False
+        except Exception:
+            logging.exception("Background job failed")
+            failed = True
+        finished_at = time.monotonic()
+        with self._lock:
+            self._wait.observe(started_at - enqueued_at)
+            self._processing.observe(finished_at - started_at)
+            if failed:
+                self._failed += 1
+            else:
+                self._processed += 1
+
+    def depth(self) -> int:
+        return sum(jobs.qsize() for jobs in self._queues)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "depth": self.depth(),
+                "enqueued": self._enqueued,
+                "processed": self._processed,
+                "failed": self._failed,
+                "wait_time": self._wait.as_dict(),
+                "processing_time": self._processing.as_dict(),
+            }
@@ -1,12 +1,86 @@
+import asyncio
+import time
+from typing import List, Optional, Tuple
+
+from langchain_core.messages import BaseMessage
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
 
+from app.services.LLMMemo import LLMMemo
+from app.services.ModelRouter import ModelRouter, ModelUsage
+from app.services.PromptBudget import PromptTokenStats, count_tokens
+from app.services.Tracing import Span, tracer
+
+_DEFAULT = object()
+
+
 class LLMManager:
-    def __init__(self):
-        self.llm = ChatOpenAI(model="gpt-4o", temperature=0)
+    def __init__(self, model: str = "gpt-4o", memo: Optional[LLMMemo] = _DEFAULT, router: Optional[ModelRouter] = _DEFAULT):
+        self.model = model
+        self.llm = ChatOpenAI(model=model, temperature=0)
+        # Responses are deterministic at temperature 0, so repeated prompts are served from the memo
+        self.memo = LLMMemo.from_env() if memo is _DEFAULT else memo
+        # Per-stage model chains, small model first; None sends every stage to self.llm
+        self.router = ModelRouter.from_env(large_model=model) if router is _DEFAULT else router
+        self.prompt_tokens = PromptTokenStats()
+        self.usage = ModelUsage()
+
+    def route(self, stage: Optional[str]) -> List[str]:
+        """Models to try for stage, in escalation order."""
+        return self.router.route(stage) if self.router is not None else [self.model]
 
-    def invoke(self, prompt: ChatPromptTemplate, **kwargs) -> str:
+    def _client(self, model: str):
+        return self.router.client(model) if self.router is not None else self.llm
+
+    def _prepare(self, prompt: ChatPromptTemplate, stage: Optional[str], model: str, kwargs: dict, span: Span) -> Tuple[List[BaseMessage], Optional[str]]:
+        """Format the messages, record their size and return them with the memo key (if memoized)."""
         messages = prompt.format_messages(**kwargs)
-        response = self.llm.invoke(messages)
-        return response.content
-    
\ No newline at end of file
+        tokens = sum(count_tokens(str(m.content)) for m in messages)
+        self.prompt_tokens.record(stage, tokens)
+        span.attributes.update(model=model, prompt_tokens=tokens)
+        if self.memo is None or not self.memo.enabled_for(stage):
+            return messages, None
+        return messages, self.memo.make_key(model, messages)
+
+    def _record_usage(self, span: Span, stage: Optional[str], model: str, started: float, response) -> None:
+        usage = getattr(response, "usage_metadata", None) or {}
+        if usage.get("input_tokens"):
+            span.attributes["prompt_tokens"] = usage["input_tokens"]
+        span.attributes["completion_tokens"] = usage.get("output_tokens") or count_tokens(str(response.content))
+        self.usage.record(
+            stage, model, time.perf_counter() - started,
+            span.attributes["prompt_tokens"], span.attributes["completion_tokens"],
+        )
+
+    def invoke(self, prompt: ChatPromptTemplate, stage: Optional[str] = None, model: Optional[str] = None, **kwargs) -> str:
+        model = model or self.route(stage)[0]
+        with tracer.span(f"llm.{stage or 'unknown'}") as span:
+            messages, key = self._prepare(prompt, stage, model, kwargs, span)
+            if key is not None:
+                cached = self.memo.get(key, stage)
+                span.attributes["memo_hit"] = cached is not None
+                if cached is not None:
+                    return cached
+            started = time.perf_counter()
+            response = self._client(model).invoke(messages)
+            self._record_usage(span, stage, model, started, response)
+            if key is not None:
+                self.memo.put(key, response.content, model, stage)
+            return response.content
+
+    async def ainvoke(self, prompt: ChatPromptTemplate, stage: Optional[str] = None, model: Optional[str] = None, **kwargs) -> str:
+        model = model or self.route(stage)[0]
+        with tracer.span(f"llm.{stage or 'unknown'}") as span:
+            messages, key = self._prepare(prompt, stage, model, kwargs, span)
+            # The memo is SQLite: keep its reads, writes and eviction off the event loop
+            if key is not None:
+                cached = await asyncio.to_thread(self.memo.get, key, stage)
+                span.attributes["memo_hit"] = cached is not None
+                if cached is not None:
+                    return cached
+            started = time.perf_counter()
+            response = await self._client(model).ainvoke(messages)
+            self._record_usage(span, stage, model, started, response)
+            if key is not None:
+                await asyncio.to_thread(self.memo.put, key, response.content, model, stage)
+            return response.content
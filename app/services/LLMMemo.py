@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+
+
+class LLMMemo:
+    """
+    Persistent memo of LLM responses, stored in SQLite.
+
+    The LLM runs at temperature 0, so the same model and the same formatted
+    messages give the same answer. Entries are keyed on a hash of both. At
+    most ``max_entries`` rows are kept and the least recently used go
+    first. Stages listed in ``disabled_stages`` always go to the model.
+    """
+
+    def __init__(self, db_path: str = "llm_memo.db", max_entries: int = 5000,
+                 disabled_stages: Iterable[str] = (), offline: bool = False):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.disabled_stages = set(disabled_stages)
+        self.offline = offline
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits: Counter = Counter()
+        self.misses: Counter = Counter()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS llm_memo ("
+            "key TEXT PRIMARY KEY, model TEXT, stage TEXT, response TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._connection().execute("CREATE INDEX IF NOT EXISTS llm_memo_last_used ON llm_memo (last_used)")
+
+    @classmethod
+    def from_env(cls) -> Optional["LLMMemo"]:
+        """Build the memo from LLM_MEMO_* settings; an empty LLM_MEMO_PATH disables it."""
+        db_path = os.getenv("LLM_MEMO_PATH", "llm_memo.db")
+        if not db_path:
+            return None
+        disabled = [stage.strip() for stage in os.getenv("LLM_MEMO_DISABLED_STAGES", "").split(",") if stage.strip()]
+        return cls(
+            db_path=db_path,
+            max_entries=int(os.getenv("LLM_MEMO_MAX_ENTRIES", "5000")),
+            disabled_stages=disabled,
+            offline=os.getenv("LLM_MEMO_OFFLINE", "") == "1",
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def enabled_for(self, stage: Optional[str]) -> bool:
+        return stage not in self.disabled_stages
+
+    @staticmethod
+    def make_key(model: str, messages: List[Any]) -> str:
+        payload = json.dumps([model, [(m.type, m.content) for m in messages]], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, stage: Optional[str] = None) -> Optional[str]:
+        connection = self._connection()
+        row = connection.execute("SELECT response FROM llm_memo WHERE key = ?", (key,)).fetchone()
+        with self._lock:
+            (self.hits if row else self.misses)[stage or "unknown"] += 1
+        if row is None:
+            if self.offline:
+                raise LookupError(f"No memoized response for stage {stage} and LLM_MEMO_OFFLINE is set")
+            return None
+        connection.execute("UPDATE llm_memo SET last_used = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key: str, response: str, model: str, stage: Optional[str] = None) -> None:
+        now = time.time()
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO llm_memo (key, model, stage, response, created_at, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, model, stage, response, now, now),
+        )
+        connection.execute(
+            "DELETE FROM llm_memo WHERE key IN ("
+            "SELECT key FROM llm_memo ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def clear(self) -> None:
+        self._connection().execute("DELETE FROM llm_memo")
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = set(self.hits) | set(self.misses)
+            per_stage = {
+                stage: {
+                    "hits": self.hits[stage],
+                    "misses": self.misses[stage],
+                    "hit_rate": self.hits[stage] / (self.hits[stage] + self.misses[stage]),
+                }
+                for stage in stages
+            }
+            hits, misses = sum(self.hits.values()), sum(self.misses.values())
+        return {
+            "entries": self._connection().execute("SELECT COUNT(*) FROM llm_memo").fetchone()[0],
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "stages": per_stage,
+        }
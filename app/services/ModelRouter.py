@@ -0,0 +1,156 @@
+import os
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.services.Tracing import LatencyHistogram
+
+# USD per million (prompt, completion) tokens; models not listed here (e.g. local ones) are counted as free
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+# Escalation chain per stage, first model first. "small" and "large" stand for
+# LLM_SMALL_MODEL and LLM_LARGE_MODEL; stages not listed use the large model.
+DEFAULT_ROUTES: Dict[str, List[str]] = {
+    "parse_question": ["small", "large"],
+    "plan_sql": ["small", "large"],
+    "generate_sql": ["small", "large"],
+    "validate_and_fix_sql": ["large"],
+    "compose_answer": ["small", "large"],
+}
+
+# Models named "local:<name>" are served by the OpenAI-compatible endpoint at LLM_LOCAL_BASE_URL
+LOCAL_PREFIX = "local:"
+
+
+def parse_routes(value: str) -> Dict[str, List[str]]:
+    """Parse LLM_ROUTES, e.g. "compose_answer=local:llama3.1>large,generate_sql=large"."""
+    routes = {}
+    for entry in value.split(","):
+        if "=" in entry:
+            stage, chain = entry.split("=", 1)
+            routes[stage.strip()] = [model.strip() for model in chain.split(">") if model.strip()]
+    return routes
+
+
+class ModelRouter:
+    """
+    Picks the chat models each SQLAgent stage may use, cheapest first.
+
+    SQLAgent sends a stage to the first model of its chain and moves on to
+    the next one when the response does not parse, when the stage judges
+    it low confidence (e.g. a plan that fails its own check) or, for
+    generate_sql, when the previous query failed in the database. Models
+    named "local:<name>" go to the OpenAI-compatible server at
+    ``local_base_url`` (vLLM, Ollama, a llama.cpp server or
+    benchmarks/stub_llm_api.py), so a self-hosted model can take the small
+    slot. ``client_factory`` builds the chat model for a name and can be
+    replaced to plug in another client.
+    """
+
+    def __init__(
+        self,
+        routes: Optional[Dict[str, List[str]]] = None,
+        small_model: str = "gpt-4o-mini",
+        large_model: str = "gpt-4o",
+        local_base_url: Optional[str] = None,
+        local_api_key: str = "local",
+        client_factory: Optional[Callable[[str], Any]] = None,
+    ):
+        aliases = {"small": small_model, "large": large_model}
+        self.large_model = large_model
+        self.routes = {
+            stage: [aliases.get(model, model) for model in chain]
+            for stage, chain in (DEFAULT_ROUTES if routes is None else routes).items()
+        }
+        self.local_base_url = local_base_url
+        self.local_api_key = local_api_key
+        self.client_factory = client_factory or self._openai_client
+        self._clients: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, large_model: str = "gpt-4o") -> Optional["ModelRouter"]:
+        """Build the router from LLM_* settings; LLM_ROUTING=0 disables it (every stage uses large_model)."""
+        if os.getenv("LLM_ROUTING", "1") == "0":
+            return None
+        routes = dict(DEFAULT_ROUTES)
+        routes.update(parse_routes(os.getenv("LLM_ROUTES", "")))
+        return cls(
+            routes=routes,
+            small_model=os.getenv("LLM_SMALL_MODEL", "gpt-4o-mini"),
+            large_model=os.getenv("LLM_LARGE_MODEL", large_model),
+            local_base_url=os.getenv("LLM_LOCAL_BASE_URL") or None,
+            local_api_key=os.getenv("LLM_LOCAL_API_KEY", "local"),
+        )
+
+    def route(self, stage: Optional[str]) -> List[str]:
+        """The models to try for stage, in escalation order."""
+        return self.routes.get(stage) or [self.large_model]
+
+    def client(self, model: str):
+        """The chat model for a model name, created on first use."""
+        with self._lock:
+            if model not in self._clients:
+                self._clients[model] = self.client_factory(model)
+            return self._clients[model]
+
+    def _openai_client(self, model: str):
+        from langchain_openai import ChatOpenAI
+        if not model.startswith(LOCAL_PREFIX):
+            return ChatOpenAI(model=model, temperature=0)
+        if not self.local_base_url:
+            raise ValueError(f"Model {model} needs LLM_LOCAL_BASE_URL to be set")
+        return ChatOpenAI(
+            model=model[len(LOCAL_PREFIX):], temperature=0, base_url=self.local_base_url, api_key=self.local_api_key
+        )
+
+
+class ModelUsage:
+    """Calls, latency, tokens and cost per stage and model, plus why stages escalated."""
+
+    def __init__(self, prices: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.prices = dict(MODEL_PRICES if prices is None else prices)
+        self._latency: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self._tokens: Dict[Tuple[str, str], Counter] = defaultdict(Counter)
+        self._escalations: Dict[str, Counter] = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        prompt_price, completion_price = self.prices.get(model, (0.0, 0.0))
+        return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+
+    def record(self, stage: Optional[str], model: str, seconds: float, prompt_tokens: int, completion_tokens: int) -> None:
+        key = (stage or "unknown", model)
+        with self._lock:
+            histogram = self._latency.get(key)
+            if histogram is None:
+                histogram = self._latency[key] = LatencyHistogram()
+            histogram.observe(seconds)
+            self._tokens[key].update(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def escalated(self, stage: str, reason: str) -> None:
+        with self._lock:
+            self._escalations[stage][reason] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            stages: Dict[str, Any] = {}
+            total = 0.0
+            for (stage, model), histogram in sorted(self._latency.items()):
+                tokens = self._tokens[(stage, model)]
+                cost = self.cost(model, tokens["prompt_tokens"], tokens["completion_tokens"])
+                total += cost
+                latency = histogram.as_dict()
+                stages.setdefault(stage, {"models": {}, "escalations": dict(self._escalations.get(stage, {}))})
+                stages[stage]["models"][model] = {
+                    "calls": latency["count"],
+                    "p50_ms": latency["p50_ms"],
+                    "p95_ms": latency["p95_ms"],
+                    "prompt_tokens": tokens["prompt_tokens"],
+                    "completion_tokens": tokens["completion_tokens"],
+                    "cost_usd": round(cost, 6),
+                }
+        return {"stages": stages, "total_cost_usd": round(total, 6)}
@@ -0,0 +1,201 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+
+def trigrams(value: str) -> Set[str]:
+    """Character trigrams of each word in value, padded so short words still count."""
+    grams = set()
+    for word in re.findall(r"\w+", value.lower()):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class _Column:
+    """Distinct values of one column and the trigram postings that find them."""
+
+    def __init__(self, max_postings: int):
+        self.max_postings = max_postings
+        self.values: Set[str] = set()
+        self.postings: Dict[str, List[str]] = defaultdict(list)
+        self.gram_counts: Dict[str, int] = {}
+
+    def add(self, value: str) -> None:
+        self.values.add(value)
+        grams = trigrams(value)
+        self.gram_counts[value] = len(grams)
+        for gram in grams:
+            posting = self.postings[gram]
+            if len(posting) < self.max_postings:
+                posting.append(value)
+
+    def scores(self, grams: Set[str]) -> Dict[str, float]:
+        """Share of each value's trigrams found in grams, for the values that share any."""
+        matched: Dict[str, int] = defaultdict(int)
+        for gram in grams:
+            for value in self.postings.get(gram, ()):
+                matched[value] += 1
+        return {value: count / self.gram_counts[value] for value, count in matched.items()}
+
+
+class _Entries:
+    """One build of the index; never changed once NounIndex publishes it, so readers need no lock."""
+
+    def __init__(self, max_value_length: int, max_values: int, max_postings: int):
+        self.max_value_length = max_value_length
+        self.max_values = max_values
+        self.max_postings = max_postings
+        self.columns: Dict[Tuple[str, str], _Column] = {}
+        self.words: Set[str] = set()
+
+    def load(self, connection, table: str, columns: List[str]) -> None:
+        for column in columns:
+            # LIMIT keeps the read bounded: SQLite stops once it has seen one value too many
+            rows = connection.execute(text(
+                f"SELECT DISTINCT `{column}` FROM `{table}` WHERE `{column}` IS NOT NULL LIMIT :limit"
+            ), {"limit": self.max_values + 1}).fetchall()
+            if len(rows) > self.max_values:
+                logging.info(f"Noun index skips {table}.{column}: more than {self.max_values} distinct values")
+                continue
+            values = {str(value).strip() for (value,) in rows}
+            values = {value for value in values if value and len(value) <= self.max_value_length and "://" not in value}
+            if not values:
+                continue
+            entry = self.columns[(table, column)] = _Column(self.max_postings)
+            for value in values:
+                entry.add(value)
+                self.words.update(re.findall(r"\w+", value.lower()))
+
+
+class NounIndex:
+    """
+    Precomputed distinct values of the text columns, searchable by trigram.
+
+    Replaces the per-message SELECT DISTINCT in SQLAgent.get_unique_nouns.
+    Each (table, column) has its own trigram postings and a lookup scores
+    only the columns it asks for. Columns with more than ``max_values``
+    distinct values (names, addresses) are near-unique per row and are not
+    indexed, and each posting list keeps at most ``max_postings`` values,
+    so neither the memory held nor the cost of a lookup grows with the
+    table. Values longer than ``max_value_length`` (reviews, descriptions)
+    are not treated as nouns.
+
+    The index is rebuilt whenever DatabaseManager.data_version() changes:
+    the file's mtime cannot tell an append from an UPDATE or DELETE, and
+    reading only new rowids would keep stale values. A rebuild fills a new
+    set of entries and swaps it in with one assignment, so lookups never
+    see a half-built index and keep using the previous one while another
+    thread rebuilds. data_version() costs a connection checkout and file
+    stats, so reads check it at most once per ``refresh_interval`` seconds.
+    """
+
+    def __init__(self, db_manager, top_k: Optional[int] = None, max_value_length: int = 80, min_score: float = 0.6,
+                 max_values: Optional[int] = None, max_postings: int = 2000, refresh_interval: Optional[float] = None):
+        self.db_manager = db_manager
+        self.top_k = top_k if top_k is not None else int(os.getenv("NOUN_INDEX_TOP_K", "20"))
+        self.max_value_length = max_value_length
+        self.min_score = min_score
+        self.max_values = max_values if max_values is not None else int(os.getenv("NOUN_INDEX_MAX_VALUES", "5000"))
+        self.max_postings = max_postings
+        self.refresh_interval = (refresh_interval if refresh_interval is not None
+                                 else float(os.getenv("NOUN_INDEX_REFRESH_SECONDS", "1")))
+        self._entries: Optional[_Entries] = None
+        self._data_version = None
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()  # held by the thread rebuilding
+
+    def _text_columns(self, snapshot) -> Dict[str, List[str]]:
+        return {
+            table: [col.name for col in columns if "CHAR" in col.type.upper() or "TEXT" in col.type.upper()]
+            for table, columns in snapshot.tables.items()
+        }
+
+    def refresh(self) -> None:
+        """Bring the index up to date with the database; a no-op if nothing changed."""
+        self._current(force=True)
+
+    def _current(self, force: bool = False) -> _Entries:
+        """The entries to read: rebuilt first if the data changed, unless another thread is already rebuilding."""
+        entries = self._entries
+        now = time.monotonic()
+        if entries is not None and not force and now - self._checked_at < self.refresh_interval:
+            return entries
+        self._checked_at = now
+        data_version = self.db_manager.data_version()
+        if data_version == self._data_version and entries is not None:
+            return entries
+        if not self._lock.acquire(blocking=entries is None):
+            return entries
+        try:
+            if data_version == self._data_version and self._entries is not None:
+                return self._entries
+            entries = _Entries(self.max_value_length, self.max_values, self.max_postings)
+            snapshot = self.db_manager.get_schema_snapshot()
+            with self.db_manager.get_engine().connect() as connection:
+                for table, columns in self._text_columns(snapshot).items():
+                    entries.load(connection, table, columns)
+            self._entries, self._data_version = entries, data_version
+            return entries
+        finally:
+            self._lock.release()
+
+    def contains_word(self, word: str) -> bool:
+        """True if word appears in any indexed value, e.g. a city or cuisine name."""
+        return word.lower() in self._current().words
+
+    def words(self) -> Set[str]:
+        """Lowercased words of every indexed value; a snapshot that is replaced, never mutated, on refresh."""
+        return self._current().words
+
+    def columns(self) -> List[Tuple[str, str]]:
+        """Every (table, column) pair the index holds values for."""
+        return list(self._current().columns)
+
+    def lookup(self, question: str, columns: Iterable[Tuple[str, str]], top_k: Optional[int] = None) -> List[str]:
+        """
+        Return indexed values from the given (table, column) pairs that the question mentions.
+
+        A value scores by the share of its trigrams found in the question, so
+        "restaurants in madrid" pulls in "Madrid" regardless of case or
+        punctuation. At most top_k values at or above min_score are
+        returned, best first.
+        """
+        scores: Dict[str, float] = {}
+        for (_, _, value), score in self._scores(question, columns).items():
+            scores[value] = max(scores.get(value, 0.0), score)
+        ranked = sorted((v for v, s in scores.items() if s >= self.min_score), key=lambda v: (-scores[v], v))
+        return ranked[:top_k if top_k is not None else self.top_k]
+
+    def _scores(self, question: str, columns: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str, str], float]:
+        entries = self._current()
+        grams = trigrams(question)
+        scores = {}
+        for key in dict.fromkeys(columns):
+            column = entries.columns.get(key)
+            if column is not None:
+                scores.update(((*key, value), score) for value, score in column.scores(grams).items())
+        return scores
+
+    def mentions(self, question: str, columns: Optional[Iterable[Tuple[str, str]]] = None) -> List[Tuple[str, str, str]]:
+        """
+        (table, column, value) for every indexed value of the given columns
+        (default all) the question contains as whole words, longest first.
+        """
+        lowered = question.lower()
+        found = [
+            entry for entry, score in self._scores(question, self.columns() if columns is None else columns).items()
+            if score >= 1.0 and re.search(rf"(?<!\w){re.escape(entry[2].lower())}(?!\w)", lowered)
+        ]
+        return sorted(found, key=lambda entry: (-len(entry[2]), entry))
+
+    def values(self, table: str, column: str) -> List[str]:
+        """The indexed values of one column."""
+        entry = self._current().columns.get((table, column))
+        return sorted(entry.values) if entry is not None else []
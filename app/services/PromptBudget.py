@@ -0,0 +1,124 @@
+import functools
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding():
+    """The GPT-4o tokenizer, or None if tiktoken or its encoding files are unavailable."""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken when available, else estimate four characters per token."""
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def truncate_text(text: str, max_tokens: int) -> str:
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = _encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens]) + " ..."
+    return text[:max_tokens * 4] + " ..."
+
+
+# Token budget for each section of each stage's prompt.
+DEFAULT_BUDGETS: Dict[str, Dict[str, int]] = {
+    "parse_question": {"schema": 2000},
+    "generate_sql": {"schema": 1500, "unique_nouns": 300, "conversation": 800},
+    "validate_and_fix_sql": {"schema": 1500},
+    "plan_sql": {"schema": 2000, "unique_nouns": 300, "conversation": 800},
+    "compose_answer": {"results": 1500},
+}
+
+
+class PromptBudget:
+    """
+    Keeps every interpolated prompt section within a per-stage token budget.
+
+    Text sections are cut at the budget, lists keep their first items that
+    fit, and result sets are sampled row by row with long cells clipped,
+    ending with a note on how many rows were left out.
+    """
+
+    def __init__(self, budgets: Optional[Dict[str, Dict[str, int]]] = None, max_cell_chars: int = 200):
+        self.budgets = {stage: dict(sections) for stage, sections in DEFAULT_BUDGETS.items()}
+        for stage, sections in (budgets or {}).items():
+            self.budgets.setdefault(stage, {}).update(sections)
+        self.max_cell_chars = max_cell_chars
+
+    def limit(self, stage: str, section: str) -> Optional[int]:
+        return self.budgets.get(stage, {}).get(section)
+
+    def fit_text(self, text: str, stage: str, section: str) -> str:
+        limit = self.limit(stage, section)
+        return text if limit is None else truncate_text(text, limit)
+
+    def fit_list(self, items: Iterable[Any], stage: str, section: str) -> List[Any]:
+        limit = self.limit(stage, section)
+        kept, used = [], 0
+        for item in items:
+            cost = count_tokens(repr(item)) + 1
+            if limit is not None and used + cost > limit:
+                break
+            kept.append(item)
+            used += cost
+        return kept
+
+    def _clip(self, value: Any) -> Any:
+        if isinstance(value, str) and len(value) > self.max_cell_chars:
+            return value[:self.max_cell_chars] + "..."
+        return value
+
+    def fit_rows(self, rows: Any, stage: str, section: str = "results", truncated: bool = False) -> Any:
+        """Render query results for a prompt, sampling rows and clipping cells to fit the budget.
+
+        truncated says the rows were already capped when fetched, so the
+        total is a lower bound.
+        """
+        if not isinstance(rows, list):
+            return rows
+        limit = self.limit(stage, section)
+        lines, used = [], 0
+        for row in rows:
+            line = repr(tuple(self._clip(value) for value in row))
+            cost = count_tokens(line) + 1
+            if limit is not None and used + cost > limit:
+                break
+            lines.append(line)
+            used += cost
+        rendered = "[" + ",\n".join(lines) + "]"
+        total = f"more than {len(rows)}" if truncated else str(len(rows))
+        if len(lines) < len(rows) or truncated:
+            rendered += f"\n(showing the first {len(lines)} of {total} rows)"
+        return rendered
+
+
+class PromptTokenStats:
+    """Per-stage prompt token counts, recorded by LLMManager for monitoring."""
+
+    def __init__(self):
+        self._stages: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: Optional[str], tokens: int) -> None:
+        with self._lock:
+            stats = self._stages.setdefault(stage or "unknown", {"calls": 0, "total": 0, "max": 0})
+            stats["calls"] += 1
+            stats["total"] += tokens
+            stats["max"] = max(stats["max"], tokens)
+
+    def metrics(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                stage: {**stats, "avg": stats["total"] / stats["calls"]}
+                for stage, stats in self._stages.items()
+            }
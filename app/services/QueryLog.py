@@ -0,0 +1,52 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+
+class QueryLog:
+    """
+    Log of the SQL the pipeline executed, with duration and full-scan plan lines.
+
+    Feeds the index advisor (python -m app.services.IndexAdvisor). Each
+    distinct query is one row that keeps a run count and the latest timing,
+    so the log stays as small as the set of distinct queries.
+    """
+
+    def __init__(self, db_path: str = "query_log.db"):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS query_log ("
+            "query TEXT PRIMARY KEY, runs INTEGER NOT NULL, last_seconds REAL NOT NULL, "
+            "full_scans TEXT, last_run REAL NOT NULL)"
+        )
+
+    @classmethod
+    def from_env(cls) -> Optional["QueryLog"]:
+        """Build the log from QUERY_LOG_PATH; an empty value disables logging."""
+        db_path = os.getenv("QUERY_LOG_PATH", "query_log.db")
+        return cls(db_path) if db_path else None
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def record(self, query: str, seconds: float, full_scans: List[str]) -> None:
+        self._connection().execute(
+            "INSERT INTO query_log (query, runs, last_seconds, full_scans, last_run) VALUES (?, 1, ?, ?, ?) "
+            "ON CONFLICT(query) DO UPDATE SET runs = runs + 1, last_seconds = excluded.last_seconds, "
+            "full_scans = excluded.full_scans, last_run = excluded.last_run",
+            (query, seconds, "; ".join(full_scans), time.time()),
+        )
+
+    def queries(self, limit: int = 500) -> List[Tuple[str, int]]:
+        """The most frequently run queries and their run counts."""
+        return self._connection().execute(
+            "SELECT query, runs FROM query_log ORDER BY runs DESC LIMIT ?", (limit,)
+        ).fetchall()
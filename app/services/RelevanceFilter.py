@@ -0,0 +1,193 @@
+import os
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Callable, Collection, Dict, List, Optional, Set, Tuple
+
+from app.services.AnswerCache import STOPWORDS, question_tokens
+from app.services.NounIndex import trigrams
+
+# Restaurant vocabulary beyond the schema, after question_tokens' synonym folding ("places" -> "restaurant")
+DOMAIN_WORDS = {
+    "restaurant", "best", "worst", "rating", "cheap", "expensive", "price", "cost", "budget", "euro",
+    "cuisine", "food", "dish", "menu", "meal", "dinner", "lunch", "breakfast", "brunch", "dine", "dining",
+    "hungry", "cafe", "bar", "bistro", "pizza", "pizzeria", "sushi", "tapa", "paella", "burger", "seafood",
+    "steak", "vegetarian", "gluten", "halal", "kosher", "dessert", "wine", "coffee", "review", "star",
+    "recommend", "recommendation", "suggest", "suggestion", "reservation", "book", "table", "open",
+    "near", "nearby", "close", "area", "neighborhood", "neighbourhood", "address", "location", "located",
+    "romantic", "terrace", "takeaway", "delivery", "spot", "michelin", "chef", "popular", "famous",
+    # comparatives that refine an earlier question ("and cheaper ones?")
+    "cheaper", "pricier", "better", "worse", "closer", "higher", "lower",
+}
+
+# Words that only come up in questions about something else; refusing a message takes more of these than domain evidence
+OFF_TOPIC_WORDS = {
+    "weather", "rain", "raining", "snow", "forecast", "temperature", "sunny",
+    "football", "soccer", "basketball", "tennis", "league", "championship",
+    "news", "president", "election", "politic", "politics", "government", "capital", "war",
+    "joke", "poem", "song", "sing", "lyric", "lyrics", "movie", "film", "music", "story", "riddle",
+    "password", "login", "account", "battery", "phone", "laptop", "computer", "email", "python", "code", "programming",
+    "flight", "airport", "taxi", "uber", "train", "hotel", "visa",
+    "math", "calculate", "equation", "homework", "translate", "translation",
+    "bored", "color", "colour", "horoscope", "stock", "bitcoin",
+}
+
+# Whole phrases that carry no question; a message made only of these (plus filler) gets a template reply
+SMALL_TALK_PHRASES: Dict[str, Tuple[str, ...]] = {
+    "greeting": (
+        "hi", "hello", "hey", "hiya", "hola", "buenas", "buenos dias", "good morning", "good afternoon",
+        "good evening", "greetings", "yo", "how are you", "how are you doing", "hows it going", "whats up", "sup",
+    ),
+    "thanks": (
+        "thanks", "thank you", "thx", "ty", "gracias", "cheers", "great", "perfect", "awesome", "cool", "nice",
+        "ok", "okay", "got it", "sounds good", "much appreciated", "appreciate it",
+    ),
+    "goodbye": ("bye", "goodbye", "see you", "see ya", "adios", "ciao", "good night", "later", "talk later"),
+    "help": (
+        "help", "what can you do", "who are you", "what are you", "how does this work", "how do you work",
+        "what do you do",
+    ),
+}
+FILLER_WORDS = {"there", "bot", "so", "much", "very", "lot", "again", "all", "everyone", "guys", "friend", "mate", "for", "the", "a", "me", "you", "your"}
+
+TEMPLATES = {
+    "greeting": "Hi! I can help you find restaurants. Try asking \"What is the best Italian restaurant in Madrid?\"",
+    "thanks": "You're welcome! Ask me anything else about restaurants.",
+    "goodbye": "Bye! Message me whenever you need a restaurant recommendation.",
+    "help": ("I answer questions about restaurants: ratings, cuisines, price ranges and cities. "
+             "For example \"Any cheap Mexican places in Sevilla?\""),
+    "reaction": "Let me know if you want another restaurant recommendation.",
+    "off_topic": "Sorry, I can only answer questions about restaurants, such as ratings, cuisines, prices and cities.",
+}
+
+
+@dataclass(frozen=True)
+class Verdict:
+    """How a message was classified; ``reply`` is set when it should not reach the SQL agent."""
+    label: str
+    score: float
+    reply: Optional[str] = None
+
+    @property
+    def is_database(self) -> bool:
+        return self.reply is None
+
+
+class RelevanceFilter:
+    """
+    Local classifier in front of the workflow graph.
+
+    Greetings, thanks, emoji-only messages and questions that are clearly
+    about something else are answered from TEMPLATES instead of costing a
+    parse_question call with the full schema. Domain evidence is a schema
+    term (table or column name), one of DOMAIN_WORDS, a value from the noun
+    index (city, cuisine, restaurant name) or a misspelling whose trigram
+    similarity to a schema or domain term is at least ``min_similarity``.
+    A message is refused as off topic only on positive evidence: it must
+    name at least ``off_topic_margin`` more OFF_TOPIC_WORDS than domain
+    evidence. Everything the filter cannot place ("Where can I get
+    tacos?", "what?") goes to the graph as "unknown", so it only ever saves
+    calls on messages it is sure about.
+    """
+
+    def __init__(
+        self,
+        known_words: Callable[[], Collection[str]] = frozenset,
+        schema: Optional[Callable[[], Any]] = None,
+        min_similarity: float = 0.6,
+        off_topic_margin: int = 1,
+    ):
+        self.known_words = known_words
+        self.schema = schema
+        self.min_similarity = min_similarity
+        self.off_topic_margin = off_topic_margin
+        self._vocabulary: Set[str] = set(DOMAIN_WORDS)
+        self._vocabulary_grams: List[Tuple[str, Set[str]]] = []
+        self._schema_version = None
+        self._small_talk = re.compile(
+            r"\b(" + "|".join(sorted((re.escape(p) for phrases in SMALL_TALK_PHRASES.values() for p in phrases), key=len, reverse=True)) + r")\b"
+        )
+        self._intent = {phrase: intent for intent, phrases in SMALL_TALK_PHRASES.items() for phrase in phrases}
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    @classmethod
+    def from_env(cls, **kwargs) -> Optional["RelevanceFilter"]:
+        """RELEVANCE_FILTER=0 sends every message to the graph."""
+        if os.getenv("RELEVANCE_FILTER", "1") == "0":
+            return None
+        return cls(
+            min_similarity=float(os.getenv("RELEVANCE_MIN_SIMILARITY", "0.6")),
+            off_topic_margin=int(os.getenv("RELEVANCE_OFF_TOPIC_MARGIN", "1")),
+            **kwargs,
+        )
+
+    def _refresh_vocabulary(self) -> None:
+        """Add table and column names to the vocabulary whenever the schema changes."""
+        snapshot = self.schema() if self.schema is not None else None
+        version = snapshot.version if snapshot is not None else None
+        if version == self._schema_version and self._vocabulary_grams:
+            return
+        vocabulary = set(DOMAIN_WORDS)
+        if snapshot is not None:
+            for table, columns in snapshot.tables.items():
+                names = [table] + [column.name for column in columns]
+                vocabulary.update(question_tokens(" ".join(re.sub(r"[_\W]+", " ", name) for name in names)))
+        with self._lock:
+            self._vocabulary = vocabulary
+            self._vocabulary_grams = [(term, trigrams(term)) for term in vocabulary if len(term) >= 4]
+            self._schema_version = version
+
+    def _similar_term(self, token: str) -> bool:
+        if len(token) < 5:
+            return False
+        grams = trigrams(token)
+        return any(len(grams & term_grams) / len(grams | term_grams) >= self.min_similarity
+                   for _, term_grams in self._vocabulary_grams)
+
+    def _evidence(self, text: str) -> List[str]:
+        # One noun-index snapshot per message; the words are tested against it in memory
+        known = self.known_words()
+        evidence = [token for token in question_tokens(text) if token in self._vocabulary or self._similar_term(token)]
+        evidence += [
+            word for word in re.findall(r"\w+", text)
+            if len(word) >= 3 and word not in STOPWORDS and word not in evidence and word in known
+        ]
+        return evidence
+
+    def classify(self, message: str) -> Verdict:
+        """Decide whether message is a database question, small talk, off topic or unknown (sent to the graph)."""
+        self._refresh_vocabulary()
+        text = " ".join(re.findall(r"[\w]+", message.lower().replace("'", "")))
+        intents = [self._intent[match] for match in self._small_talk.findall(text)]
+        rest = self._small_talk.sub(" ", text)
+        tokens = [token for token in question_tokens(rest) if token not in FILLER_WORDS]
+        evidence = self._evidence(rest)
+        # Raw words too: folding turns "news" into "new"
+        off_topic = set(tokens) & OFF_TOPIC_WORDS | set(rest.split()) & OFF_TOPIC_WORDS
+
+        if len(off_topic) - len(evidence) >= self.off_topic_margin:
+            verdict = Verdict("off_topic", len(off_topic) / max(1, len(tokens)), TEMPLATES["off_topic"])
+        elif evidence:
+            verdict = Verdict("database", len(evidence) / max(1, len(tokens)))
+        elif intents and len(tokens) <= 1:
+            verdict = Verdict(intents[0], 1.0, TEMPLATES[intents[0]])
+        elif not text:
+            verdict = Verdict("reaction", 1.0, TEMPLATES["reaction"])
+        else:
+            # No evidence either way ("Where can I get tacos?", "what?"): let the graph and the conversation decide
+            verdict = Verdict("unknown", 0.0)
+        with self._lock:
+            self.stats[verdict.label] += 1
+        return verdict
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            total = sum(self.stats.values())
+            answered = total - self.stats["database"] - self.stats["unknown"]
+            return {
+                **self.stats,
+                "answered_locally": answered,
+                "answered_locally_rate": answered / total if total else 0.0,
+            }
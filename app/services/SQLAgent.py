@@ -1,24 +1,170 @@
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Union
+
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.exceptions import OutputParserException
 from langchain_core.output_parsers import JsonOutputParser
-<<<<<<< HEAD
-from DatabaseManager import DatabaseManager
-from LLMManager import LLMManager
-=======
 from app.services.DatabaseManager import DatabaseManager
 from app.services.LLMManager import LLMManager
->>>>>>> 69a94044205ec7ebdabb3d49af6431e7c830a426
+from app.services.NounIndex import NounIndex
+from app.services.SQLValidator import SQLValidator
+from app.services.SQLTemplates import SQLTemplates
+from app.services.PromptBudget import PromptBudget
+from app.services.ConversationMemory import ConversationMemory
+
+
+class LLMCall(NamedTuple):
+    """The prompt and format arguments a stage wants sent to the LLM."""
+    prompt: ChatPromptTemplate
+    kwargs: Dict[str, Any]
+
+
+class LowConfidence(Exception):
+    """A response that parsed but should not be trusted; the next model in the stage's route is tried."""
+
+
+# Builds the final update from a response the last model in the route could not get right
+Recover = Callable[[dict, str, Exception], dict]
+
+# Responses a stage cannot use; the stage escalates to its next model, or recovers (or raises) after the last one
+UNUSABLE_RESPONSE = (OutputParserException, KeyError, TypeError, LowConfidence)
 
 
 class SQLAgent:
+    """
+    Graph nodes for the SQL agent.
+
+    Every LLM-backed stage is split into a ``_<stage>_call`` method that
+    builds the prompt (or returns the final state update directly when no
+    LLM call is needed) and a ``_<stage>_result`` method that turns the
+    response into a state update. The public sync and async nodes only
+    differ in how they send the call, so both share the same prompts.
+
+    A stage goes to the models of its llm_manager route in order, cheapest
+    first: when ``_<stage>_result`` cannot use the response (it does not
+    parse or raises LowConfidence) the next model gets the same prompt.
+    After the last model, stages with a ``recover`` function degrade
+    gracefully and the others raise.
+    """
+
+    # Total SQL executions per question, counting regenerations after a failed query
+    max_sql_attempts = 2
+    # Restaurants listed under the recommendation (format_restaurant_message shows them as "Top 5")
+    max_top_restaurants = 5
+
     def __init__(self):
         self.db_manager = DatabaseManager()
         self.llm_manager = LLMManager()
+        self.prompt_budget = PromptBudget()
+        self._noun_index = None
+        self._sql_validator = None
+        self._sql_templates = None
+
+    @property
+    def noun_index(self) -> NounIndex:
+        """Noun index over db_manager, rebuilt if db_manager is swapped out."""
+        if self._noun_index is None or self._noun_index.db_manager is not self.db_manager:
+            self._noun_index = NounIndex(self.db_manager)
+        return self._noun_index
+
+    @property
+    def sql_validator(self) -> SQLValidator:
+        """Local SQL validator over db_manager, rebuilt if db_manager is swapped out."""
+        if self._sql_validator is None or self._sql_validator.db_manager is not self.db_manager:
+            self._sql_validator = SQLValidator(self.db_manager)
+        return self._sql_validator
+
+    @property
+    def sql_templates(self) -> Optional[SQLTemplates]:
+        """SQL template library over db_manager, rebuilt if db_manager is swapped out; None with SQL_TEMPLATES=0."""
+        if self._sql_templates is None or self._sql_templates.db_manager is not self.db_manager:
+            self._sql_templates = SQLTemplates.from_env(self.db_manager, self.noun_index)
+        return self._sql_templates
+
+    def _relevant_schema(self, parsed_question: Optional[dict], stage: str) -> str:
+        """Schema prompt limited to the tables parse_question picked, trimmed to the stage budget."""
+        tables = [info['table_name'] for info in (parsed_question or {}).get('relevant_tables', [])]
+        schema = self.db_manager.get_schema_snapshot().prompt_for(tables)
+        return self.prompt_budget.fit_text(schema, stage, "schema")
+
+    def _models(self, stage: str, escalate: Optional[str]) -> List[str]:
+        """The stage's route; ``escalate`` names a reason to skip straight to its last model."""
+        models = self.llm_manager.route(stage)
+        if escalate and len(models) > 1:
+            self.llm_manager.usage.escalated(stage, escalate)
+            return models[-1:]
+        return models
+
+    def _finish(self, stage: str, model: str, last: bool, finish: Callable[[dict, str], dict], recover: Optional[Recover], state: dict, response: str) -> Optional[dict]:
+        """The state update for response, or None to escalate to the next model."""
+        try:
+            return finish(state, response)
+        except UNUSABLE_RESPONSE as e:
+            if not last:
+                reason = "low_confidence" if isinstance(e, LowConfidence) else "parse_failure"
+                logging.info(f"{stage}: escalating from {model} ({reason}: {e})")
+                self.llm_manager.usage.escalated(stage, reason)
+                return None
+            if recover is None:
+                raise
+            return recover(state, response, e)
+
+    def _run_stage(self, stage: str, build: Callable[[dict], Union[dict, LLMCall]], finish: Callable[[dict, str], dict], state: dict,
+                   recover: Optional[Recover] = None, escalate: Optional[str] = None) -> dict:
+        call = build(state)
+        if not isinstance(call, LLMCall):
+            return call
+        models = self._models(stage, escalate)
+        for i, model in enumerate(models):
+            response = self.llm_manager.invoke(call.prompt, stage=stage, model=model, **call.kwargs)
+            update = self._finish(stage, model, i == len(models) - 1, finish, recover, state, response)
+            if update is not None:
+                return update
+
+    async def _arun_stage(self, stage: str, build: Callable[[dict], Union[dict, LLMCall]], finish: Callable[[dict, str], dict], state: dict,
+                          recover: Optional[Recover] = None, escalate: Optional[str] = None) -> dict:
+        # Building the prompt (schema, noun lookups) and checking the response (SQL validation) touch SQLite
+        call = await asyncio.to_thread(build, state)
+        if not isinstance(call, LLMCall):
+            return call
+        models = self._models(stage, escalate)
+        for i, model in enumerate(models):
+            response = await self.llm_manager.ainvoke(call.prompt, stage=stage, model=model, **call.kwargs)
+            update = await asyncio.to_thread(self._finish, stage, model, i == len(models) - 1, finish, recover, state, response)
+            if update is not None:
+                return update
+
+    def match_template(self, state: dict) -> dict:
+        """Answer a question whose shape has an SQL template with that prepared statement, skipping the SQL-writing stages."""
+        templates = self.sql_templates
+        match = templates.match(state['question']) if templates is not None else None
+        if match is None:
+            return {"sql_template": None}
+        return {
+            "parsed_question": match.parsed_question,
+            "unique_nouns": list(match.params.values()),
+            "sql_query": match.sql_query,
+            "sql_valid": True,
+            "sql_template": {"shape": match.shape, "statement": match.statement, "params": match.params},
+        }
+
+    async def amatch_template(self, state: dict) -> dict:
+        """Async version of match_template; the noun lookup runs in a thread."""
+        return await asyncio.to_thread(self.match_template, state)
 
     def parse_question(self, state: dict) -> dict:
         """Parse user question and identify relevant tables and columns."""
+        return self._run_stage("parse_question", self._parse_question_call, self._parse_question_result, state)
+
+    async def aparse_question(self, state: dict) -> dict:
+        """Async version of parse_question."""
+        return await self._arun_stage("parse_question", self._parse_question_call, self._parse_question_result, state)
+
+    def _parse_question_call(self, state: dict) -> LLMCall:
         question = state['question']
-        schema = self.db_manager.get_schema()
-        print(f"Schema fetched: {schema}")  # Debugging line
+        schema = self.prompt_budget.fit_text(self.db_manager.get_schema(), "parse_question", "schema")
+        logging.debug(f"Schema fetched: {schema}")
         prompt = ChatPromptTemplate.from_messages([
             ("system", '''You are a data analyst that can help summarize SQL tables and parse user questions about a database. 
             Given the question and database schema, identify the relevant tables and columns. 
@@ -40,35 +186,55 @@ class SQLAgent:
             '''),
             ("human", "===Database schema:\n{schema}\n\n===User question:\n{question}\n\nIdentify relevant tables and columns:")
         ])
+        return LLMCall(prompt, {"schema": schema, "question": question})
 
+    def _parse_question_result(self, state: dict, response: str) -> dict:
         output_parser = JsonOutputParser()
-        response = self.llm_manager.invoke(prompt, schema=schema, question=question)
         parsed_response = output_parser.parse(response)
+        if not isinstance(parsed_response, dict) or "is_relevant" not in parsed_response:
+            raise OutputParserException(f"parse_question response has no is_relevant: {response[:200]}")
         return {"parsed_question": parsed_response}
 
     def get_unique_nouns(self, state: dict) -> dict:
-        """Find unique nouns in relevant tables and columns."""
+        """Find the nouns from the relevant columns that the question mentions."""
         parsed_question = state['parsed_question']
         
         if not parsed_question['is_relevant']:
             return {"unique_nouns": []}
 
-        unique_nouns = set()
+        schema = self.db_manager.get_schema_snapshot()
+        columns = []
         for table_info in parsed_question['relevant_tables']:
             table_name = table_info['table_name']
-            noun_columns = table_info['noun_columns']
-            
-            if noun_columns:
-                column_names = ', '.join(f"`{col}`" for col in noun_columns)
-                query = f"SELECT DISTINCT {column_names} FROM `{table_name}`"
-                results = self.db_manager.execute_query(query)
-                for row in results:
-                    unique_nouns.update(str(value) for value in row if value)
+            # Drop any table or column the LLM made up
+            columns.extend(
+                (table_name, col) for col in table_info['noun_columns'] if schema.has_column(table_name, col)
+            )
+
+        if not columns:
+            return {"unique_nouns": []}
+        return {"unique_nouns": self.noun_index.lookup(state['question'], columns)}
 
-        return {"unique_nouns": list(unique_nouns)}
+    async def aget_unique_nouns(self, state: dict) -> dict:
+        """Async version of get_unique_nouns; the database work runs in a thread."""
+        return await asyncio.to_thread(self.get_unique_nouns, state)
 
     def generate_sql(self, state: dict) -> dict:
         """Generate SQL query based on parsed question and unique nouns."""
+        return self._run_stage("generate_sql", self._generate_sql_call, self._generate_sql_result, state,
+                               recover=self._generate_sql_recover, escalate=self._sql_error(state))
+
+    async def agenerate_sql(self, state: dict) -> dict:
+        """Async version of generate_sql."""
+        return await self._arun_stage("generate_sql", self._generate_sql_call, self._generate_sql_result, state,
+                                      recover=self._generate_sql_recover, escalate=self._sql_error(state))
+
+    @staticmethod
+    def _sql_error(state: dict) -> Optional[str]:
+        """A query that already failed in the database is rewritten by the largest model of the route."""
+        return "sql_error" if state.get('error') else None
+
+    def _generate_sql_call(self, state: dict) -> Union[dict, LLMCall]:
         question = state['question']
         parsed_question = state['parsed_question']
         unique_nouns = state['unique_nouns']
@@ -76,8 +242,9 @@ class SQLAgent:
         if not parsed_question['is_relevant']:
             return {"sql_query": "NOT_RELEVANT", "is_relevant": False}
     
-        schema = self.db_manager.get_schema()
-        print(f"Schema fetched: {schema}")  # Debugging line
+        schema = self._relevant_schema(parsed_question, "generate_sql")
+        unique_nouns = self.prompt_budget.fit_list(unique_nouns, "generate_sql", "unique_nouns")
+        logging.debug(f"Schema fetched: {schema}")
         prompt = ChatPromptTemplate.from_messages([
             ("system", '''
             You are an AI assistant that generates SQL queries based on user questions, database schema, and unique nouns found in the relevant tables. Generate a valid SQL query to answer the user's question.
@@ -115,26 +282,50 @@ class SQLAgent:
             ===Unique nouns in relevant tables:
             {unique_nouns}
 
+            ===Previous attempt that failed (write a different query that avoids the error):
+            {previous_attempt}
+
+            ===Conversation so far (the question may refine the last one, e.g. "and cheaper ones?"):
+            {conversation}
+
             Generate SQL query string'''),
         ])
+        previous_attempt = "None"
+        if state.get('error'):
+            previous_attempt = f"{state.get('sql_query')}\nError: {state['error']}"
+        conversation = self.prompt_budget.fit_text(ConversationMemory.render(state), "generate_sql", "conversation")
+        return LLMCall(prompt, {"schema": schema, "question": question, "parsed_question": parsed_question, "unique_nouns": unique_nouns, "previous_attempt": previous_attempt, "conversation": conversation})
 
-        response = self.llm_manager.invoke(prompt, schema=schema, question=question, parsed_question=parsed_question, unique_nouns=unique_nouns)
-        
+    def _generate_sql_result(self, state: dict, response: str) -> dict:
         if response.strip() == "NOT_ENOUGH_INFO":
-            return {"sql_query": "NOT_RELEVANT"}
-        else:
-            return {"sql_query": response}
-    
+            # parse_question found the question relevant, so a larger model may still answer it
+            raise LowConfidence("model could not write a query")
+        return {"sql_query": response, "sql_template": None}
+
+    def _generate_sql_recover(self, state: dict, response: str, error: Exception) -> dict:
+        return {"sql_query": "NOT_RELEVANT", "sql_template": None}
     
     def validate_and_fix_sql(self, state: dict) -> dict:
         """Validate and fix the generated SQL query."""
+        return self._run_stage("validate_and_fix_sql", self._validate_and_fix_sql_call, self._validate_and_fix_sql_result, state)
+
+    async def avalidate_and_fix_sql(self, state: dict) -> dict:
+        """Async version of validate_and_fix_sql."""
+        return await self._arun_stage("validate_and_fix_sql", self._validate_and_fix_sql_call, self._validate_and_fix_sql_result, state)
+
+    def _validate_and_fix_sql_call(self, state: dict) -> Union[dict, LLMCall]:
         sql_query = state['sql_query']
 
         if sql_query == "NOT_RELEVANT":
             return {"sql_query": "NOT_RELEVANT", "sql_valid": False}
+
+        # Fast path: a query SQLite can compile against the known schema needs no LLM review
+        sql_query, local_error = self.sql_validator.validate(sql_query)
+        if local_error is None:
+            return {"sql_query": sql_query, "sql_valid": True}
         
-        schema = self.db_manager.get_schema()
-        print(f"Schema fetched: {schema}")  # Debugging line
+        schema = self._relevant_schema(state.get('parsed_question'), "validate_and_fix_sql")
+        logging.debug(f"Schema fetched: {schema}")
 
         # Ensure that schema and sql_query are properly passed in the format
         prompt = ChatPromptTemplate.from_messages([
@@ -158,6 +349,9 @@ class SQLAgent:
             ===Generated SQL query:
             {sql_query}
 
+            ===Error reported by the database:
+            {local_error}
+
             Respond in JSON format with the following structure. Only respond with the JSON:
             {{
                 "valid": boolean,
@@ -185,12 +379,12 @@ class SQLAgent:
             }}
             '''),
         ])
+        return LLMCall(prompt, {"schema": schema, "sql_query": sql_query, "local_error": local_error})
 
+    def _validate_and_fix_sql_result(self, state: dict, response: str) -> dict:
+        sql_query = state['sql_query']
         output_parser = JsonOutputParser()
 
-        # Ensure that you're passing both schema and sql_query properly as keyword arguments
-        response = self.llm_manager.invoke(prompt, schema=schema, sql_query=sql_query)
-        
         # Parsing the response from the language model
         result = output_parser.parse(response)
 
@@ -203,361 +397,208 @@ class SQLAgent:
                 "sql_valid": result["valid"],
                 "sql_issues": result["issues"]
             }
-        
+
+    def plan_sql(self, state: dict) -> dict:
+        """Parse the question, write the SQL and check it in a single LLM call (the "fast" workflow)."""
+        return self._run_stage("plan_sql", self._plan_sql_call, self._plan_sql_result, state, recover=self._plan_sql_recover)
+
+    async def aplan_sql(self, state: dict) -> dict:
+        """Async version of plan_sql."""
+        return await self._arun_stage("plan_sql", self._plan_sql_call, self._plan_sql_result, state, recover=self._plan_sql_recover)
+
+    def _plan_sql_call(self, state: dict) -> LLMCall:
+        question = state['question']
+        schema = self.prompt_budget.fit_text(self.db_manager.get_schema(), "plan_sql", "schema")
+        # No parse step has picked the noun columns yet, so offer matches from every indexed column
+        candidate_nouns = self.noun_index.lookup(question, self.noun_index.columns())
+        candidate_nouns = self.prompt_budget.fit_list(candidate_nouns, "plan_sql", "unique_nouns")
+        conversation = self.prompt_budget.fit_text(ConversationMemory.render(state), "plan_sql", "conversation")
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", '''
+            You are an AI assistant that plans and checks SQL queries for questions about a SQLite database. In one step:
+            1. Decide whether the question can be answered from the database. If it cannot, set is_relevant to false and sql_query to "NOT_RELEVANT".
+            2. Identify the relevant tables and columns. "noun_columns" are the relevant columns that contain nouns or names, not numbers.
+            3. Write one valid SQL query that answers the question. Use the exact spellings from the candidate nouns list. All the table and column names should be enclosed in backticks. Skip all rows where any selected column is NULL or "N/A" or "".
+            4. Check the query against the schema: every table and column must exist. Set valid to false and describe the problem in issues if you are not confident the query is correct.
+
+            Here are some examples of queries:
+            1. What is the best restaurant?
+            Answer: SELECT `name`, `rating`, `url` FROM `data_restaurants` ORDER BY `rating` DESC LIMIT 5
+
+            2. What is the restaurant with the worst rating in madrid?
+            Answer: SELECT `name`, `rating`, `url` FROM `data_restaurants` WHERE `city` = 'Madrid' ORDER BY `rating` ASC LIMIT 5
+
+            Respond in JSON format with the following structure. Only respond with the JSON:
+            {{
+                "is_relevant": boolean,
+                "relevant_tables": [
+                    {{
+                        "table_name": string,
+                        "columns": [string],
+                        "noun_columns": [string]
+                    }}
+                ],
+                "unique_nouns": [string],
+                "sql_query": string,
+                "valid": boolean,
+                "issues": string or null
+            }}
+            '''),
+            ("human", '''===Database schema:
+            {schema}
+
+            ===User question:
+            {question}
+
+            ===Candidate nouns found in the database:
+            {candidate_nouns}
+
+            ===Conversation so far (the question may refine the last one, e.g. "and cheaper ones?"):
+            {conversation}
+
+            Plan and check the SQL query:'''),
+        ])
+        return LLMCall(prompt, {"schema": schema, "question": question, "candidate_nouns": candidate_nouns, "conversation": conversation})
+
+    def _plan_sql_result(self, state: dict, response: str) -> dict:
+        """
+        The plan as the update parse_question, get_unique_nouns, generate_sql
+        and validate_and_fix_sql would have produced. A plan that fails its
+        own check or does not compile raises LowConfidence.
+        """
+        result = JsonOutputParser().parse(response)
+        parsed_question = {"is_relevant": bool(result["is_relevant"]), "relevant_tables": result.get("relevant_tables") or []}
+        sql_query = result["sql_query"]
+
+        if not parsed_question['is_relevant']:
+            return {"parsed_question": parsed_question, "unique_nouns": [], "sql_query": "NOT_RELEVANT", "plan_failed": False}
+        if not result.get("valid") or not isinstance(sql_query, str) or not sql_query.strip():
+            raise LowConfidence(f"plan failed its own check: {result.get('issues')}")
+        sql_query, local_error = self.sql_validator.validate(sql_query)
+        if local_error is not None:
+            raise LowConfidence(f"planned query does not compile: {local_error}")
+        return {
+            "parsed_question": parsed_question,
+            "unique_nouns": [noun for noun in result.get("unique_nouns") or [] if isinstance(noun, str)],
+            "sql_query": sql_query,
+            "sql_valid": True,
+            "plan_failed": False,
+        }
+
+    def _plan_sql_recover(self, state: dict, response: str, error: Exception) -> dict:
+        """No model produced a usable plan: continue with the staged workflow."""
+        logging.info(f"plan_sql unusable, falling back to the staged workflow: {error}")
+        return {"plan_failed": True}
+
     def execute_sql(self, state: dict) -> dict:
         """Execute SQL query and return results."""
         query = state['sql_query']
+        template = state.get('sql_template')
         # uuid = state['uuid']
         
         if query == "NOT_RELEVANT":
             return {"results": "NOT_RELEVANT"}
 
         try:
-            results = self.db_manager.execute_query(query)
-            return {"results": results}
+            if template:
+                results, truncated = self.db_manager.fetch_bounded(template['statement'], params=template['params'])
+            else:
+                results, truncated = self.db_manager.fetch_bounded(query)
         except Exception as e:
-            return {"error": str(e)}
-
-    def format_results(self, state: dict) -> dict:
-        """Format query results into a human-readable response."""
-        question = state['question']
-        results = state['results']
-
-        if results == "NOT_RELEVANT":
-            return {"answer": "Sorry, I can only give answers relevant to the database."}
-
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", "You are an AI assistant that formats database query results into a human-readable response. Give a conclusion to the user's question based on the query results. Do not give the answer in markdown format. Only give the answer in one line."),
-            ("human", "User question: {question}\n\nQuery results: {results}\n\nFormatted response:"),
-        ])
-
-        response = self.llm_manager.invoke(prompt, question=question, results=results)
-        return {"answer": response}
-
-    def choose_recommendation(self, state: dict) -> dict:
-        """Choose an appropriate recommendation from the data."""
+            # Timeouts, cost rejections and SQL errors all go back to generate_sql (see needs_new_sql)
+            return {"results": [], "error": str(e), "sql_attempts": state.get('sql_attempts', 0) + 1}
+        templates = self.sql_templates
+        # Follow-ups are written against the earlier turns, so only standalone questions teach templates
+        if templates is not None and results and not template and not state.get('follow_up'):
+            templates.observe(state['question'], query)
+        return {"results": results, "results_truncated": truncated, "error": ""}
+
+    def needs_new_sql(self, state: dict) -> bool:
+        """True if execute_sql failed and another generate_sql attempt is allowed."""
+        return bool(state.get('error')) and state.get('sql_attempts', 0) < self.max_sql_attempts
+
+    async def aexecute_sql(self, state: dict) -> dict:
+        """Async version of execute_sql; the query runs in a thread."""
+        return await asyncio.to_thread(self.execute_sql, state)
+
+    def compose_answer(self, state: dict) -> dict:
+        """Write the answer, the recommendation and the top restaurants from the query results."""
+        return self._run_stage("compose_answer", self._compose_answer_call, self._compose_answer_result, state,
+                               recover=self._compose_answer_recover)
+
+    async def acompose_answer(self, state: dict) -> dict:
+        """Async version of compose_answer."""
+        return await self._arun_stage("compose_answer", self._compose_answer_call, self._compose_answer_result, state,
+                                      recover=self._compose_answer_recover)
+
+    def _compose_answer_call(self, state: dict) -> Union[dict, LLMCall]:
         question = state['question']
         results = state['results']
         sql_query = state['sql_query']
 
         if results == "NOT_RELEVANT":
-            return {"recommendation": "none", "recommendation_reasoning": "No recommendation needed for irrelevant questions."}
+            return {
+                "answer": "Sorry, I can only give answers relevant to the database.",
+                "recommendation": "None",
+                "recommendation_reason": "No recommendation needed for irrelevant questions.",
+                "formatted_data_for_recommendation": {"Top 5 Restaurants": []},
+            }
 
         prompt = ChatPromptTemplate.from_messages([
             ("system", '''
-             You are an AI assistant that specializes in recommending restaurants. Based on the user's question, the SQL query, and the query results, provide the most accurate and suitable restaurant recommendation. If no recommendation fits, clearly state that no suitable option is available.
-
-            When making recommendations, consider these factors:
-            - Location: Prioritize restaurants near the specified area or region.
-            - Cuisine: Match the cuisine type or style the user is asking for (e.g., "Italian," "Vegan").
-            - Ratings: Favor restaurants with higher ratings or reviews if applicable.
-            - Price Range: Consider the price range based on the user's preferences or question.
-            - Special Requests: Address specific requirements like "family-friendly," "romantic atmosphere," or dietary preferences like "gluten-free."
-            
-            Provide concise and actionable recommendations. Use the query results to support your answers when appropriate. Do NOT recommend a restaurant if the available data does not support it.
+            You are an AI assistant that answers questions about restaurants from database query results and recommends one of them. Based on the user's question, the SQL query, and the query results:
+            1. Give a conclusion to the user's question in one line. Do not use markdown.
+            2. Recommend the most suitable restaurant from the results, or "None" if the data does not support a recommendation.
+            3. Explain the choice in one sentence, based on location, cuisine, rating, price range or special requests.
+            4. List up to 5 of the best matching restaurants from the results, best first. Only use names and URLs that appear in the query results; use "N/A" for a missing URL.
 
-            Output your response in the following format:
-            Recommended restaurant: [Name of the restaurant or "None" if no recommendation is suitable]
-            Reason: [Explain why this restaurant was chosen based on location, cuisine, rating, etc.]
-            Additional information: [Optional details like opening hours, special offers, or unique features]
+            Respond in JSON format with the following structure. Only respond with the JSON:
+            {{
+                "answer": string,
+                "recommendation": string,
+                "reason": string,
+                "top_restaurants": [
+                    {{
+                        "name": string,
+                        "url": string,
+                        "description": string
+                    }}
+                ]
+            }}
             '''),
-            
             ("human", '''
             User question: {question}
             SQL query: {sql_query}
             Query results: {results}
 
-            Recommend a restaurant:'''),
-                    ])
-
-        response = self.llm_manager.invoke(prompt, question=question, sql_query=sql_query, results=results)
-        
-        lines = response.split('\n')
-        recommendation = lines[0].split(': ')[1]
-        reason = lines[1].split(': ')[1]
-
-        return {"recommendation": recommendation, "recommendation_reason": reason}
-<<<<<<< HEAD
-
-
-
-
-# class SQLAgent:
-#     def __init__(self):
-#         self.db_manager = DatabaseManager()
-#         self.llm_manager = LLMManager()
-
-#     def parse_question(self, state: dict) -> dict:
-#         """Parse user question and identify relevant tables and columns."""
-#         question = state['question']
-#         schema = self.db_manager.get_schema()
-#         print(f"Schema fetched: {schema}")  # Debugging line
-#         prompt = ChatPromptTemplate.from_messages([
-#             ("system", '''You are a data analyst that can help summarize SQL tables and parse user questions 
-#             about a database. Given the question and database schema, identify the relevant tables and columns.
-            
-#             If the question is not relevant to the database or if there is not enough information to answer the question, set is_relevant to false.
-
-#             Your response should be in the following JSON format:
-#             {{
-#                 "is_relevant": boolean,
-#                 "relevant_tables": [
-#                     {{
-#                         "table_name": string,
-#                         "columns": [string],
-#                         "noun_columns": [string]
-#                     }}
-#                 ]
-#             }}
-
-#             The "noun_columns" field should contain only the columns that are relevant to the question and contain nouns or names, for example, the column "reviews" contains nouns relevant to the question "What are the top restaurants?", but the column "place_id" is not relevant because it does not contain a noun. Do not include columns that contain numbers.
-#             '''),
-#             ("human", "===Database schema:\n{schema}\n\n===User question:\n{question}\n\nIdentify relevant tables and columns:")
-#         ])
-#         print(prompt)
-#         output_parser = JsonOutputParser()
-#         response = self.llm_manager.invoke(prompt, schema=schema, question=question)
-#         print(response)
-#         parsed_response = output_parser.parse(response)
-#         print(parsed_response)
-#         return {"parsed_question": parsed_response}
-
-#     def get_unique_nouns(self, state: dict) -> dict:
-#         """Find unique nouns in relevant tables and columns."""
-#         parsed_question = state['parsed_question']
-        
-#         if not parsed_question['is_relevant']:
-#             return {"unique_nouns": []}
-
-#         unique_nouns = set()
-#         for table_info in parsed_question['relevant_tables']:
-#             table_name = table_info['table_name']
-#             noun_columns = table_info['noun_columns']
-            
-#             if noun_columns:
-#                 column_names = ', '.join(f"`{col}`" for col in noun_columns)
-#                 query = f"SELECT DISTINCT {column_names} FROM `{table_name}`"
-#                 results = self.db_manager.execute_query(query)
-#                 for row in results:
-#                     unique_nouns.update(str(value) for value in row if value)
-#         print(unique_nouns)
-#         return {"unique_nouns": list(unique_nouns)}
-
-#     def generate_sql(self, state: dict) -> dict:
-#         """Generate SQL query based on parsed question and unique nouns.
-#             There is a massive problem with this approach, the think is that if we just use this process we are going to call me same restaurant over and over
-#             The chain needs more data (dynamic subjective data) to create a metric where the llm can grab mor information and retrieve an accurate recommendation
-#             Double-check the reasoning to see what were the steps taken to make the recommendation"""
-#         question = state['question']
-#         parsed_question = state['parsed_question']
-#         unique_nouns = state['unique_nouns']
-
-#         if not parsed_question['is_relevant']:
-#             return {"sql_query": "NOT_RELEVANT", "is_relevant": False} # cambiar esta condicional aqui
-
-#         schema = self.db_manager.get_schema()
-#         print(f"Schema fetched: {schema}")  # Debugging line
-#         prompt = ChatPromptTemplate.from_messages([
-#             ("system", '''
-#             You are an AI assistant that generates SQL queries based on user questions, database schema, and unique nouns found in the relevant tables. Generate a valid SQL query to answer the user's question.
-
-#             If there is not enough information to write a SQL query, respond with "NOT_ENOUGH_INFO".
-
-#             Here are some examples:
-
-#             1. What is the best restaurant?
-#             Answer: SELECT name, rating, url FROM data_restaurants ORDER BY rating DESC LIMIT 5
-
-#             2. What is the restaurant with the worst rating in madrid?
-#             Answer: SELECT name, rating, url FROM data_restaurants ORDER BY rating ASC LIMIT 5
-            
-#             3. What is the price range in the best restaurant?
-#             Answer: SELECT name AS best_restaurant, 
-#                     rating AS highest_rating, 
-#                     price_range
-#                     FROM restaurants
-#                     WHERE rating = (SELECT MAX(rating) FROM restaurants);
-            
-
-#             SKIP ALL ROWS WHERE ANY COLUMN IS NULL or "N/A" or "".
-#             Just give the query string. Do not format it. Make sure to use the correct spellings of nouns as provided in the unique nouns list. All the table and column names should be enclosed in backticks.
-#             '''),
-#                         ("human", '''===Database schema:
-#             {schema}
-
-#             ===User question:
-#             {question}
-
-#             ===Relevant tables and columns:
-#             {parsed_question}
-
-#             ===Unique nouns in relevant tables:
-#             {unique_nouns}
-
-#             Generate SQL query string'''),
-#         ])
-
-#         response = self.llm_manager.invoke(prompt, schema=schema, question=question, parsed_question=parsed_question, unique_nouns=unique_nouns)
-        
-#         if response.strip() == "NOT_ENOUGH_INFO":
-#             return {"sql_query": "NOT_RELEVANT"}
-#         else:
-#             print(response)
-#             return {"sql_query": response}
-
-
-#     def validate_and_fix_sql(self, state: dict) -> dict:
-#         """Validate and fix the generated SQL query."""
-#         sql_query = state['sql_query']
-
-#         if sql_query == "NOT_RELEVANT":
-#             return {"sql_query": "NOT_RELEVANT", "sql_valid": False}
-        
-#         schema = self.db_manager.get_schema()
-#         print(f"Schema fetched: {schema}")  # Debugging line
-
-#         # Ensure that schema and sql_query are properly passed in the format
-#         prompt = ChatPromptTemplate.from_messages([
-#             ("system", '''
-#             You are an AI assistant that validates and fixes SQL queries. Your task is to:
-#             1. Check if the SQL query is valid.
-#             2. Ensure all table and column names are correctly spelled and exist in the schema. All the table and column names should be enclosed in backticks.
-#             3. If there are any issues, fix them and provide the corrected SQL query.
-#             4. If no issues are found, return the original query.
-
-#             Respond in JSON format with the following structure. Only respond with the JSON:
-#             {{
-#                 "valid": boolean,
-#                 "issues": string or null,
-#                 "corrected_query": string
-#             }}
-#             '''),
-#             ("human", '''===Database schema:
-#             {schema}
-
-#             ===Generated SQL query:
-#             {sql_query}
-
-#             Respond in JSON format with the following structure. Only respond with the JSON:
-#             {{
-#                 "valid": boolean,
-#                 "issues": string or null,
-#                 "corrected_query": string
-#             }}
-
-#             For example:
-#             1. {{
-#                 "valid": true,
-#                 "issues": null,
-#                 "corrected_query": "None"
-#             }}
-                                        
-#             2. {{
-#                 "valid": false,
-#                 "issues": "Column USERS does not exist",
-#                 "corrected_query": "SELECT * FROM \\`users\\` WHERE age > 25"
-#             }}
-
-#             3. {{
-#                 "valid": false,
-#                 "issues": "Column names and table names should be enclosed in backticks if they contain spaces or special characters",
-#                 "corrected_query": "SELECT * FROM \\`gross income\\` WHERE \\`age\\` > 25"
-#             }}
-#             '''),
-#         ])
-
-#         output_parser = JsonOutputParser()
-
-#         # Ensure that you're passing both schema and sql_query properly as keyword arguments
-#         response = self.llm_manager.invoke(prompt, schema=schema, sql_query=sql_query)
-#         print(response)
-#         # Parsing the response from the language model
-#         result = output_parser.parse(response)
-
-#         # Check the validation result and return accordingly
-#         if result["valid"] and result["issues"] is None:
-#             return {"sql_query": sql_query, "sql_valid": True}
-#         else:
-#             return {
-#                 "sql_query": result["corrected_query"],
-#                 "sql_valid": result["valid"],
-#                 "sql_issues": result["issues"]
-#             }
-        
-#     def execute_sql(self, state: dict) -> dict:
-#         """Execute SQL query and return results."""
-#         query = state['sql_query']
-#         # uuid = state['uuid']
-        
-#         if query == "NOT_RELEVANT":
-#             return {"results": "NOT_RELEVANT"}
-
-#         try:
-#             results = self.db_manager.execute_query(query)
-#             print(results)
-#             return {"results": results}
-#         except Exception as e:
-#             return {"error": str(e)}
-
-#     def format_results(self, state: dict) -> dict:
-#         """Format query results into a human-readable response."""
-#         question = state['question']
-#         results = state['results']
-
-#         if results == "NOT_RELEVANT":
-#             return {"answer": "Sorry, I can only give answers relevant to the database."}
-
-#         prompt = ChatPromptTemplate.from_messages([
-#             ("system", "You are an AI assistant that formats database query results into a human-readable response. Give a conclusion to the user's question based on the query results. Do not give the answer in markdown format. Only give the answer in one line."),
-#             ("human", "User question: {question}\n\nQuery results: {results}\n\nFormatted response:"),
-#         ])
-
-#         response = self.llm_manager.invoke(prompt, question=question, results=results)
-#         print(response)
-#         return {"answer": response}
-
-#     def choose_recommendation(self, state: dict) -> dict:
-#         """Choose an appropriate recommendation from the data."""
-#         question = state['question']
-#         results = state['results']
-#         sql_query = state['sql_query']
-
-#         if results == "NOT_RELEVANT":
-#             return {"recommendation": "none", "recommendation_reasoning": "No recommendation needed for irrelevant questions."}
-
-#         prompt = ChatPromptTemplate.from_messages([
-#             ("system", '''
-#                 You are an AI assistant that specializes in recommending restaurants. Based on the user's question, the SQL query, and the query results, provide the most accurate and suitable restaurant recommendation. If no recommendation fits, clearly state that no suitable option is available.
-
-#             When making recommendations, consider these factors:
-#             - Location: Prioritize restaurants near the specified area or region.
-#             - Cuisine: Match the cuisine type or style the user is asking for (e.g., "Italian," "Vegan").
-#             - Ratings: Favor restaurants with higher ratings or reviews if applicable.
-#             - Price Range: Consider the price range based on the user's preferences or question.
-#             - Special Requests: Address specific requirements like "family-friendly," "romantic atmosphere," or dietary preferences like "gluten-free."
-            
-#             Provide concise and actionable recommendations. Use the query results to support your answers when appropriate. Do NOT recommend a restaurant if the available data does not support it.
-
-#             Output your response in the following format:
-#             Recommended restaurant: [Name of the restaurant or "None" if no recommendation is suitable]
-#             Reason: [Explain why this restaurant was chosen based on location, cuisine, rating, etc.]
-#             Additional information: [Optional details like opening hours, special offers, or unique features]
-#             '''),
-            
-#             ("human", '''
-#             User question: {question}
-#             SQL query: {sql_query}
-#             Query results: {results}
-
-#             Recommend a restaurant:'''),
-#                     ])
-
-#         response = self.llm_manager.invoke(prompt, question=question, sql_query=sql_query, results=results)
-        
-#         lines = response.split('\n')
-#         recommendation = lines[0].split(': ')[1]
-#         reason = lines[1].split(': ')[1]
-
-#         return {"recommendation": recommendation, "recommendation_reason": reason}
-=======
->>>>>>> 69a94044205ec7ebdabb3d49af6431e7c830a426
+            Answer and recommend a restaurant:'''),
+        ])
+        results = self.prompt_budget.fit_rows(results, "compose_answer", truncated=state.get('results_truncated', False))
+        return LLMCall(prompt, {"question": question, "sql_query": sql_query, "results": results})
+
+    def _compose_answer_result(self, state: dict, response: str) -> dict:
+        """The parsed response in the shape format_restaurant_message reads."""
+        result = JsonOutputParser().parse(response)
+        return self._composed_answer(str(result["answer"]), result)
+
+    def _compose_answer_recover(self, state: dict, response: str, error: Exception) -> dict:
+        """A response that is not the requested JSON is sent as the answer on its own rather than failing the run."""
+        logging.warning(f"compose_answer response is not JSON, sending it as plain text: {error}")
+        return self._composed_answer(response.strip(), {})
+
+    def _composed_answer(self, answer: str, result: dict) -> dict:
+        top_restaurants = [
+            {
+                "Restaurant name": str(restaurant["name"]),
+                "URL": str(restaurant.get("url") or "N/A"),
+                "Description": str(restaurant.get("description") or ""),
+            }
+            for restaurant in (result.get("top_restaurants") or [])[:self.max_top_restaurants]
+            if isinstance(restaurant, dict) and restaurant.get("name")
+        ]
+        return {
+            "answer": answer,
+            "recommendation": str(result.get("recommendation") or "None"),
+            "recommendation_reason": str(result.get("reason") or ""),
+            "formatted_data_for_recommendation": {"Top 5 Restaurants": top_restaurants},
+        }
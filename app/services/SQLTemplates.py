@@ -0,0 +1,294 @@
+import logging
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from app.services.AnswerCache import question_tokens
+
+# Sort words (after question_tokens' synonym folding: "top" -> "best", "lowest" -> "worst") and their ORDER BY direction
+SORT_WORDS = {"best": "DESC", "worst": "ASC"}
+# Price words and the end of the price column's levels they stand for; levels sort by length ("€" < "€€")
+PRICE_WORDS = {"cheap": 0, "expensive": -1}
+# Literals the prompts ask the model to filter out; a template may keep them unbound
+CONSTANT_LITERALS = {"", "N/A"}
+# The generate_sql rule for the seeds' selected columns: skip rows where any is NULL, '' or 'N/A' (NULLs sort first with ASC)
+NOT_MISSING = ("`rating` IS NOT NULL AND `rating` NOT IN ('', 'N/A') AND `name` NOT IN ('', 'N/A') "
+               "AND `url` NOT IN ('', 'N/A')")
+_SEED_SELECT = "SELECT `name`, `rating`, `url` FROM `data_restaurants` WHERE "
+
+# Marks the ORDER BY direction in a statement; it is filled from SORT_WORDS, never from user text
+ORDER = "{order}"
+ORDER_SLOT = "slot_order"
+
+# Question shapes the generate_sql few-shot examples cover; {column} stands for a value of that column
+SEED_TEMPLATES: Tuple[Tuple[str, str], ...] = (
+    ("What is the best restaurant?",
+     _SEED_SELECT + NOT_MISSING + " ORDER BY `rating` {order} LIMIT 5"),
+    ("What is the best restaurant in {city}?",
+     _SEED_SELECT + "`city` = :city AND " + NOT_MISSING + " ORDER BY `rating` {order} LIMIT 5"),
+    ("What is the best {cuisine} restaurant?",
+     _SEED_SELECT + "`cuisine` = :cuisine AND " + NOT_MISSING + " ORDER BY `rating` {order} LIMIT 5"),
+    ("What is the best {cuisine} restaurant in {city}?",
+     _SEED_SELECT + "`city` = :city AND `cuisine` = :cuisine AND " + NOT_MISSING + " ORDER BY `rating` {order} LIMIT 5"),
+    ("Any cheap restaurants in {city}?",
+     _SEED_SELECT + "`city` = :city AND `price_range` = :price_range AND " + NOT_MISSING + " ORDER BY `rating` DESC LIMIT 5"),
+)
+
+_LITERAL = re.compile(r"'((?:[^']|'')*)'")
+_DIRECTION = re.compile(r"\b(ASC|DESC)\b", re.IGNORECASE)
+_BIND = re.compile(r"(?<![:\w]):(\w+)")
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+
+def slot_name(column: str) -> str:
+    """Bind parameter name for a column, e.g. "Price range" -> "price_range"."""
+    return re.sub(r"\W+", "_", column).strip("_").lower()
+
+
+def render(statement: str, params: Dict[str, Any]) -> str:
+    """The statement with its parameters written in as SQL literals, for prompts and the conversation history."""
+    return _BIND.sub(lambda match: "'" + str(params[match.group(1)]).replace("'", "''") + "'", statement)
+
+
+@dataclass(frozen=True)
+class Template:
+    shape: Tuple[str, ...]
+    statement: str
+    params: Tuple[str, ...]
+    parsed_question: Dict[str, Any]
+    source: str  # "seed" or "learned"
+
+
+class Slots(NamedTuple):
+    """A question reduced to its shape, plus the values it fills the shape's slots with."""
+    shape: Tuple[str, ...]
+    params: Dict[str, str]
+    order: Optional[str]
+
+
+class TemplateMatch(NamedTuple):
+    shape: str
+    statement: str
+    params: Dict[str, str]
+    sql_query: str
+    parsed_question: Dict[str, Any]
+
+
+class SQLTemplates:
+    """
+    Prepared statements for recurring question shapes.
+
+    A question's shape is its question_tokens with every noun index value
+    it names (city, cuisine, restaurant name) replaced by a slot for that
+    column, sort words by an order slot and price words by a slot for the
+    price column. "Best Italian restaurant in Madrid?" and "top Mexican
+    places in Sevilla" share the shape (restaurant, slot_city,
+    slot_cuisine, slot_order). A question whose shape has a template is
+    answered by executing the template with the slot values bound, without
+    the parse_question, generate_sql and validate_and_fix_sql calls.
+
+    Templates start from SEED_TEMPLATES (those that compile against the
+    schema) and are learned from execute_sql: a query that ran and found
+    rows is generalized by binding the literals the question's slots
+    account for. A query with any other literal, or whose ORDER BY does
+    not follow the question's sort word, is not a candidate. Once the same
+    statement has been written ``min_occurrences`` times for a shape, and
+    for at least ``min_agreement`` of that shape's questions, it becomes
+    the shape's template. Templates and candidates are dropped when the
+    schema changes.
+
+    Matching only looks for values of the columns some template binds, so
+    a question costs a lookup in a few small columns (city, cuisine, price
+    range) whatever else the noun index holds. Learning, which runs after
+    the answer is sent, looks at every indexed column.
+    """
+
+    def __init__(self, db_manager, noun_index, min_occurrences: int = 3, min_agreement: float = 0.8,
+                 max_candidates: int = 1000, seeds: Tuple[Tuple[str, str], ...] = SEED_TEMPLATES):
+        self.db_manager = db_manager
+        self.noun_index = noun_index
+        self.min_occurrences = min_occurrences
+        self.min_agreement = min_agreement
+        self.max_candidates = max_candidates
+        self.seeds = seeds
+        self._templates: Dict[Tuple[str, ...], Template] = {}
+        self._candidates: "OrderedDict[Tuple[str, ...], Counter]" = OrderedDict()
+        self._schema_version = None
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    @classmethod
+    def from_env(cls, db_manager, noun_index) -> Optional["SQLTemplates"]:
+        """SQL_TEMPLATES=0 sends every question through the LLM stages."""
+        if os.getenv("SQL_TEMPLATES", "1") == "0":
+            return None
+        return cls(db_manager, noun_index, min_occurrences=int(os.getenv("SQL_TEMPLATES_MIN_OCCURRENCES", "3")))
+
+    def _refresh(self) -> None:
+        """Reload the seeds when the schema changes; learned templates may no longer compile."""
+        version = self.db_manager.get_schema_snapshot().version[0]
+        if version == self._schema_version:
+            return
+        with self._lock:
+            if version == self._schema_version:
+                return
+            self._templates.clear()
+            self._candidates.clear()
+            for question, statement in self.seeds:
+                slots = self._shape(_PLACEHOLDER.sub(lambda match: f" slot_{slot_name(match.group(1))} ", question.lower()), {})
+                params = {name: "" for name in _BIND.findall(statement)}
+                template = self._template(slots.shape, statement, params, "seed") if slots is not None else None
+                if template is not None:
+                    self._templates[template.shape] = template
+            self._schema_version = version
+
+    def _price_column(self) -> Optional[Tuple[str, str]]:
+        return next(((table, column) for table, column in self.noun_index.columns() if "price" in column.lower()), None)
+
+    def _shape(self, text: str, params: Dict[str, str]) -> Optional[Slots]:
+        """Slots for text whose noun values are already replaced; None if it asks for two sort orders or prices."""
+        price_column = self._price_column()
+        order, tokens = None, set()
+        for token in question_tokens(text):
+            if token in SORT_WORDS:
+                if order not in (None, SORT_WORDS[token]):
+                    return None
+                order, token = SORT_WORDS[token], ORDER_SLOT
+            elif token in PRICE_WORDS and price_column is not None:
+                levels = sorted(self.noun_index.values(*price_column), key=lambda level: (len(level), level))
+                param = slot_name(price_column[1])
+                value = levels[PRICE_WORDS[token]] if levels else ""
+                if params.setdefault(param, value) != value:
+                    return None
+                token = f"slot_{param}"
+            tokens.add(token)
+        return Slots(tuple(sorted(tokens)), params, order)
+
+    def _slot_columns(self) -> List[Tuple[str, str]]:
+        """The indexed columns some template binds a value of."""
+        with self._lock:
+            params = {param for template in self._templates.values() for param in template.params}
+        return [(table, column) for table, column in self.noun_index.columns() if slot_name(column) in params]
+
+    def _slots(self, question: str, columns: Optional[List[Tuple[str, str]]] = None) -> Optional[Slots]:
+        """The question's shape and slot values (from values of columns, default all); None if it names two values of one column."""
+        text = question.lower()
+        params: Dict[str, str] = {}
+        for _, column, value in self.noun_index.mentions(question, columns):
+            pattern = rf"(?<!\w){re.escape(value.lower())}(?!\w)"
+            if not re.search(pattern, text):
+                continue  # part of a longer value that already took its place
+            param = slot_name(column)
+            if params.setdefault(param, value) != value:
+                return None
+            text = re.sub(pattern, f" slot_{param} ", text)
+        return self._shape(text, params)
+
+    def _parsed_question(self, statement: str, params) -> Dict[str, Any]:
+        """The parse_question result the statement answers, for follow-ups and SQL retries."""
+        snapshot = self.db_manager.get_schema_snapshot()
+        names = set(re.findall(r"\w+", statement))
+        relevant_tables = []
+        for table in snapshot.table_names():
+            if table in names:
+                columns = [column for column in snapshot.column_names(table) if column in names]
+                noun_columns = [column for column in columns if slot_name(column) in params]
+                relevant_tables.append({"table_name": table, "columns": columns, "noun_columns": noun_columns})
+        return {"is_relevant": True, "relevant_tables": relevant_tables}
+
+    def _template(self, shape: Tuple[str, ...], statement: str, params: Dict[str, str], source: str) -> Optional[Template]:
+        """A template if the statement binds exactly the shape's slots and compiles against the schema."""
+        slots = {token[len("slot_"):] for token in shape if token.startswith("slot_") and token != ORDER_SLOT}
+        if set(_BIND.findall(statement)) != slots or (ORDER in statement) != (ORDER_SLOT in shape):
+            return None
+        try:
+            self.db_manager.check_query_cost(statement.replace(ORDER, "DESC"), params)
+        except Exception as e:
+            logging.info(f"SQL template for {' '.join(shape)} rejected: {e}")
+            return None
+        return Template(shape, statement, tuple(sorted(slots)), self._parsed_question(statement, slots), source)
+
+    def _generalize(self, sql_query: str, slots: Slots) -> Optional[str]:
+        """sql_query with the slot values bound and the sort direction marked, or None if it does not fit the shape."""
+        by_value = {value: param for param, value in slots.params.items()}
+        if len(by_value) != len(slots.params):
+            return None
+        bound, unbound = set(), []
+
+        def bind(match) -> str:
+            value = match.group(1).replace("''", "'")
+            if value in by_value:
+                bound.add(by_value[value])
+                return f":{by_value[value]}"
+            if value not in CONSTANT_LITERALS:
+                unbound.append(value)
+            return match.group(0)
+
+        statement = _LITERAL.sub(bind, sql_query)
+        # A literal the question does not name came from somewhere else (an earlier turn, the model's guess)
+        if unbound or bound != set(slots.params) or _BIND.findall(sql_query):
+            return None
+        if slots.order is not None:
+            directions = _DIRECTION.findall(statement)
+            if len(directions) != 1 or directions[0].upper() != slots.order:
+                return None
+            statement = _DIRECTION.sub(ORDER, statement)
+        return statement
+
+    def match(self, question: str) -> Optional[TemplateMatch]:
+        """The prepared statement for the question's shape, or None if the shape has no template."""
+        self._refresh()
+        slots = self._slots(question, self._slot_columns())
+        template = self._templates.get(slots.shape) if slots is not None else None
+        with self._lock:
+            self.stats["hits" if template is not None else "misses"] += 1
+        if template is None:
+            return None
+        statement = template.statement.replace(ORDER, slots.order or "DESC")
+        params = {param: slots.params[param] for param in template.params}
+        return TemplateMatch(" ".join(template.shape), statement, params, render(statement, params), template.parsed_question)
+
+    def observe(self, question: str, sql_query: str) -> None:
+        """Count a query that answered question; its statement becomes a template once it recurs."""
+        self._refresh()
+        slots = self._slots(question)
+        statement = self._generalize(sql_query, slots) if slots is not None else None
+        if statement is None:
+            return
+        with self._lock:
+            if slots.shape in self._templates:
+                return
+            counts = self._candidates.setdefault(slots.shape, Counter())
+            self._candidates.move_to_end(slots.shape)
+            while len(self._candidates) > self.max_candidates:
+                self._candidates.popitem(last=False)
+            counts[statement] += 1
+            if counts[statement] < self.min_occurrences or counts[statement] < self.min_agreement * sum(counts.values()):
+                return
+        template = self._template(slots.shape, statement, slots.params, "learned")
+        with self._lock:
+            self._candidates.pop(slots.shape, None)
+            if template is not None:
+                self._templates[slots.shape] = template
+                self.stats["learned"] += 1
+                logging.info(f"Learned SQL template for {' '.join(slots.shape)}: {statement}")
+
+    def templates(self) -> List[Template]:
+        with self._lock:
+            return list(self._templates.values())
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                "hits": self.stats["hits"],
+                "misses": self.stats["misses"],
+                "learned": self.stats["learned"],
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                "templates": len(self._templates),
+                "seeded": sum(template.source == "seed" for template in self._templates.values()),
+                "candidates": len(self._candidates),
+            }
@@ -0,0 +1,72 @@
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import text
+
+_FENCE = re.compile(r"^```(?:sql)?\s*|\s*```$", re.IGNORECASE)
+_BACKTICKED = re.compile(r"`([^`]+)`")
+_ALIAS = re.compile(r"\bAS\s+`?(\w+)`?", re.IGNORECASE)
+# String literals, quoted identifiers and comments, which may contain a ";" that ends nothing
+_QUOTED = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|--[^\n]*|/\*.*?\*/", re.DOTALL)
+
+
+class SQLValidator:
+    """
+    Local check for LLM-generated SQL, run before asking the LLM validator.
+
+    A query passes when it is a single SELECT (or WITH) statement, every
+    backticked identifier is a table, column or alias known to the cached
+    schema snapshot, and SQLite can compile it with EXPLAIN. EXPLAIN
+    resolves every table and column without executing anything. Passing
+    queries skip the LLM round trip; failures carry the concrete error
+    so the LLM only has to fix it.
+    """
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def clean(sql_query: str) -> str:
+        """Strip markdown fences and a trailing semicolon the model sometimes adds."""
+        return _FENCE.sub("", sql_query.strip()).strip().rstrip(";").strip()
+
+    def _check(self, sql_query: str) -> Optional[str]:
+        if not re.match(r"^(SELECT|WITH)\b", sql_query, re.IGNORECASE):
+            return "Only a single SELECT statement is allowed"
+        if ";" in _QUOTED.sub(" ", sql_query).rstrip().rstrip(";"):
+            return "Only a single SQL statement is allowed"
+
+        snapshot = self.db_manager.get_schema_snapshot()
+        known = set(snapshot.table_names()) | set(_ALIAS.findall(sql_query))
+        for table in snapshot.table_names():
+            known.update(snapshot.column_names(table))
+        unknown = sorted({name for name in _BACKTICKED.findall(sql_query) if name not in known})
+        if unknown:
+            return f"Unknown table or column: {', '.join(unknown)}"
+
+        try:
+            with self.db_manager.get_engine().connect() as connection:
+                connection.execute(text(f"EXPLAIN {sql_query}"))
+        except Exception as e:
+            return str(getattr(e, "orig", e)).splitlines()[0]
+        return None
+
+    def validate(self, sql_query: str) -> Tuple[str, Optional[str]]:
+        """Return (cleaned query, error); error is None when the query is valid."""
+        sql_query = self.clean(sql_query)
+        error = self._check(sql_query)
+        with self._lock:
+            self.stats["fast_path" if error is None else "llm_fallback"] += 1
+        return sql_query, error
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.stats["fast_path"] + self.stats["llm_fallback"]
+            return {
+                **self.stats,
+                "fast_path_rate": self.stats["fast_path"] / total if total else 0.0,
+            }
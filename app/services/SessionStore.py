@@ -0,0 +1,200 @@
+import json
+import os
+import shelve
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Optional
+
+
+class SessionStore:
+    """
+    Conversation sessions keyed by WhatsApp id, stored in SQLite (WAL).
+
+    Replaces the shelve file that was opened on every message. Writes are
+    single upsert statements, so several Flask workers can record the same
+    wa_id at once without losing an update. Sessions idle for longer than
+    ``ttl`` seconds are expired. A small in-process LRU answers repeat
+    lookups; the database row is only touched again once ``touch_interval``
+    seconds have passed, which keeps last_seen accurate enough for the TTL.
+    Expired rows are swept at most once per ``expire_interval`` on write.
+    """
+
+    def __init__(
+        self,
+        db_path: str = "sessions.db",
+        ttl: float = 7 * 86400,
+        cache_size: int = 1024,
+        touch_interval: float = 60,
+        expire_interval: float = 3600,
+    ):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.touch_interval = touch_interval
+        self.expire_interval = expire_interval
+        self._last_expiry = 0.0
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "wa_id TEXT PRIMARY KEY, thread_id TEXT NOT NULL, name TEXT, "
+            "data TEXT NOT NULL DEFAULT '{}', created_at REAL NOT NULL, last_seen REAL NOT NULL)"
+        )
+        self._connection().execute("CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions (last_seen)")
+
+    @classmethod
+    def from_env(cls) -> "SessionStore":
+        """Build the store from the SESSION_* settings."""
+        return cls(
+            db_path=os.getenv("SESSION_DB_PATH", "sessions.db"),
+            ttl=float(os.getenv("SESSION_TTL_SECONDS", str(7 * 86400))),
+            cache_size=int(os.getenv("SESSION_CACHE_SIZE", "1024")),
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _session(row: sqlite3.Row) -> Dict[str, Any]:
+        session = dict(row)
+        session["data"] = json.loads(session["data"])
+        return session
+
+    def _remember(self, session: Dict[str, Any]) -> None:
+        with self._lock:
+            self._cache[session["wa_id"]] = session
+            self._cache.move_to_end(session["wa_id"])
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _forget(self, wa_id: str) -> None:
+        with self._lock:
+            self._cache.pop(wa_id, None)
+
+    def get(self, wa_id: str) -> Optional[Dict[str, Any]]:
+        """The live session for wa_id, or None if there is none or it has expired."""
+        now = time.time()
+        with self._lock:
+            session = self._cache.get(wa_id)
+            if session is not None and now - session["last_seen"] < self.ttl:
+                self._cache.move_to_end(wa_id)
+                self.hits += 1
+                return session
+            self.misses += 1
+        row = self._connection().execute(
+            "SELECT * FROM sessions WHERE wa_id = ? AND last_seen >= ?", (wa_id, now - self.ttl)
+        ).fetchone()
+        if row is None:
+            self._forget(wa_id)
+            return None
+        session = self._session(row)
+        self._remember(session)
+        return session
+
+    def upsert(self, wa_id: str, thread_id: str, name: Optional[str] = None, **data) -> Dict[str, Any]:
+        """
+        Create the session or refresh it in one statement.
+
+        thread_id and created_at are kept when the row already exists; name
+        is updated when given and ``data`` is merged into the stored data.
+        """
+        now = time.time()
+        if now - self._last_expiry > self.expire_interval:
+            self._last_expiry = now
+            self.expire()
+        row = self._connection().execute(
+            "INSERT INTO sessions (wa_id, thread_id, name, data, created_at, last_seen) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(wa_id) DO UPDATE SET "
+            "name = COALESCE(excluded.name, sessions.name), "
+            "last_seen = excluded.last_seen, "
+            # an expired row is a new conversation, not a continuation
+            "data = CASE WHEN sessions.last_seen < ? THEN excluded.data ELSE json_patch(sessions.data, excluded.data) END, "
+            "thread_id = CASE WHEN sessions.last_seen < ? THEN excluded.thread_id ELSE sessions.thread_id END, "
+            "created_at = CASE WHEN sessions.last_seen < ? THEN excluded.created_at ELSE sessions.created_at END "
+            "RETURNING *",
+            (wa_id, thread_id, name, json.dumps(data), now, now, *[now - self.ttl] * 3),
+        ).fetchone()
+        session = self._session(row)
+        self._remember(session)
+        return session
+
+    def touch(self, wa_id: str, thread_id: str, name: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Return the session for wa_id, creating it with thread_id if needed.
+
+        Cached sessions are returned without a write unless last_seen is
+        older than touch_interval.
+        """
+        session = self.get(wa_id)
+        if session is not None and time.time() - session["last_seen"] < self.touch_interval:
+            return session
+        return self.upsert(wa_id, thread_id, name)
+
+    def delete(self, wa_id: str) -> None:
+        self._connection().execute("DELETE FROM sessions WHERE wa_id = ?", (wa_id,))
+        self._forget(wa_id)
+
+    def expire(self) -> int:
+        """Delete sessions idle for longer than the TTL; returns how many were removed."""
+        cutoff = time.time() - self.ttl
+        removed = self._connection().execute("DELETE FROM sessions WHERE last_seen < ?", (cutoff,)).rowcount
+        with self._lock:
+            for wa_id in [wa_id for wa_id, session in self._cache.items() if session["last_seen"] < cutoff]:
+                del self._cache[wa_id]
+        return removed
+
+    def export(self, include_expired: bool = False) -> Iterator[Dict[str, Any]]:
+        """Yield every stored session, oldest activity first."""
+        cutoff = 0 if include_expired else time.time() - self.ttl
+        cursor = self._connection().execute(
+            "SELECT * FROM sessions WHERE last_seen >= ? ORDER BY last_seen", (cutoff,)
+        )
+        for row in cursor:
+            yield self._session(row)
+
+    def export_jsonl(self, path: str, include_expired: bool = False) -> int:
+        """Write the sessions to a JSON-lines file; returns the number written."""
+        count = 0
+        with open(path, "w") as handle:
+            for session in self.export(include_expired):
+                handle.write(json.dumps(session) + "\n")
+                count += 1
+        return count
+
+    def import_shelve(self, path: str = "threads_db") -> int:
+        """Copy wa_id -> thread_id pairs from the old shelve store; existing sessions win."""
+        now = time.time()
+        with shelve.open(path, flag="r") as threads_shelf:
+            pairs = [(wa_id, str(thread_id), now, now) for wa_id, thread_id in threads_shelf.items()]
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT OR IGNORE INTO sessions (wa_id, thread_id, created_at, last_seen) VALUES (?, ?, ?, ?)", pairs
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return len(pairs)
+
+    def __len__(self) -> int:
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM sessions WHERE last_seen >= ?", (time.time() - self.ttl,)
+        ).fetchone()[0]
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"sessions": len(self), "cached": len(self._cache), "cache_hits": self.hits, "cache_misses": self.misses}
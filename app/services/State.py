@@ -1,6 +1,13 @@
 from typing import List, Any, Annotated, Dict, Optional
 from typing_extensions import TypedDict
-import operator
+
+
+def add_text(left: Optional[str], right: Optional[str]) -> str:
+    """Concatenate text updates; None starts the channel over for a new conversation turn."""
+    if right is None:
+        return ""
+    return (left or "") + right
+
 
 class InputState(TypedDict):
     question: str
@@ -9,7 +16,16 @@ class InputState(TypedDict):
     unique_nouns: List[str]
     sql_query: str
     results: List[Any]
-    recommendation: Annotated[str, operator.add]
+    results_truncated: bool
+    error: str
+    sql_attempts: int
+    answer: Annotated[str, add_text]
+    recommendation: Annotated[str, add_text]
+    history: List[Dict[str, str]]
+    summary: str
+    follow_up: bool
+    plan_failed: bool
+    sql_template: Optional[Dict[str, Any]]
 
 class OutputState(TypedDict):
     parsed_question: Dict[str, Any]
@@ -18,7 +34,9 @@ class OutputState(TypedDict):
     sql_valid: bool
     sql_issues: str
     results: List[Any]
-    answer: Annotated[str, operator.add]
+    results_truncated: bool
+    answer: Annotated[str, add_text]
     error: str
-    recommendation: Annotated[str, operator.add]
-    recommendation_reason: Annotated[str, operator.add]
\ No newline at end of file
+    recommendation: Annotated[str, add_text]
+    recommendation_reason: Annotated[str, add_text]
+    formatted_data_for_recommendation: Dict[str, Any]
@@ -0,0 +1,219 @@
+import bisect
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+# Upper bounds (ms) of the histogram buckets reported on /metrics
+BUCKET_BOUNDS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+@dataclass
+class TraceContext:
+    """One incoming WhatsApp message: every span recorded while it is active shares its trace_id."""
+    trace_id: str
+    wa_id: Optional[str] = None
+    message_id: Optional[str] = None
+
+
+@dataclass
+class Span:
+    name: str
+    trace: Optional[TraceContext]
+    parent_id: Optional[str]
+    span_id: str = field(default_factory=lambda: secrets.token_hex(8))
+    start_ns: int = field(default_factory=time.time_ns)
+    duration: float = 0.0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """The span in OTLP/JSON field names, so the JSONL file can be replayed into an OTel collector."""
+        attributes = dict(self.attributes)
+        if self.trace is not None:
+            attributes.update({"wa_id": self.trace.wa_id, "message_id": self.trace.message_id})
+        return {
+            "traceId": self.trace.trace_id if self.trace else None,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.start_ns + int(self.duration * 1e9),
+            "attributes": {key: value for key, value in attributes.items() if value is not None},
+            "status": {"code": "ERROR", "message": self.error} if self.error else {"code": "OK"},
+        }
+
+
+class LatencyHistogram:
+    """Fixed-bucket histogram plus a sliding window of recent samples for percentiles."""
+
+    def __init__(self, window: int = 2000):
+        self.count = 0
+        self.errors = 0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.recent: Deque[float] = deque(maxlen=window)
+
+    def observe(self, seconds: float, error: bool = False) -> None:
+        ms = seconds * 1000
+        self.count += 1
+        self.errors += error
+        self.max = max(self.max, ms)
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS_MS, ms)] += 1
+        self.recent.append(ms)
+
+    def as_dict(self) -> Dict[str, Any]:
+        ordered = sorted(self.recent)
+
+        def percentile(p: float) -> float:
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 2) if ordered else 0.0
+
+        labels = [f"<={bound}ms" for bound in BUCKET_BOUNDS_MS] + [f">{BUCKET_BOUNDS_MS[-1]}ms"]
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(self.max, 2),
+            "histogram": {label: n for label, n in zip(labels, self.buckets) if n},
+        }
+
+
+class JSONLSpanExporter:
+    """Appends each finished span to a JSON-lines file as an OTLP-shaped record."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", buffering=1)
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_otlp(), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+
+_current_trace: contextvars.ContextVar[Optional[TraceContext]] = contextvars.ContextVar("trace", default=None)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("span", default=None)
+
+
+class Tracer:
+    """
+    Records wall time for pipeline stages and external calls.
+
+    ``trace`` opens a trace for one incoming message (wa_id + message id);
+    ``span`` times a block inside it and nests under the enclosing span.
+    Both use contextvars, so spans follow the request into LangGraph's
+    worker threads and asyncio tasks. Every finished span updates the
+    per-name latency histogram shown on /metrics and is handed to the
+    exporters (see TRACE_EXPORT_PATH).
+    """
+
+    def __init__(self, exporters: Optional[List[Any]] = None, enabled: bool = True):
+        self.enabled = enabled
+        self.exporters = list(exporters or [])
+        self._histograms: Dict[str, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        """TRACE_ENABLED=0 turns tracing off; TRACE_EXPORT_PATH names a JSONL file to export spans to."""
+        exporters = []
+        path = os.getenv("TRACE_EXPORT_PATH", "")
+        if path:
+            exporters.append(JSONLSpanExporter(path))
+        return cls(exporters=exporters, enabled=os.getenv("TRACE_ENABLED", "1") != "0")
+
+    @staticmethod
+    def current() -> Optional[TraceContext]:
+        return _current_trace.get()
+
+    @contextlib.contextmanager
+    def attach(self, trace: Optional[TraceContext]) -> Iterator[None]:
+        """Make an existing trace current, e.g. inside a coroutine handed to another thread's loop."""
+        token = _current_trace.set(trace)
+        try:
+            yield
+        finally:
+            _current_trace.reset(token)
+
+    def propagate(self, coro):
+        """Wrap a coroutine so it runs under the caller's trace and span when scheduled on another loop."""
+        trace, parent = _current_trace.get(), _current_span.get()
+
+        async def run():
+            _current_trace.set(trace)
+            _current_span.set(parent)
+            return await coro
+        return run()
+
+    @contextlib.contextmanager
+    def trace(self, name: str, wa_id: Optional[str] = None, message_id: Optional[str] = None, **attributes) -> Iterator[Span]:
+        """Start a new trace for one message, with a root span called ``name``."""
+        trace = TraceContext(trace_id=secrets.token_hex(16), wa_id=wa_id, message_id=message_id)
+        with self.attach(trace), self.span(name, **attributes) as span:
+            yield span
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """Time the enclosed block; attributes can be added to the yielded span before it ends."""
+        if not self.enabled:
+            yield Span(name, None, None)
+            return
+        parent = _current_span.get()
+        span = Span(name, _current_trace.get(), parent.span_id if parent else None, attributes=attributes)
+        token = _current_span.set(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.duration = time.perf_counter() - started
+            _current_span.reset(token)
+            self._finish(span)
+
+    def _finish(self, span: Span) -> None:
+        with self._lock:
+            histogram = self._histograms.get(span.name)
+            if histogram is None:
+                histogram = self._histograms[span.name] = LatencyHistogram()
+            histogram.observe(span.duration, error=span.error is not None)
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception as e:
+                logging.warning(f"Span export failed: {e}")
+
+    def traced(self, name: str, fn: Callable) -> Callable:
+        """Wrap a sync or async callable (e.g. a graph node) in a span."""
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with self.span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: histogram.as_dict() for name, histogram in sorted(self._histograms.items())}
+
+
+tracer = Tracer.from_env()
@@ -0,0 +1,232 @@
+import asyncio
+import importlib.util
+import json
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Union
+
+import httpx
+
+# Graph API error codes that mean "slow down" even when the status is not 429
+RATE_LIMIT_ERROR_CODES = {4, 80007, 130429, 131048, 131056}
+
+
+class WhatsAppSendError(Exception):
+    """The Graph API rejected a message, or kept failing after every retry."""
+
+    def __init__(self, status_code: int, body: str):
+        super().__init__(f"WhatsApp API returned {status_code}: {body[:200]}")
+        self.status_code = status_code
+        self.body = body
+
+
+class TokenBucket:
+    """
+    Token bucket for one event loop: ``reserve`` takes a token and returns
+    how long the caller has to wait for it, so waiting callers queue up in
+    order instead of polling.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class WhatsAppSender:
+    """
+    Sends messages to the WhatsApp Cloud API over one pooled HTTP client.
+
+    The httpx client keeps connections alive between messages and uses
+    HTTP/2 when the ``h2`` package is installed. 429 and 5xx responses (and
+    Graph rate-limit error codes) are retried with jittered exponential
+    backoff, waiting at least as long as Retry-After asks. Outbound messages
+    pass two token buckets: one for the business phone number's throughput
+    and one per recipient, so a burst to one user cannot starve the rest.
+
+    The client lives on a private event loop thread; ``send``/``send_batch``
+    are the blocking entry points for the job queue workers and ``asend``/
+    ``asend_batch`` can be awaited from that loop. ``base_url`` can point at
+    a local stub server (see benchmarks/stub_graph_api.py).
+    """
+
+    def __init__(
+        self,
+        access_token: str,
+        phone_number_id: str,
+        version: str,
+        base_url: str = "https://graph.facebook.com",
+        max_retries: int = 4,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        timeout: float = 10.0,
+        max_connections: int = 20,
+        rate_per_second: float = 80.0,
+        recipient_rate_per_second: float = 1.0,
+        recipient_burst: int = 10,
+        max_tracked_recipients: int = 10000,
+    ):
+        self.url = f"{base_url.rstrip('/')}/{version}/{phone_number_id}/messages"
+        self.headers = {"Content-type": "application/json", "Authorization": f"Bearer {access_token}"}
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.http2 = importlib.util.find_spec("h2") is not None
+        self.recipient_rate_per_second = recipient_rate_per_second
+        self.recipient_burst = recipient_burst
+        self.max_tracked_recipients = max_tracked_recipients
+        self._phone_bucket = TokenBucket(rate_per_second, rate_per_second)
+        self._recipient_buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop = None
+        self._loop_lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.throttled_seconds = 0.0
+
+    @classmethod
+    def from_config(cls, config) -> "WhatsAppSender":
+        """Build the sender from the Flask config (see app/config.py)."""
+        return cls(
+            access_token=config["ACCESS_TOKEN"],
+            phone_number_id=config["PHONE_NUMBER_ID"],
+            version=config["VERSION"],
+            base_url=config["WHATSAPP_API_BASE_URL"],
+            max_retries=config["WHATSAPP_MAX_RETRIES"],
+            rate_per_second=config["WHATSAPP_RATE_PER_SECOND"],
+            recipient_rate_per_second=config["WHATSAPP_RECIPIENT_RATE_PER_SECOND"],
+            recipient_burst=config["WHATSAPP_RECIPIENT_BURST"],
+        )
+
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="whatsapp-sender", daemon=True).start()
+            return self._loop
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=self.http2,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            )
+        return self._client
+
+    async def _throttle(self, recipient: Optional[str]) -> None:
+        wait = self._phone_bucket.reserve()
+        if recipient:
+            bucket = self._recipient_buckets.get(recipient)
+            if bucket is None:
+                bucket = self._recipient_buckets[recipient] = TokenBucket(self.recipient_rate_per_second, self.recipient_burst)
+                if len(self._recipient_buckets) > self.max_tracked_recipients:
+                    self._recipient_buckets.popitem(last=False)
+            self._recipient_buckets.move_to_end(recipient)
+            wait = max(wait, bucket.reserve())
+        if wait > 0:
+            self.throttled_seconds += wait
+            await asyncio.sleep(wait)
+
+    def _backoff(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, min(self.backoff_max, float(retry_after)))
+            except ValueError:
+                pass
+        return delay
+
+    @staticmethod
+    def _retryable(response: httpx.Response) -> bool:
+        if response.status_code == 429 or response.status_code >= 500:
+            return True
+        try:
+            code = response.json().get("error", {}).get("code")
+        except (ValueError, AttributeError):
+            return False
+        return code in RATE_LIMIT_ERROR_CODES
+
+    async def asend(self, data: Union[str, Dict[str, Any]]) -> httpx.Response:
+        """
+        Send one message payload (the JSON from get_text_message_input, or a dict).
+
+        Returns the successful response; raises WhatsAppSendError for a
+        rejected message and httpx errors when the API stays unreachable.
+        """
+        payload = json.loads(data) if isinstance(data, str) else data
+        body = json.dumps(payload)
+        recipient = payload.get("to")
+        await self._throttle(recipient)
+        attempt = 0
+        while True:
+            response = None
+            try:
+                response = await self._http().post(self.url, content=body, headers=self.headers)
+                if response.status_code < 400:
+                    self.sent += 1
+                    logging.info(f"Message to {recipient} sent: {response.status_code} ({response.http_version})")
+                    logging.debug(f"Body: {response.text}")
+                    return response
+                if not self._retryable(response) or attempt >= self.max_retries:
+                    raise WhatsAppSendError(response.status_code, response.text)
+            except httpx.TransportError:
+                if attempt >= self.max_retries:
+                    self.failed += 1
+                    raise
+            except WhatsAppSendError:
+                self.failed += 1
+                raise
+            delay = self._backoff(attempt, response)
+            attempt += 1
+            self.retries += 1
+            logging.warning(f"Retrying message to {recipient} in {delay:.2f}s (attempt {attempt}/{self.max_retries})")
+            await asyncio.sleep(delay)
+
+    async def asend_batch(self, payloads: List[Union[str, Dict[str, Any]]]) -> List[Union[httpx.Response, Exception]]:
+        """Send payloads concurrently; each result is the response or the exception it raised."""
+        # Queueing more requests than pooled connections only makes the pool rescan its waiters
+        slots = asyncio.Semaphore(self.max_connections)
+
+        async def send(payload):
+            async with slots:
+                return await self.asend(payload)
+        return await asyncio.gather(*(send(payload) for payload in payloads), return_exceptions=True)
+
+    def send(self, data: Union[str, Dict[str, Any]]) -> httpx.Response:
+        """Blocking version of asend for worker threads."""
+        return asyncio.run_coroutine_threadsafe(self.asend(data), self._event_loop()).result()
+
+    def send_batch(self, payloads: List[Union[str, Dict[str, Any]]]) -> List[Union[httpx.Response, Exception]]:
+        """Blocking version of asend_batch."""
+        return asyncio.run_coroutine_threadsafe(self.asend_batch(payloads), self._event_loop()).result()
+
+    def close(self) -> None:
+        """Close the pooled connections."""
+        if self._client is not None and self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result()
+            self._client = None
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+            "http2": self.http2,
+        }
@@ -1,57 +1,397 @@
 
-<<<<<<< HEAD
-from SQLAgent import SQLAgent
-from State import InputState, OutputState
-=======
 from app.services.SQLAgent import SQLAgent
 from app.services.State import InputState, OutputState
->>>>>>> 69a94044205ec7ebdabb3d49af6431e7c830a426
+from app.services.AnswerCache import AnswerCache
+from app.services.ConversationMemory import ConversationMemory
+from app.services.RelevanceFilter import RelevanceFilter
+from app.services.Tracing import tracer
 from langgraph.graph import END, START, StateGraph
+import asyncio
 import logging
+import threading
 import sys
 import os
+import queue
+import sqlite3
+from typing import AsyncIterator, Iterator, Optional, Tuple
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '/Users/main/Desktop/chatbot/bot/lib/python3.13/site-packages')))
 
-        
+_DEFAULT = object()
+_STREAM_END = object()
+
+# What a follow-up needs from the turn it refines; cached with the answer so a cache hit can stand in for the turn
+TURN_CONTEXT = ("parsed_question", "unique_nouns", "sql_query")
+
+# "staged": parse_question -> get_unique_nouns -> generate_sql -> validate_and_fix_sql
+# "fast": one plan_sql call, falling back to the staged chain when the plan is unusable
+WORKFLOW_MODES = ("staged", "fast")
+
+
 class Workflow:
-    def __init__(self):
+    def __init__(self, use_async: bool = True, memory: Optional[ConversationMemory] = _DEFAULT, mode: Optional[str] = None):
         self.sql_agent = SQLAgent()
+        self.use_async = use_async
+        self.mode = mode or os.getenv("WORKFLOW_MODE", "staged")
+        if self.mode not in WORKFLOW_MODES:
+            raise ValueError(f"Unknown WORKFLOW_MODE {self.mode!r}; expected one of {', '.join(WORKFLOW_MODES)}")
+        # Per-wa_id history through LangGraph checkpoints; None runs every message on its own
+        self.memory = ConversationMemory.from_env() if memory is _DEFAULT else memory
+        # City, cuisine and restaurant names must match exactly for a cached answer to be reused
+        self.answer_cache = AnswerCache(is_protected=lambda word: self.sql_agent.noun_index.contains_word(word))
+        # Small talk and off-topic messages are answered from templates before they reach the graph
+        self.relevance_filter = RelevanceFilter.from_env(
+            known_words=lambda: self.sql_agent.noun_index.words(),
+            schema=lambda: self.sql_agent.db_manager.get_schema_snapshot(),
+        )
+        self._graphs = {}
+        self._graph_lock = threading.Lock()
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    def create_workflow(self, asynchronous: bool = False) -> StateGraph:
+        """Create and configure the workflow graph.
 
-    def create_workflow(self) -> StateGraph:
-        """Create and configure the workflow graph."""
+        With asynchronous=True the nodes are the SQLAgent coroutines, so one
+        event loop can serve many conversations while they wait on the LLM.
+        compose_answer writes the answer, the recommendation and the top
+        restaurants in a single call.
+
+        With conversation memory the graph starts at start_turn, which sends
+        follow-up questions straight to generate_sql, and ends at end_turn,
+        which records the turn in the checkpointed history.
+
+        In "fast" mode new questions start at plan_sql, which does the work
+        of the four stages before execute_sql in one LLM call. A plan that
+        is malformed, flagged by its own check or rejected by the local SQL
+        validator continues at parse_question, so the staged chain is only
+        paid for when the single call fails.
+
+        Unless SQL_TEMPLATES=0, new questions first go to match_template:
+        a question whose shape has an SQL template goes straight to
+        execute_sql with the template's prepared statement, skipping the
+        LLM stages before it.
+        """
         workflow = StateGraph(input=InputState, output=OutputState)
+        agent = self.sql_agent
+        node = lambda name: tracer.traced(f"node.{name}", getattr(agent, f"a{name}" if asynchronous else name))
 
         # Add nodes to the graph
-        workflow.add_node("parse_question", self.sql_agent.parse_question)
-        workflow.add_node("get_unique_nouns", self.sql_agent.get_unique_nouns)
-        workflow.add_node("generate_sql", self.sql_agent.generate_sql)
-        workflow.add_node("validate_and_fix_sql", self.sql_agent.validate_and_fix_sql)
-        workflow.add_node("execute_sql", self.sql_agent.execute_sql)
-        workflow.add_node("format_results", self.sql_agent.format_results)
-        workflow.add_node("choose_recommendation", self.sql_agent.choose_recommendation)
+        workflow.add_node("parse_question", node("parse_question"))
+        workflow.add_node("get_unique_nouns", node("get_unique_nouns"))
+        workflow.add_node("generate_sql", node("generate_sql"))
+        workflow.add_node("validate_and_fix_sql", node("validate_and_fix_sql"))
+        workflow.add_node("execute_sql", node("execute_sql"))
+        workflow.add_node("compose_answer", node("compose_answer"))
         
         # Define edges
         workflow.add_edge("parse_question", "get_unique_nouns")
         workflow.add_edge("get_unique_nouns", "generate_sql")
         workflow.add_edge("generate_sql", "validate_and_fix_sql")
         workflow.add_edge("validate_and_fix_sql", "execute_sql")
-        workflow.add_edge("execute_sql", "format_results")
-        workflow.add_edge("execute_sql", "choose_recommendation")
-        workflow.add_edge("choose_recommendation", END)
-        workflow.add_edge("format_results", END)
-        workflow.set_entry_point("parse_question")
+        entry = "parse_question"
+        if self.mode == "fast":
+            workflow.add_node("plan_sql", node("plan_sql"))
+            workflow.add_conditional_edges(
+                "plan_sql",
+                lambda state: "parse_question" if state.get('plan_failed') else "execute_sql",
+                ["parse_question", "execute_sql"],
+            )
+            entry = "plan_sql"
+        if agent.sql_templates is not None:
+            llm_entry = entry
+            workflow.add_node("match_template", node("match_template"))
+            workflow.add_conditional_edges(
+                "match_template",
+                lambda state: "execute_sql" if state.get('sql_template') else llm_entry,
+                ["execute_sql", llm_entry],
+            )
+            entry = "match_template"
+        workflow.add_conditional_edges(
+            "execute_sql",
+            self._route_after_execute,
+            ["generate_sql", "compose_answer"],
+        )
+        if self.memory is None:
+            workflow.add_edge("compose_answer", END)
+            workflow.set_entry_point(entry)
+            return workflow
+
+        memory = self.memory
+        workflow.add_node("start_turn", tracer.traced("node.start_turn", lambda state: memory.start_turn(state, agent.noun_index.lookup)))
+        workflow.add_node("end_turn", tracer.traced("node.end_turn", memory.end_turn))
+        workflow.add_conditional_edges(
+            "start_turn",
+            lambda state: "generate_sql" if state.get('follow_up') else entry,
+            ["generate_sql", entry],
+        )
+        workflow.add_edge("compose_answer", "end_turn")
+        workflow.add_edge("end_turn", END)
+        workflow.set_entry_point("start_turn")
 
         return workflow
-    
+
+    def _route_after_execute(self, state: dict):
+        """Retry generation when the query failed or was rejected, else answer from the results."""
+        if self.sql_agent.needs_new_sql(state):
+            return "generate_sql"
+        return "compose_answer"
+
+    def get_graph(self, asynchronous: bool = False):
+        """Return the compiled workflow, compiling it on first use.
+
+        The compiled graph holds no per-request state, so a single instance is
+        shared by every Flask worker thread. The lock only guards the first
+        compilation (and the one after an invalidation).
+        """
+        graph = self._graphs.get(asynchronous)
+        if graph is None:
+            with self._graph_lock:
+                if asynchronous not in self._graphs:
+                    logging.info(f"Compiling SQL agent workflow graph (mode={self.mode}, async={asynchronous})")
+                    self._graphs[asynchronous] = self.create_workflow(asynchronous).compile(
+                        checkpointer=self._checkpointer(asynchronous)
+                    )
+                graph = self._graphs[asynchronous]
+        return graph
+
+    def _checkpointer(self, asynchronous: bool):
+        if self.memory is None:
+            return None
+        if not asynchronous:
+            return self.memory.checkpointer()
+        try:
+            asyncio.get_running_loop()
+            return self.memory.async_checkpointer()
+        except RuntimeError:
+            pass
+
+        async def build():
+            return self.memory.async_checkpointer()
+        # Bind the aiosqlite connection to the loop that runs the async workflows
+        return asyncio.run_coroutine_threadsafe(build(), self._event_loop()).result()
+
+    def _config(self, uuid: str) -> Optional[dict]:
+        return self.memory.config(uuid) if self.memory is not None else None
+
+    def _cacheable(self, question: str) -> bool:
+        """Follow-ups depend on the earlier turns, so they bypass the answer cache."""
+        return self.memory is None or not self.memory.looks_like_follow_up(question)
+
+    def _early_answer(self, question: str, data_version) -> Optional[Tuple[dict, dict]]:
+        """
+        A template reply for small talk or off-topic messages, else a cached
+        answer; either skips the graph. Returned with the turn context
+        (TURN_CONTEXT keys) the answer stands for, empty for template replies.
+        """
+        cacheable = self._cacheable(question)
+        if self.relevance_filter is not None:
+            with tracer.span("relevance_filter") as span:
+                verdict = self.relevance_filter.classify(question)
+                span.attributes["label"] = verdict.label
+            # A follow-up that reads as off topic ("the second one?") may still refer back to the conversation
+            if not verdict.is_database and (cacheable or verdict.label != "off_topic"):
+                return {
+                    "answer": verdict.reply,
+                    "recommendation": "None",
+                    "recommendation_reason": "",
+                    "formatted_data_for_recommendation": {},
+                }, {}
+        return self.answer_cache.get(question, data_version) if cacheable else None
+
+    def _early_turn(self, values: dict, question: str, answer: dict, context: dict) -> Optional[dict]:
+        """
+        The checkpoint update that records an early answer as a turn of the
+        thread whose state is ``values``, as end_turn would have. A cache hit
+        also replaces the context a follow-up refines; a template reply only
+        adds to the history. None for a template reply on a new thread.
+        """
+        if not values and not context:
+            return None
+        update = {"question": question, **context}
+        update.update(self.memory.end_turn({**values, **update, "answer": answer.get('answer') or ""}))
+        return update
+
+    def _remember(self, uuid: str, question: str, answer: dict, context: dict) -> None:
+        if self.memory is None:
+            return
+        app, config = self.get_graph(), self._config(uuid)
+        update = self._early_turn(app.get_state(config).values, question, answer, context)
+        if update is not None:
+            app.update_state(config, update, as_node="end_turn")
+        self._compact(uuid)
+
+    async def _aremember(self, uuid: str, question: str, answer: dict, context: dict) -> None:
+        if self.memory is None:
+            return
+        app, config = self.get_graph(asynchronous=True), self._config(uuid)
+        update = self._early_turn((await app.aget_state(config)).values, question, answer, context)
+        if update is not None:
+            await app.aupdate_state(config, update, as_node="end_turn")
+        await asyncio.to_thread(self._compact, uuid)
+
+    def _compact(self, uuid: str) -> None:
+        """Drop the thread's superseded checkpoints once a run has written its last one."""
+        if self.memory is None:
+            return
+        try:
+            self.memory.compact(uuid)
+        except sqlite3.Error as e:
+            logging.warning(f"Could not compact the conversation checkpoints for {uuid}: {e}")
+
+    def invalidate_graph(self) -> None:
+        """Drop the compiled graphs so the next request rebuilds them.
+
+        Call this after changing the nodes or edges in create_workflow.
+        """
+        with self._graph_lock:
+            self._graphs = {}
+
     def returnGraph(self):
-        return self.create_workflow().compile()
+        return self.get_graph()
 
-    def run_sql_agent(self, question: str, uuid: str) -> dict:
-        """Run the SQL agent workflow and return the formatted answer and visualization recommendation."""
-        app = self.create_workflow().compile()
-        result = app.invoke({"question": question, "uuid": uuid})
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        """Return the long-lived event loop that runs async workflows.
+
+        One loop in a daemon thread serves every conversation, which keeps
+        the async OpenAI client bound to a single loop.
+        """
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="workflow-loop", daemon=True).start()
+            return self._loop
+
+    @staticmethod
+    def _format_result(result: dict) -> dict:
         return {
             "answer": result['answer'],
             "recommendation": result['recommendation'],
-            "recommendation_reason": result['recommendation_reason']
-        }
\ No newline at end of file
+            "recommendation_reason": result['recommendation_reason'],
+            "formatted_data_for_recommendation": result.get('formatted_data_for_recommendation') or {},
+        }
+
+    @staticmethod
+    def _cached_events(cached: dict) -> Iterator[Tuple[str, dict]]:
+        """The events an early answer stands in for, so streaming callers see the same sequence."""
+        yield "compose_answer", dict(cached)
+        yield "done", cached
+
+    @staticmethod
+    def _collect(result: dict, context: dict, update: Optional[dict]) -> None:
+        for key in ("answer", "recommendation", "recommendation_reason"):
+            if update and update.get(key):
+                result[key] += update[key]
+        if update and update.get('formatted_data_for_recommendation'):
+            result['formatted_data_for_recommendation'] = update['formatted_data_for_recommendation']
+        context.update((key, update[key]) for key in TURN_CONTEXT if update and key in update)
+
+    @staticmethod
+    def _turn_context(result: dict) -> dict:
+        return {key: result[key] for key in TURN_CONTEXT if key in result}
+
+    def _cache_answer(self, question: str, data_version, answer: dict, context: dict) -> dict:
+        if answer.get('answer') and self._cacheable(question):
+            self.answer_cache.put(question, (answer, context), data_version)
+        return answer
+
+    async def arun_sql_agent(self, question: str, uuid: str) -> dict:
+        """Async version of run_sql_agent; other conversations run on the loop while this one waits on the LLM."""
+        data_version = await asyncio.to_thread(self.sql_agent.db_manager.data_version)
+        early = await asyncio.to_thread(self._early_answer, question, data_version)
+        if early is not None:
+            await self._aremember(uuid, question, *early)
+            return early[0]
+        app = self.get_graph(asynchronous=True)
+        result = await app.ainvoke({"question": question, "uuid": uuid}, self._config(uuid))
+        await asyncio.to_thread(self._compact, uuid)
+        return self._cache_answer(question, data_version, self._format_result(result), self._turn_context(result))
+
+    async def astream_sql_agent(self, question: str, uuid: str) -> AsyncIterator[Tuple[str, dict]]:
+        """Async version of stream_sql_agent."""
+        data_version = await asyncio.to_thread(self.sql_agent.db_manager.data_version)
+        early = await asyncio.to_thread(self._early_answer, question, data_version)
+        if early is not None:
+            await self._aremember(uuid, question, *early)
+            for event in self._cached_events(early[0]):
+                yield event
+            return
+        app = self.get_graph(asynchronous=True)
+        result = {"answer": "", "recommendation": "", "recommendation_reason": "", "formatted_data_for_recommendation": {}}
+        context = {}
+        async for chunk in app.astream({"question": question, "uuid": uuid}, self._config(uuid), stream_mode="updates"):
+            for node, update in chunk.items():
+                self._collect(result, context, update)
+                yield node, update
+        await asyncio.to_thread(self._compact, uuid)
+        yield "done", self._cache_answer(question, data_version, result, context)
+
+    def stream_sql_agent(self, question: str, uuid: str) -> Iterator[Tuple[str, dict]]:
+        """Run the workflow, yielding (node, update) as each node finishes, then ("done", answer).
+
+        compose_answer yields the answer and recommendation before end_turn
+        has written the checkpoint, so callers can reply before the whole
+        graph is done. The final "done" event carries what run_sql_agent
+        returns.
+        In async mode the graph runs on the shared loop and events are
+        handed to the calling thread through a queue, so slow consumers
+        never block the loop.
+        """
+        if not self.use_async:
+            data_version = self.sql_agent.db_manager.data_version()
+            early = self._early_answer(question, data_version)
+            if early is not None:
+                self._remember(uuid, question, *early)
+                yield from self._cached_events(early[0])
+                return
+            app = self.get_graph()
+            result = {"answer": "", "recommendation": "", "recommendation_reason": "", "formatted_data_for_recommendation": {}}
+            context = {}
+            for chunk in app.stream({"question": question, "uuid": uuid}, self._config(uuid), stream_mode="updates"):
+                for node, update in chunk.items():
+                    self._collect(result, context, update)
+                    yield node, update
+            self._compact(uuid)
+            yield "done", self._cache_answer(question, data_version, result, context)
+            return
+
+        events = queue.Queue()
+
+        async def produce():
+            try:
+                async for event in self.astream_sql_agent(question, uuid):
+                    events.put(event)
+            finally:
+                events.put(_STREAM_END)
+
+        future = asyncio.run_coroutine_threadsafe(tracer.propagate(produce()), self._event_loop())
+        while True:
+            event = events.get()
+            if event is _STREAM_END:
+                break
+            yield event
+        future.result()  # re-raise a failure from the graph
+
+    def run_sql_agent(self, question: str, uuid: str) -> dict:
+        """Run the SQL agent workflow and return the formatted answer and visualization recommendation.
+
+        Small talk and off-topic messages get a template reply from
+        relevance_filter, and answers are served from answer_cache when the
+        same (or a closely paraphrased) question was answered against the
+        current data. With conversation memory, uuid is the wa_id whose
+        history the question continues; early answers are recorded in that
+        history too, and a cache hit becomes the turn follow-ups refine.
+        """
+        if self.use_async:
+            future = asyncio.run_coroutine_threadsafe(
+                tracer.propagate(self.arun_sql_agent(question, uuid)), self._event_loop()
+            )
+            return future.result()
+        data_version = self.sql_agent.db_manager.data_version()
+        early = self._early_answer(question, data_version)
+        if early is not None:
+            self._remember(uuid, question, *early)
+            return early[0]
+        app = self.get_graph()
+        result = app.invoke({"question": question, "uuid": uuid}, self._config(uuid))
+        self._compact(uuid)
+        return self._cache_answer(question, data_version, self._format_result(result), self._turn_context(result))
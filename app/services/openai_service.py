@@ -1,5 +1,4 @@
 from openai import OpenAI
-import shelve
 from dotenv import load_dotenv
 import os
 import time
@@ -7,6 +6,7 @@ import logging
 from pathlib import Path
 from app.services.WorkflowManager import Workflow
 from app.services.State import InputState, OutputState
+from app.services.SessionStore import SessionStore
 
 
 load_dotenv()
@@ -14,28 +14,26 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_ASSISTANT_ID = os.getenv("OPENAI_ASSISTANT_ID")
 
 agent_executor = Workflow()
-
-agent_executor = Workflow()
+session_store = SessionStore.from_env()
 
 client=OpenAI()
 
 def check_if_thread_exists(wa_id):
-    with shelve.open("threads_db") as threads_shelf:
-        return threads_shelf.get(wa_id, None)
+    session = session_store.get(wa_id)
+    return session["thread_id"] if session else None
 
 
-def store_thread(wa_id, thread_id):
-    with shelve.open("threads_db", writeback=True) as threads_shelf:
-        threads_shelf[wa_id] = thread_id
+def store_thread(wa_id, thread_id, name=None):
+    session_store.upsert(wa_id, thread_id, name)
 
-def run_assistant(query, name):
+def run_assistant(query, name, wa_id=None):
     """
     Run the LangChain SQL agent to process a query and return the response.
->>>>>>> 69a94044205ec7ebdabb3d49af6431e7c830a426
 
     Parameters:
         query (str): The SQL query or question to ask the agent.
         name (str): The name of the user (for logging or personalized prompts, if needed).
+        wa_id (str): The WhatsApp ID whose conversation history the query continues.
 
     Returns:
         str: The response generated by the LangChain SQL agent.
@@ -43,6 +41,51 @@ def run_assistant(query, name):
     try:
         # Log the received query for tracking
         logging.info(f"Received query from {name}: {query}")
+        response = agent_executor.run_sql_agent(query, wa_id or name)
+        logging.info(f"Generated response for {name}: {response}")
+        return response
+    except Exception as e:
+        logging.error(f"SQL agent failed for {name}: {e}")
+        return "Sorry, something went wrong while looking that up. Please try again."
+
+def _touch_session(wa_id, name):
+    # Create the session or refresh an existing one in a single upsert
+    session = session_store.touch(wa_id, wa_id, name)  # thread_id placeholder is the wa_id
+    if session["created_at"] == session["last_seen"]:
+        logging.info(f"Creating new thread for {name} with wa_id {wa_id}")
+    else:
+        logging.info(f"Retrieving existing thread for {name} with wa_id {wa_id}")
+
+
+def stream_response(query, wa_id, name):
+    """
+    Generate a response to a query as a sequence of partial replies.
+
+    Parameters:
+        query (str): The SQL query or question to ask the agent.
+        wa_id (str): The WhatsApp ID or other user identifier.
+        name (str): The name of the user.
+
+    Yields:
+        tuple: ("reply", dict with answer, recommendation,
+        recommendation_reason and formatted_data_for_recommendation) once
+        compose_answer finishes, before the conversation state is saved.
+    """
+    _touch_session(wa_id, name)
+    logging.info(f"Received query from {name}: {query}")
+    answered = False
+    try:
+        for node, update in agent_executor.stream_sql_agent(query, wa_id or name):
+            if node == "compose_answer" and update and update.get("answer"):
+                answered = True
+                yield "reply", update
+            elif node == "done":
+                logging.info(f"Generated response for {name}: {update}")
+    except Exception as e:
+        logging.error(f"SQL agent failed for {name}: {e}")
+        if not answered:
+            yield "reply", {"answer": "Sorry, something went wrong while looking that up. Please try again."}
+
 
 def generate_response(query, wa_id, name):
     """
@@ -56,28 +99,9 @@ def generate_response(query, wa_id, name):
     Returns:
         str: The response from the assistant.
     """
-    # Check if there is already a thread_id for the wa_id
-    thread_id = check_if_thread_exists(wa_id)
-
-    # If a thread doesn't exist, create one and store it
-    if thread_id is None:
-        logging.info(f"Creating new thread for {name} with wa_id {wa_id}")
-        thread = {}  # Placeholder for thread logic (if needed in future for tracking)
-        store_thread(wa_id, thread_id)
-    else:
-        logging.info(f"Retrieving existing thread for {name} with wa_id {wa_id}")
-
-    # Add message to thread
-    message = client.beta.threads.messages.create(
-        thread_id=thread_id,
-        role="user",
-        content=message_body,
-    )
+    _touch_session(wa_id, name)
 
-    # Run the assistant and get the new message
-    new_message = run_assistant(thread, name)
-    print(f"This is another new message: {new_message}")
     # Run the agent and get the response
-    new_message = run_assistant(query, name)
+    new_message = run_assistant(query, name, wa_id)
 
-    return new_message
\ No newline at end of file
+    return new_message
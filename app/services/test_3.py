@@ -1,8 +1,12 @@
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
-from DatabaseManager import DatabaseManager
-from LLMManager import LLMManager
-from SQLAgent import SQLAgent
+from app.services.DatabaseManager import DatabaseManager
+from app.services.LLMManager import LLMManager
+from app.services.SQLAgent import SQLAgent
+
+# LLM responses are memoized in llm_memo.db (see LLMMemo). Once a run has
+# recorded them, replay it offline with:
+#   LLM_MEMO_OFFLINE=1 OPENAI_API_KEY=offline python -m app.services.test_3
 
 def test_sql_agent_workflow():
     # Initialize DatabaseManager and LLMManager
@@ -52,14 +56,12 @@ def test_sql_agent_workflow():
     execution_results = sql_agent.execute_sql(state)
     print("Execution Results:", execution_results)
 
-    # Step 6: Format results into a human-readable response
+    # Step 6: Answer, recommend and list the top restaurants in one call
     state['results'] = execution_results['results']
-    formatted_results = sql_agent.format_results(state)
-    print("Formatted Results:", formatted_results)
-
-    # Step 7: Choose a recommendation based on results
-    recommendation = sql_agent.choose_recommendation(state)
-    print("Recommendation:", recommendation)
+    composed_answer = sql_agent.compose_answer(state)
+    print("Answer:", composed_answer['answer'])
+    print("Recommendation:", composed_answer['recommendation'], "-", composed_answer['recommendation_reason'])
+    print("Top Restaurants:", composed_answer['formatted_data_for_recommendation'])
 
 if __name__ == "__main__":
     test_sql_agent_workflow()
\ No newline at end of file
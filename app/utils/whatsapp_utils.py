@@ -1,15 +1,12 @@
 import logging
 from flask import current_app, jsonify
 import json
-import requests
+import httpx
 import re
 from typing import Dict, Union, Any
-from app.services.openai_service import generate_response
-def log_http_response(response):
-    logging.info(f"Status: {response.status_code}")
-    logging.info(f"Content-type: {response.headers.get('content-type')}")
-    logging.info(f"Body: {response.text}")
-
+from app.services.openai_service import generate_response, stream_response
+from app.services.WhatsAppSender import WhatsAppSendError
+from app.services.Tracing import tracer
 def format_restaurant_message(response_data: Dict[str, Any]) -> str:
     """Format the restaurant data into a WhatsApp-friendly message"""
     message_parts = []
@@ -60,24 +57,22 @@ def get_text_message_input(recipient: str, response_data: Union[str, Dict[str, A
         }
     })
 
-def send_message(data: str) -> Union[requests.Response, tuple]:
-    """Send message to WhatsApp API with proper error handling"""
-    headers = {
-        "Content-type": "application/json",
-        "Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}",
-    }
-
-    url = f"https://graph.facebook.com/{current_app.config['VERSION']}/{current_app.config['PHONE_NUMBER_ID']}/messages"
+def send_message(data: str) -> Union[httpx.Response, tuple]:
+    """Send message to WhatsApp API with proper error handling
 
+    Goes through the app's pooled WhatsAppSender, which retries 429/5xx
+    responses and rate-limits per recipient.
+    """
+    sender = current_app.extensions["whatsapp_sender"]
     try:
-        response = requests.post(url, data=data, headers=headers, timeout=10)
-        response.raise_for_status()
-        log_http_response(response)
-        return response
-    except requests.Timeout:
+        with tracer.span("whatsapp.send_message") as span:
+            response = sender.send(data)
+            span.attributes["status_code"] = response.status_code
+            return response
+    except httpx.TimeoutException:
         logging.error("Timeout occurred while sending message")
         return jsonify({"status": "error", "message": "Request timed out"}), 408
-    except requests.RequestException as e:
+    except (httpx.HTTPError, WhatsAppSendError) as e:
         logging.error(f"Request failed due to: {e}")
         return jsonify({"status": "error", "message": "Failed to send message"}), 500
 
@@ -94,13 +89,53 @@ def process_text_for_whatsapp(text: str) -> str:
     
     return text
 
+def get_typing_indicator_input(message_id: str) -> str:
+    """Mark the user's message as read and show the typing indicator while the answer is prepared"""
+    return json.dumps({
+        "messaging_product": "whatsapp",
+        "status": "read",
+        "message_id": message_id,
+        "typing_indicator": {"type": "text"},
+    })
+
+def send_acknowledgement(wa_id: str, message_id: str) -> None:
+    """Let the user know the question arrived, as configured by REPLY_ACK"""
+    ack = current_app.config["REPLY_ACK"]
+    if ack == "typing" and message_id:
+        send_message(get_typing_indicator_input(message_id))
+    elif ack == "text":
+        send_message(get_text_message_input(wa_id, current_app.config["REPLY_ACK_TEXT"]))
+
+def is_recommendation_worth_sending(recommendation: str) -> bool:
+    return bool(recommendation) and recommendation.strip().lower() not in ("none", "no recommendation")
+
 def process_whatsapp_message(body: Dict[str, Any]) -> None:
-    """Process incoming WhatsApp message and send response"""
+    """Process incoming WhatsApp message and send response
+
+    In the default "progressive" REPLY_MODE the user gets an acknowledgement
+    first, then one message with the answer and the recommendation (with the
+    top restaurants) as soon as compose_answer finishes, without waiting for
+    the conversation state to be saved. "single" sends the same message once
+    the whole pipeline is done.
+    """
     wa_id = body["entry"][0]["changes"][0]["value"]["contacts"][0]["wa_id"]
     name = body["entry"][0]["changes"][0]["value"]["contacts"][0]["profile"]["name"]
     message = body["entry"][0]["changes"][0]["value"]["messages"][0]
     message_body = message["text"]["body"]
 
+    with tracer.trace("whatsapp.message", wa_id=wa_id, message_id=message.get("id")):
+        reply_to_message(wa_id, name, message.get("id"), message_body)
+
+def reply_to_message(wa_id: str, name: str, message_id: str, message_body: str) -> None:
+    if current_app.config["REPLY_MODE"] == "progressive":
+        send_acknowledgement(wa_id, message_id)
+        for kind, reply in stream_response(message_body, wa_id, name):
+            if kind == "reply":
+                if not is_recommendation_worth_sending(reply.get("recommendation") or ""):
+                    reply = {"answer": reply["answer"]}
+                send_message(get_text_message_input(wa_id, reply))
+        return
+
     # Generate response using your existing service
     response = generate_response(message_body, wa_id, name)
     
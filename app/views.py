@@ -4,10 +4,7 @@ import json
 from flask import Blueprint, request, jsonify, current_app
 
 from .decorators.security import signature_required
-from .utils.whatsapp_utils import (
-    process_whatsapp_message,
-    is_valid_whatsapp_message,
-)
+from .utils.whatsapp_utils import is_valid_whatsapp_message
 
 webhook_blueprint = Blueprint("webhook", __name__)
 
@@ -17,9 +14,10 @@ def handle_message():
     Handle incoming webhook events from the WhatsApp API.
 
     This function processes incoming WhatsApp messages and other events,
-    such as delivery statuses. If the event is a valid message, it gets
-    processed. If the incoming payload is not a recognized WhatsApp event,
-    an error is returned.
+    such as delivery statuses. If the event is a valid message, it is queued
+    for a background worker and acknowledged straight away, so Meta is not
+    kept waiting on the LLM calls. If the incoming payload is not a
+    recognized WhatsApp event, an error is returned.
 
     Every message send will trigger 4 HTTP requests to your webhook: message, sent, delivered, read.
 
@@ -41,7 +39,13 @@ def handle_message():
 
     try:
         if is_valid_whatsapp_message(body):
-            process_whatsapp_message(body)
+            message_id = body["entry"][0]["changes"][0]["value"]["messages"][0].get("id")
+            if message_id and current_app.extensions["dedup_store"].check_and_mark(message_id):
+                logging.info(f"Skipping duplicate delivery of message {message_id}")
+                return jsonify({"status": "ok"}), 200
+
+            wa_id = body["entry"][0]["changes"][0]["value"]["contacts"][0]["wa_id"]
+            current_app.extensions["job_queue"].enqueue(wa_id, body)
             return jsonify({"status": "ok"}), 200
         else:
             # if the request is not a WhatsApp API event, return an error
@@ -77,6 +81,27 @@ def verify():
         return jsonify({"status": "error", "message": "Missing parameters"}), 400
 
 
+@webhook_blueprint.route("/metrics", methods=["GET"])
+def metrics():
+    llm_memo = current_app.extensions["llm_memo"]
+    relevance_filter = current_app.extensions["relevance_filter"]
+    sql_templates = current_app.extensions["sql_agent"].sql_templates
+    return jsonify({
+        "job_queue": current_app.extensions["job_queue"].metrics(),
+        "dedup": current_app.extensions["dedup_store"].metrics(),
+        "answer_cache": current_app.extensions["answer_cache"].metrics(),
+        "llm_memo": llm_memo.metrics() if llm_memo else None,
+        "sql_validator": current_app.extensions["sql_agent"].sql_validator.metrics(),
+        "sql_templates": sql_templates.metrics() if sql_templates else None,
+        "prompt_tokens": current_app.extensions["prompt_tokens"].metrics(),
+        "models": current_app.extensions["model_usage"].metrics(),
+        "relevance_filter": relevance_filter.metrics() if relevance_filter else None,
+        "sessions": current_app.extensions["session_store"].metrics(),
+        "whatsapp_sender": current_app.extensions["whatsapp_sender"].metrics(),
+        "latency": current_app.extensions["tracer"].metrics(),
+    }), 200
+
+
 @webhook_blueprint.route("/webhook", methods=["GET"])
 def webhook_get():
     return verify()
@@ -0,0 +1,85 @@
+"""
+Throughput of the sync and async SQL agent graphs across many conversations.
+
+Uses the fake LLM from benchmarks.fakes with a fixed per-call latency.
+Each conversation (wa_id) asks one question. The graph is a single chain
+of LLM calls, so one message costs the same in both modes; the async graph
+pays off only when one event loop serves many conversations at once, where
+it should keep up with a thread pool of the same size without a thread per
+conversation. The sync graph is measured serving the conversations one
+after another (a single worker) and from that thread pool.
+
+Run from the repository root:
+    python -m benchmarks.bench_async_pipeline --latency 0.2 --conversations 20
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from app.services.DatabaseManager import DatabaseManager
+from app.services.WorkflowManager import Workflow
+from benchmarks.fakes import FakeLLMManager, create_restaurant_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per fake LLM call")
+    parser.add_argument("--conversations", type=int, default=20, help="distinct wa_ids, one message each")
+    parser.add_argument("--concurrency", type=int, default=10, help="conversations in flight at once")
+    args = parser.parse_args()
+
+    db_path = create_restaurant_db(os.path.join(tempfile.mkdtemp(), "bench.db"))
+    workflow = Workflow(memory=None)
+    workflow.sql_agent.db_manager = DatabaseManager(db_path)
+    workflow.sql_agent.llm_manager = FakeLLMManager(latency=args.latency)
+    question = "What is the best restaurant?"
+    wa_ids = [f"user-{i}" for i in range(args.conversations)]
+
+    def invoke(wa_id):
+        workflow.get_graph().invoke({"question": question, "uuid": wa_id})
+
+    async def serve():
+        graph = workflow.get_graph(asynchronous=True)
+        slots = asyncio.Semaphore(args.concurrency)
+
+        async def one(wa_id):
+            async with slots:
+                await graph.ainvoke({"question": question, "uuid": wa_id})
+
+        await asyncio.gather(*(one(wa_id) for wa_id in wa_ids))
+
+    def serial():
+        for wa_id in wa_ids:
+            invoke(wa_id)
+
+    def threaded():
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(invoke, wa_ids))
+
+    # Compile both graphs outside the timed runs
+    workflow.get_graph()
+    workflow.get_graph(asynchronous=True)
+
+    rows = []
+    for label, run in [
+        ("sync, one at a time", serial),
+        (f"sync, {args.concurrency} threads", threaded),
+        (f"async, {args.concurrency} on one loop", lambda: asyncio.run(serve())),
+    ]:
+        start = time.perf_counter()
+        run()
+        rows.append((label, time.perf_counter() - start))
+
+    print(f"fake LLM latency: {args.latency * 1000:.0f} ms/call, {args.conversations} conversations")
+    print(f"{'mode':<28}{'seconds':>9}{'msg/s':>8}{'ms/msg':>8}")
+    for label, seconds in rows:
+        print(f"{label:<28}{seconds:>9.2f}{args.conversations / seconds:>8.1f}{seconds / args.conversations * 1000:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
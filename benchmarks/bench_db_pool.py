@@ -0,0 +1,68 @@
+"""
+Queries per second against the restaurant database under concurrent readers.
+
+Compares a plain per-manager engine (the old DatabaseManager setup) with the
+shared, read-only, pragma-tuned engine from get_shared_engine.
+
+Run from the repository root:
+    python -m benchmarks.bench_db_pool --rows 100000 --threads 8 --seconds 3
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from sqlalchemy import create_engine, text
+
+from app.services.DatabaseManager import get_shared_engine
+from benchmarks.fakes import create_restaurant_db
+
+QUERIES = [
+    "SELECT `name`, `rating`, `url` FROM `data_restaurants` ORDER BY `rating` DESC LIMIT 5",
+    "SELECT `name`, `rating`, `url` FROM `data_restaurants` WHERE `city` = 'Madrid' ORDER BY `rating` DESC LIMIT 5",
+    "SELECT `name`, `price_range` FROM `data_restaurants` WHERE `rating` = (SELECT MAX(`rating`) FROM `data_restaurants`)",
+]
+
+
+def run(engine, threads: int, seconds: float) -> float:
+    counts = [0] * threads
+    deadline = time.perf_counter() + seconds
+
+    def reader(slot: int):
+        i = 0
+        while time.perf_counter() < deadline:
+            with engine.connect() as connection:
+                connection.execute(text(QUERIES[i % len(QUERIES)])).fetchall()
+            i += 1
+        counts[slot] = i
+
+    workers = [threading.Thread(target=reader, args=(slot,)) for slot in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return sum(counts) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    db_path = create_restaurant_db(os.path.join(tempfile.mkdtemp(), "bench.db"), rows=args.rows)
+
+    baseline = run(create_engine(f"sqlite:///{db_path}"), args.threads, args.seconds)
+    tuned = run(get_shared_engine(db_path), args.threads, args.seconds)
+
+    print(f"rows: {args.rows}, reader threads: {args.threads}")
+    print(f"default engine:        {baseline:,.0f} queries/s")
+    print(f"shared tuned engine:   {tuned:,.0f} queries/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+Offline end-to-end benchmark: webhook payloads replayed against create_app().
+
+Builds a synthetic restaurant database (cached per --rows/--seed), swaps the
+OpenAI-backed LLMManager for the deterministic FakeLLMManager and points the
+WhatsApp sender at the local stub Graph API, so nothing leaves the machine.
+Signed webhook payloads (generated, or read from --corpus as one JSON
+payload per line) are posted through the Flask test client. The report
+covers webhook ack latency, message throughput, per-stage latency
+percentiles from the tracer, and a sequential profiling pass with peak
+Python memory per stage.
+
+Run from the repository root:
+    python -m benchmarks.bench_end_to_end --rows 10000 --messages 200 --latency 0.05
+    python -m benchmarks.bench_end_to_end --rows 10000000 --json report.json
+    python -m benchmarks.bench_end_to_end --compare report.json --tolerance 0.2
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+WORKDIR = tempfile.mkdtemp(prefix="bench-e2e-")
+APP_SECRET = "bench-secret"
+
+# Everything create_app reads from the environment has to be set before app is imported
+os.environ.update({
+    "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "sk-benchmark"),
+    "APP_SECRET": APP_SECRET,
+    "ACCESS_TOKEN": "bench",
+    "VERSION": "v18.0",
+    "PHONE_NUMBER_ID": "1000",
+    "LLM_MEMO_PATH": "",
+    "QUERY_LOG_PATH": "",
+    "TRACE_EXPORT_PATH": "",
+    "CONVERSATION_DB_PATH": os.path.join(WORKDIR, "conversations.db"),
+    "SESSION_DB_PATH": os.path.join(WORKDIR, "sessions.db"),
+    "DEDUP_BACKEND": "memory",
+    "WHATSAPP_RECIPIENT_BURST": "1000",
+    "WHATSAPP_RATE_PER_SECOND": "10000",
+})
+
+from benchmarks.fakes import CITIES, CUISINES, FakeLLMManager, create_restaurant_db
+from benchmarks.stub_graph_api import start_stub_server
+
+QUESTION_TEMPLATES = [
+    "What is the best restaurant in {city}?",
+    "Which {cuisine} restaurant has the best rating?",
+    "What is the worst rated restaurant in {city}?",
+    "Any cheap {cuisine} places in {city}?",
+    "and cheaper ones?",
+    "What is the price range in the best restaurant?",
+]
+
+
+def database(rows: int, seed: int) -> str:
+    """Path of the synthetic database, generated once per size and seed."""
+    path = os.path.join(tempfile.gettempdir(), f"bench-restaurants-{rows}-{seed}.db")
+    if not os.path.exists(path):
+        started = time.perf_counter()
+        create_restaurant_db(path + ".tmp", rows=rows, seed=seed)
+        os.replace(path + ".tmp", path)
+        print(f"generated {rows:,} rows in {time.perf_counter() - started:.1f}s: {path}")
+    return path
+
+
+def webhook_payload(wa_id: str, message_id: str, text: str) -> dict:
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{"changes": [{"value": {
+            "messaging_product": "whatsapp",
+            "contacts": [{"wa_id": wa_id, "profile": {"name": f"user {wa_id}"}}],
+            "messages": [{"id": message_id, "from": wa_id, "type": "text", "text": {"body": text}}],
+        }}]}],
+    }
+
+
+def corpus(messages: int, users: int, seed: int):
+    rng = random.Random(seed)
+    for i in range(messages):
+        question = rng.choice(QUESTION_TEMPLATES).format(city=rng.choice(CITIES), cuisine=rng.choice(CUISINES))
+        yield webhook_payload(f"3460{rng.randrange(users):05d}", f"wamid.bench{i}", question)
+
+
+def load_corpus(path: str):
+    with open(path) as handle:
+        for line in handle:
+            if line.strip():
+                yield json.loads(line)
+
+
+class StageMemory:
+    """
+    Span exporter that records peak traced Python memory per span name.
+
+    Only meaningful when messages are processed one at a time: each span
+    reports the tracemalloc peak since the previous span ended, folded into
+    its parent so enclosing spans include their children.
+    """
+
+    def __init__(self):
+        self.peaks = {}
+        self._child_peaks = {}
+        self.baseline = 0
+
+    def start(self):
+        tracemalloc.start()
+        self.baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+    def export(self, span):
+        peak = max(tracemalloc.get_traced_memory()[1], self._child_peaks.pop(span.span_id, 0))
+        tracemalloc.reset_peak()
+        if span.parent_id:
+            self._child_peaks[span.parent_id] = max(self._child_peaks.get(span.parent_id, 0), peak)
+        self.peaks[span.name] = max(self.peaks.get(span.name, 0), peak - self.baseline)
+
+
+def post(client, payload: dict):
+    raw = json.dumps(payload)
+    signature = hmac.new(APP_SECRET.encode(), raw.encode(), hashlib.sha256).hexdigest()
+    return client.post("/webhook", data=raw, content_type="application/json",
+                       headers={"X-Hub-Signature-256": f"sha256={signature}"})
+
+
+def wait_for_queue(job_queue, expected: int, timeout: float = 600) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = job_queue.metrics()
+        if stats["processed"] + stats["failed"] >= expected:
+            return
+        time.sleep(0.01)
+    raise TimeoutError("job queue did not drain")
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=10000, help="synthetic restaurants (10k to 10M)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake LLM seconds per call")
+    parser.add_argument("--send-latency", type=float, default=0.02, help="stub Graph API seconds per request")
+    parser.add_argument("--workers", type=int, default=4, help="JOB_QUEUE_WORKERS")
+    parser.add_argument("--reply-mode", choices=["progressive", "single"], default="progressive")
+    parser.add_argument("--profile-messages", type=int, default=20, help="messages in the sequential memory pass")
+    parser.add_argument("--corpus", help="JSONL file of webhook payloads to replay instead of generated ones")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--compare", help="earlier --json report; exit 1 if a stage's p95 regressed")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 regression for --compare")
+    args = parser.parse_args()
+
+    stub, base_url = start_stub_server(latency=args.send_latency)
+    os.environ.update({
+        "DB_PATH": database(args.rows, args.seed),
+        "WHATSAPP_API_BASE_URL": base_url,
+        "JOB_QUEUE_WORKERS": str(args.workers),
+        "REPLY_MODE": args.reply_mode,
+    })
+
+    import app.services.openai_service as openai_service
+    from app import create_app
+    from app.services.DatabaseManager import DatabaseManager
+    from app.services.Tracing import tracer
+
+    # The agent was built when app was first imported, before DB_PATH pointed at the synthetic database
+    openai_service.agent_executor.sql_agent.db_manager = DatabaseManager(os.environ["DB_PATH"])
+    openai_service.agent_executor.sql_agent.llm_manager = FakeLLMManager(latency=args.latency)
+    started = time.perf_counter()
+    flask_app = create_app()
+    startup = time.perf_counter() - started
+    client = flask_app.test_client()
+    job_queue = flask_app.extensions["job_queue"]
+
+    payloads = list(load_corpus(args.corpus) if args.corpus else corpus(args.messages, args.users, args.seed))
+    acks = []
+    started = time.perf_counter()
+    for payload in payloads:
+        sent = time.perf_counter()
+        post(client, payload)
+        acks.append(time.perf_counter() - sent)
+    wait_for_queue(job_queue, len(payloads))
+    elapsed = time.perf_counter() - started
+    stages = tracer.metrics()
+
+    # Sequential pass for memory: one message at a time on the calling thread
+    memory = StageMemory()
+    tracer.exporters.append(memory)
+    memory.start()
+    from app.utils.whatsapp_utils import process_whatsapp_message
+    for payload in payloads[:args.profile_messages]:
+        with flask_app.app_context():
+            process_whatsapp_message(payload)
+    tracemalloc.stop()
+    tracer.exporters.remove(memory)
+
+    report = {
+        "rows": args.rows,
+        "messages": len(payloads),
+        "startup_seconds": round(startup, 3),
+        "throughput_msgs_per_second": round(len(payloads) / elapsed, 2),
+        "webhook_ack_ms": {
+            "p50": round(percentile(acks, 0.50) * 1000, 2),
+            "p95": round(percentile(acks, 0.95) * 1000, 2),
+            "p99": round(percentile(acks, 0.99) * 1000, 2),
+        },
+        "stages": {
+            name: {**{key: stats[key] for key in ("count", "p50_ms", "p95_ms", "p99_ms", "max_ms")},
+                   "peak_memory_kb": round(memory.peaks.get(name, 0) / 1024, 1)}
+            for name, stats in stages.items()
+        },
+        "llm_calls": openai_service.agent_executor.sql_agent.llm_manager.calls,
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "failed_jobs": job_queue.metrics()["failed"],
+        "stub_messages_received": len(stub.received),
+    }
+
+    print(f"rows: {args.rows:,}  messages: {report['messages']}  workers: {args.workers}  "
+          f"fake LLM latency: {args.latency * 1000:.0f} ms  reply mode: {args.reply_mode}")
+    print(f"startup {report['startup_seconds']}s  throughput {report['throughput_msgs_per_second']} msg/s  "
+          f"webhook ack p50/p95/p99 {report['webhook_ack_ms']['p50']}/{report['webhook_ack_ms']['p95']}/"
+          f"{report['webhook_ack_ms']['p99']} ms  max RSS {report['max_rss_mb']} MB  failed jobs {report['failed_jobs']}")
+    print(f"{'stage':32} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak KB':>9}")
+    for name, stats in report["stages"].items():
+        print(f"{name:32} {stats['count']:6} {stats['p50_ms']:9.2f} {stats['p95_ms']:9.2f} "
+              f"{stats['p99_ms']:9.2f} {stats['peak_memory_kb']:9.1f}")
+
+    if args.json:
+        with open(args.json, "w") as handle:
+            json.dump(report, handle, indent=2)
+
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+        regressions = [
+            f"{name}: p95 {baseline['stages'][name]['p95_ms']} -> {stats['p95_ms']} ms"
+            for name, stats in report["stages"].items()
+            if name in baseline["stages"]
+            and stats["p95_ms"] > baseline["stages"][name]["p95_ms"] * (1 + args.tolerance) + 1
+        ]
+        if regressions:
+            print("\nregressions beyond tolerance:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print(f"\nno stage regressed more than {args.tolerance:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
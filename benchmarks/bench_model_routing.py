@@ -0,0 +1,98 @@
+"""
+Per-stage latency and cost with and without small-model-first routing.
+
+Both models are served by the OpenAI-compatible stub in
+benchmarks/stub_llm_api.py through ModelRouter's "local:" endpoint, so
+the real ChatOpenAI client is used end to end. The small model answers
+faster but gives an unusable reply to --small-failure-rate of its
+prompts; those stages escalate to the large model. Tokens are priced as
+gpt-4o-mini (small) and gpt-4o (large). The labeled questions from
+bench_workflow_modes measure accuracy.
+
+Run from the repository root:
+    python -m benchmarks.bench_model_routing --large-latency 0.3 --small-latency 0.1 --small-failure-rate 0.15
+"""
+import argparse
+import os
+import tempfile
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from app.services.DatabaseManager import DatabaseManager
+from app.services.LLMManager import LLMManager
+from app.services.ModelRouter import MODEL_PRICES, ModelRouter, ModelUsage
+from app.services.WorkflowManager import WORKFLOW_MODES, Workflow
+from benchmarks.bench_workflow_modes import labeled_questions
+from benchmarks.fakes import create_restaurant_db
+from benchmarks.stub_llm_api import start_stub_server
+
+SMALL, LARGE = "local:fake-small", "local:fake-large"
+PRICES = {SMALL: MODEL_PRICES["gpt-4o-mini"], LARGE: MODEL_PRICES["gpt-4o"]}
+
+
+def run(name: str, routes, base_url: str, db_manager: DatabaseManager, mode: str, questions) -> dict:
+    router = ModelRouter(routes=routes, small_model=SMALL, large_model=LARGE, local_base_url=base_url)
+    llm_manager = LLMManager(model=LARGE, memo=None, router=router)
+    llm_manager.usage = ModelUsage(PRICES)
+    workflow = Workflow(use_async=False, memory=None, mode=mode)
+    workflow.sql_agent.db_manager = db_manager
+    workflow.sql_agent.llm_manager = llm_manager
+    graph = workflow.get_graph()
+
+    latencies, correct = [], 0
+    for i, (question, reference) in enumerate(questions):
+        expected = sorted(map(tuple, db_manager.execute_query(reference)))
+        started = time.perf_counter()
+        result = graph.invoke({"question": question, "uuid": f"bench-{i}"})
+        latencies.append(time.perf_counter() - started)
+        rows = result.get('results')
+        correct += isinstance(rows, list) and sorted(map(tuple, rows)) == expected
+    return {
+        "name": name,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "accuracy": correct / len(questions),
+        **llm_manager.usage.metrics(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--large-latency", type=float, default=0.3, help="seconds per large-model call")
+    parser.add_argument("--small-latency", type=float, default=0.1, help="seconds per small-model call")
+    parser.add_argument("--small-failure-rate", type=float, default=0.15, help="share of unusable small-model replies")
+    parser.add_argument("--mode", choices=WORKFLOW_MODES, default="staged", help="WORKFLOW_MODE to run")
+    args = parser.parse_args()
+
+    stub, base_url = start_stub_server({
+        "fake-small": {"latency": args.small_latency, "failure_rate": args.small_failure_rate},
+        "fake-large": {"latency": args.large_latency},
+    })
+    db_manager = DatabaseManager(create_restaurant_db(os.path.join(tempfile.mkdtemp(), "bench.db"), rows=args.rows))
+    questions = list(labeled_questions())
+
+    reports = [
+        run("large only", {}, base_url, db_manager, args.mode, questions),
+        run("routed", None, base_url, db_manager, args.mode, questions),
+    ]
+
+    print(f"{len(questions)} labeled questions, {args.mode} workflow; small model {args.small_latency * 1000:.0f} ms "
+          f"({args.small_failure_rate:.0%} unusable), large model {args.large_latency * 1000:.0f} ms")
+    for report in reports:
+        print(f"\n{report['name']}: mean {report['mean_ms']:.0f} ms/question, cost ${report['total_cost_usd']:.4f}, "
+              f"accuracy {report['accuracy']:.0%}")
+        print(f"  {'stage':22} {'model':18} {'calls':>6} {'p50 ms':>8} {'p95 ms':>8} {'cost $':>9}  escalations")
+        for stage, stats in report["stages"].items():
+            escalations = ", ".join(f"{reason} {n}" for reason, n in stats["escalations"].items()) or "-"
+            for model, usage in stats["models"].items():
+                print(f"  {stage:22} {model:18} {usage['calls']:6} {usage['p50_ms']:8.0f} {usage['p95_ms']:8.0f} "
+                      f"{usage['cost_usd']:9.5f}  {escalations}")
+                escalations = ""
+    large, routed = reports
+    print(f"\nrouted: {routed['mean_ms'] / large['mean_ms']:.0%} of the latency and "
+          f"{routed['total_cost_usd'] / max(large['total_cost_usd'], 1e-12):.0%} of the cost of large-only")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Accuracy of the relevance filter and the LLM calls it saves.
+
+Classifies the labeled messages in benchmarks/relevance_eval.jsonl
+(database questions, small talk and off-topic questions) and prints the
+confusion matrix, precision and recall per class and every database
+question the filter would have answered with a template, which is the
+error that matters: it costs a user their answer, while a message wrongly
+let through only costs the LLM calls the filter exists to save.
+
+Then runs every message through a Workflow with the filter off and on and
+compares LLM calls and prompt tokens (from the llm.* spans). The fake LLM
+marks the non-database messages as not relevant, like a perfectly
+accurate model would, so the run without the filter pays parse_question
+for each of them before answering "sorry".
+
+Run from the repository root:
+    python -m benchmarks.bench_relevance_filter --latency 0.3
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from app.services.DatabaseManager import DatabaseManager
+from app.services.NounIndex import NounIndex
+from app.services.RelevanceFilter import RelevanceFilter
+from app.services.Tracing import tracer
+from app.services.WorkflowManager import Workflow
+from benchmarks.bench_workflow_modes import LLMUsage
+from benchmarks.fakes import FakeLLMManager, create_restaurant_db
+
+EVAL_PATH = os.path.join(os.path.dirname(__file__), "relevance_eval.jsonl")
+LABELS = ("database", "small_talk", "off_topic")
+
+
+def load_eval(path: str = EVAL_PATH):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def eval_label(verdict) -> str:
+    """Collapse the filter's labels into the eval set's: unknown goes to the graph, template intents are small talk."""
+    if verdict.is_database:
+        return "database"
+    return verdict.label if verdict.label == "off_topic" else "small_talk"
+
+
+def evaluate(relevance_filter: RelevanceFilter, examples) -> dict:
+    confusion = Counter()
+    blocked, let_through = [], []
+    started = time.perf_counter()
+    for example in examples:
+        predicted = eval_label(relevance_filter.classify(example["text"]))
+        confusion[(example["label"], predicted)] += 1
+        if example["label"] == "database" and predicted != "database":
+            blocked.append((example["text"], predicted))
+        elif example["label"] != "database" and predicted == "database":
+            let_through.append((example["text"], example["label"]))
+    elapsed = time.perf_counter() - started
+    scores = {}
+    for label in LABELS:
+        true_positive = confusion[(label, label)]
+        predicted = sum(confusion[(actual, label)] for actual in LABELS)
+        actual = sum(confusion[(label, other)] for other in LABELS)
+        scores[label] = {
+            "precision": true_positive / predicted if predicted else 0.0,
+            "recall": true_positive / actual if actual else 0.0,
+        }
+    return {
+        "confusion": confusion,
+        "scores": scores,
+        "blocked": blocked,
+        "let_through": let_through,
+        "classify_us": elapsed / len(examples) * 1e6,
+    }
+
+
+def run_workflow(filtered: bool, db_manager: DatabaseManager, examples, latency: float) -> dict:
+    irrelevant = [example["text"] for example in examples if example["label"] != "database"]
+    workflow = Workflow(use_async=False, memory=None, mode="staged")
+    workflow.sql_agent.db_manager = db_manager
+    workflow.sql_agent.llm_manager = FakeLLMManager(latency, irrelevant_questions=irrelevant)
+    if not filtered:
+        workflow.relevance_filter = None
+    usage = LLMUsage()
+    tracer.exporters.append(usage)
+    started = time.perf_counter()
+    try:
+        for i, example in enumerate(examples):
+            workflow.run_sql_agent(example["text"], f"bench-{i}")
+    finally:
+        tracer.exporters.remove(usage)
+    return {
+        "seconds": time.perf_counter() - started,
+        "llm_calls": usage.total("calls"),
+        "prompt_tokens": usage.total("prompt_tokens"),
+        "parse_question_calls": usage.stages["parse_question"]["calls"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.0, help="fake LLM seconds per call")
+    parser.add_argument("--eval", default=EVAL_PATH, help="JSON lines of {\"text\", \"label\"}")
+    args = parser.parse_args()
+
+    examples = load_eval(args.eval)
+    db_manager = DatabaseManager(create_restaurant_db(os.path.join(tempfile.mkdtemp(), "bench.db"), rows=args.rows))
+    noun_index = NounIndex(db_manager)
+    relevance_filter = RelevanceFilter(known_words=noun_index.words, schema=db_manager.get_schema_snapshot)
+
+    report = evaluate(relevance_filter, examples)
+    counts = Counter(example["label"] for example in examples)
+    print(f"{len(examples)} labeled messages ({', '.join(f'{counts[label]} {label}' for label in LABELS)}), "
+          f"{report['classify_us']:.0f} us/message")
+    print(f"\n{'actual/predicted':18} " + " ".join(f"{label:>11}" for label in LABELS) + f" {'precision':>10} {'recall':>8}")
+    for label in LABELS:
+        row = " ".join(f"{report['confusion'][(label, predicted)]:11}" for predicted in LABELS)
+        scores = report["scores"][label]
+        print(f"{label:18} {row} {scores['precision']:10.0%} {scores['recall']:8.0%}")
+    print(f"\ndatabase questions answered with a template: {len(report['blocked'])}")
+    for text, predicted in report["blocked"]:
+        print(f"  [{predicted}] {text}")
+    print(f"non-database messages sent to the graph: {len(report['let_through'])}")
+    for text, label in report["let_through"]:
+        print(f"  [{label}] {text}")
+
+    off = run_workflow(False, db_manager, examples, args.latency)
+    on = run_workflow(True, db_manager, examples, args.latency)
+    print(f"\n{'filter':7} {'LLM calls':>10} {'parse_question':>15} {'prompt tok':>11} {'seconds':>8}")
+    for name, run in (("off", off), ("on", on)):
+        print(f"{name:7} {run['llm_calls']:10} {run['parse_question_calls']:15} {run['prompt_tokens']:11} {run['seconds']:8.2f}")
+    print(f"filter saves {off['llm_calls'] - on['llm_calls']} LLM calls "
+          f"({1 - on['llm_calls'] / max(1, off['llm_calls']):.0%}) and "
+          f"{1 - on['prompt_tokens'] / max(1, off['prompt_tokens']):.0%} of prompt tokens")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Session lookups/upserts per second under concurrent writers.
+
+Compares the old shelve thread store (open the file on every message, as
+check_if_thread_exists/store_thread did) with SessionStore. Several worker
+processes hit one store file, the way several Flask workers would.
+
+Run from the repository root:
+    python -m benchmarks.bench_session_store --processes 4 --users 500 --seconds 3
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shelve
+import tempfile
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from app.services.SessionStore import SessionStore
+
+
+def shelve_worker(path, users, seconds, results):
+    random.seed(os.getpid())
+    done = errors = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        wa_id = str(random.randrange(users))
+        try:
+            with shelve.open(path) as threads_shelf:
+                thread_id = threads_shelf.get(wa_id, None)
+            if thread_id is None:
+                with shelve.open(path, writeback=True) as threads_shelf:
+                    threads_shelf[wa_id] = wa_id
+            done += 1
+        except Exception:
+            errors += 1  # dbm refuses concurrent writers or leaves a corrupt file
+    results.put((done, errors))
+
+
+def session_worker(path, users, seconds, results):
+    random.seed(os.getpid())
+    store = SessionStore(db_path=path, touch_interval=0.5)
+    done = errors = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        wa_id = str(random.randrange(users))
+        try:
+            store.touch(wa_id, wa_id)
+            done += 1
+        except Exception:
+            errors += 1
+    results.put((done, errors))
+
+
+def run(worker, path, processes, users, seconds):
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=worker, args=(path, users, seconds, results)) for _ in range(processes)
+    ]
+    for process in workers:
+        process.start()
+    totals = [results.get() for _ in workers]
+    for process in workers:
+        process.join()
+    return sum(done for done, _ in totals) / seconds, sum(errors for _, errors in totals)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    SessionStore(db_path=os.path.join(directory, "sessions.db"))  # create the schema before the workers race
+
+    print(f"processes: {args.processes}, distinct users: {args.users}")
+    for label, worker, path in (
+        ("shelve threads_db", shelve_worker, os.path.join(directory, "threads_db")),
+        ("SessionStore", session_worker, os.path.join(directory, "sessions.db")),
+    ):
+        rate, errors = run(worker, path, args.processes, args.users, args.seconds)
+        print(f"{label:18} {rate:10,.0f} messages/s  {errors} failed operations")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+LLM calls, latency and accuracy with and without SQL templates.
+
+Sends a stream of recurring question intents (best/worst restaurants by
+city, cuisine and price, in several phrasings) through a Workflow with
+SQL_TEMPLATES=0 and with the template library on, and compares LLM
+calls, prompt tokens (from the llm.* spans), wall time per question and
+accuracy. A question counts as correct when the rows the workflow fetched
+equal the rows of its reference query. The answer cache is bypassed, so
+the template library is measured on its own.
+
+With the library on, seeded shapes are answered from the first question
+and the other intents go through the LLM until their query has recurred
+SQL_TEMPLATES_MIN_OCCURRENCES times; the hit rate per quarter of the
+stream shows that learning curve.
+
+Run from the repository root:
+    python -m benchmarks.bench_sql_templates --questions 200 --latency 0.3
+    OPENAI_API_KEY=... python -m benchmarks.bench_sql_templates --live --questions 50
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from app.services.DatabaseManager import DatabaseManager
+from app.services.LLMManager import LLMManager
+from app.services.Tracing import tracer
+from app.services.WorkflowManager import WORKFLOW_MODES, Workflow
+from benchmarks.bench_workflow_modes import SELECT, LLMUsage, where
+from benchmarks.fakes import CITIES, CUISINES, FakeLLMManager, create_restaurant_db
+
+# (question, WHERE filters, ORDER BY direction) per phrasing of the recurring intents
+PHRASINGS = (
+    ("What is the best restaurant in {city}?", ("city",), "DESC"),
+    ("Top places in {city}", ("city",), "DESC"),
+    ("What is the worst rated restaurant in {city}?", ("city",), "ASC"),
+    ("Which {cuisine} restaurant has the best rating?", ("cuisine",), "DESC"),
+    ("Best {cuisine} restaurant in {city}?", ("city", "cuisine"), "DESC"),
+    ("Any cheap {cuisine} places in {city}?", ("city", "cuisine", "price_range"), "DESC"),
+)
+
+
+def traffic(questions: int, seed: int = 0):
+    """(question, reference SQL) pairs drawn from PHRASINGS with random cities and cuisines."""
+    rng = random.Random(seed)
+    for _ in range(questions):
+        phrasing, filters, direction = rng.choice(PHRASINGS)
+        values = {"city": rng.choice(CITIES), "cuisine": rng.choice(CUISINES), "price_range": "€"}
+        clause = where(*(f"`{column}` = '{values[column]}'" for column in filters))
+        yield phrasing.format(**values), f"{SELECT}{clause} ORDER BY `rating` {direction} LIMIT 5"
+
+
+def run(templates: bool, mode: str, db_manager: DatabaseManager, llm_manager, questions) -> dict:
+    os.environ["SQL_TEMPLATES"] = "1" if templates else "0"
+    workflow = Workflow(use_async=False, memory=None, mode=mode)
+    workflow.sql_agent.db_manager = db_manager
+    workflow.sql_agent.llm_manager = llm_manager
+    graph = workflow.get_graph()
+    library = workflow.sql_agent.sql_templates
+    usage = LLMUsage()
+    tracer.exporters.append(usage)
+    latencies, hits, correct = [], [], 0
+    try:
+        for i, (question, reference) in enumerate(questions):
+            expected = sorted(map(tuple, db_manager.execute_query(reference)))
+            hits_before = library.metrics()["hits"] if library else 0
+            started = time.perf_counter()
+            result = graph.invoke({"question": question, "uuid": f"bench-{i}"})
+            latencies.append(time.perf_counter() - started)
+            hits.append(library is not None and library.metrics()["hits"] > hits_before)
+            rows = result.get('results')
+            correct += isinstance(rows, list) and sorted(map(tuple, rows)) == expected
+    finally:
+        tracer.exporters.remove(usage)
+    quarter = max(1, len(hits) // 4)
+    return {
+        "name": "templates" if templates else "no templates",
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "llm_calls": usage.total("calls"),
+        "prompt_tokens": usage.total("prompt_tokens"),
+        "accuracy": correct / len(questions),
+        "hit_rates": [sum(hits[i:i + quarter]) / len(hits[i:i + quarter]) for i in range(0, quarter * 4, quarter)],
+        "library": library.metrics() if library else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.3, help="fake LLM seconds per call")
+    parser.add_argument("--mode", choices=WORKFLOW_MODES, default="staged", help="WORKFLOW_MODE to run")
+    parser.add_argument("--live", action="store_true", help="use the real OpenAI model instead of the fake")
+    args = parser.parse_args()
+
+    db_manager = DatabaseManager(create_restaurant_db(os.path.join(tempfile.mkdtemp(), "bench.db"), rows=args.rows))
+    questions = list(traffic(args.questions))
+    reports = []
+    for templates in (False, True):
+        llm_manager = LLMManager(memo=None) if args.live else FakeLLMManager(args.latency)
+        reports.append(run(templates, args.mode, db_manager, llm_manager, questions))
+
+    source = "live model" if args.live else f"fake LLM, {args.latency * 1000:.0f} ms/call"
+    print(f"{len(questions)} questions over {len(PHRASINGS)} phrasings, {args.rows:,} rows, {args.mode} workflow, {source}")
+    print(f"{'':13} {'mean ms':>9} {'LLM calls':>10} {'prompt tok':>11} {'accuracy':>9}  template hit rate by quarter")
+    for report in reports:
+        quarters = " ".join(f"{rate:4.0%}" for rate in report["hit_rates"]) if report["library"] else "-"
+        print(f"{report['name']:13} {report['mean_ms']:9.0f} {report['llm_calls']:10} {report['prompt_tokens']:11} "
+              f"{report['accuracy']:9.0%}  {quarters}")
+    off, on = reports
+    library = on["library"]
+    print(f"templates: {library['seeded']} seeded, {library['learned']} learned; "
+          f"{1 - on['llm_calls'] / max(1, off['llm_calls']):.0%} fewer LLM calls, "
+          f"{on['mean_ms'] / off['mean_ms']:.0%} of the latency")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Outbound WhatsApp messages per second against a local stub Graph API.
+
+Compares the old send path (requests.post with a new connection per
+message, no retries) with WhatsAppSender (pooled keep-alive client,
+retries, rate limits) sending one by one and as a batch. The stub answers
+every --fail-every-th request with a 429 and adds --latency seconds per
+request to stand in for the round trip to Meta.
+
+Run from the repository root:
+    python -m benchmarks.bench_whatsapp_sender --messages 200 --recipients 50 --latency 0.05
+"""
+import argparse
+import json
+import os
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+import requests
+
+from app.services.WhatsAppSender import WhatsAppSender
+from benchmarks.stub_graph_api import start_stub_server
+
+
+def payloads(messages: int, recipients: int):
+    return [
+        json.dumps({
+            "messaging_product": "whatsapp",
+            "recipient_type": "individual",
+            "to": f"3460000{i % recipients:04d}",
+            "type": "text",
+            "text": {"preview_url": False, "body": f"Message {i}"},
+        })
+        for i in range(messages)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--recipients", type=int, default=50)
+    parser.add_argument("--fail-every", type=int, default=20, help="answer every Nth request with a 429")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub response delay in seconds")
+    args = parser.parse_args()
+    batch = payloads(args.messages, args.recipients)
+    headers = {"Content-type": "application/json", "Authorization": "Bearer stub"}
+
+    server, base_url = start_stub_server(fail_every=args.fail_every, latency=args.latency)
+    url = f"{base_url}/v18.0/123/messages"
+    start = time.perf_counter()
+    delivered = sum(requests.post(url, data=data, headers=headers, timeout=10).ok for data in batch)
+    elapsed = time.perf_counter() - start
+    print(f"requests.post per message: {args.messages / elapsed:8,.0f} msg/s  "
+          f"delivered {delivered}/{args.messages}  connections {server.connections}")
+
+    for label, send in (("sender, one by one", "send"), ("sender, batch", "send_batch")):
+        server, base_url = start_stub_server(fail_every=args.fail_every, latency=args.latency)
+        sender = WhatsAppSender("stub", "123", "v18.0", base_url=base_url, backoff_base=0.01,
+                                rate_per_second=10000, recipient_burst=args.messages)
+        start = time.perf_counter()
+        if send == "send":
+            results = [sender.send(data) for data in batch]
+        else:
+            results = sender.send_batch(batch)
+        elapsed = time.perf_counter() - start
+        delivered = sum(not isinstance(result, Exception) for result in results)
+        print(f"{label + ':':26} {args.messages / elapsed:8,.0f} msg/s  delivered {delivered}/{args.messages}  "
+              f"connections {server.connections}  retries {sender.retries}")
+        sender.close()
+
+
+if __name__ == "__main__":
+    main()
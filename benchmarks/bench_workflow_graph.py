@@ -0,0 +1,46 @@
+"""
+Micro-benchmark for the per-message LangGraph setup cost.
+
+Compares rebuilding and compiling the StateGraph on every message (the old
+behaviour of Workflow.run_sql_agent) against reusing the cached graph from
+Workflow.get_graph. No LLM or database calls are made.
+
+Run from the repository root:
+    python -m benchmarks.bench_workflow_graph --messages 200
+"""
+import argparse
+import os
+import time
+
+# ChatOpenAI only validates that a key is present; nothing is sent.
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from app.services.WorkflowManager import Workflow
+
+
+def time_per_message(fn, messages: int) -> float:
+    start = time.perf_counter()
+    for _ in range(messages):
+        fn()
+    return (time.perf_counter() - start) / messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=200)
+    args = parser.parse_args()
+
+    workflow = Workflow(memory=None)
+
+    before = time_per_message(lambda: workflow.create_workflow().compile(), args.messages)
+    workflow.get_graph()  # warm the cache, as create_app does at startup
+    after = time_per_message(workflow.get_graph, args.messages)
+
+    print(f"messages:            {args.messages}")
+    print(f"compile per message: {before * 1000:.3f} ms")
+    print(f"cached graph:        {after * 1000:.6f} ms")
+    print(f"speedup:             {before / after:,.0f}x")
+
+
+if __name__ == "__main__":
+    main()
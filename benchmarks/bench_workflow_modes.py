@@ -0,0 +1,138 @@
+"""
+Latency, token usage and accuracy of the staged and fast workflow modes.
+
+Runs a labeled question set through a Workflow in each WORKFLOW_MODE and
+compares wall time per question, LLM calls, prompt/completion tokens (from
+the llm.* spans) and answer accuracy. A question counts as correct when
+the rows the workflow fetched equal the rows of its reference query.
+
+By default the deterministic fake LLM is used, so accuracy only moves
+with --invalid-plan-rate (the share of plan_sql responses that fail their
+self-check and fall back to the staged chain). --live sends the prompts
+to the configured OpenAI model instead, which is what the accuracy
+comparison is for.
+
+Run from the repository root:
+    python -m benchmarks.bench_workflow_modes --latency 0.3 --invalid-plan-rate 0.1
+    OPENAI_API_KEY=... python -m benchmarks.bench_workflow_modes --live
+"""
+import argparse
+import os
+import tempfile
+import time
+from collections import defaultdict
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from app.services.DatabaseManager import DatabaseManager
+from app.services.LLMManager import LLMManager
+from app.services.Tracing import tracer
+from app.services.WorkflowManager import WORKFLOW_MODES, Workflow
+from app.services.SQLTemplates import NOT_MISSING
+from benchmarks.fakes import CITIES, CUISINES, FakeLLMManager, create_restaurant_db
+
+SELECT = "SELECT `name`, `rating`, `url` FROM `data_restaurants`"
+CHEAP = "`price_range` = '€'"
+
+
+def where(*filters: str) -> str:
+    """A WHERE clause with the filters plus the prompt's rule to skip NULL, '' and 'N/A' values."""
+    return " WHERE " + " AND ".join(filters + (NOT_MISSING,))
+
+
+def labeled_questions():
+    """(question, reference SQL) pairs over the synthetic data_restaurants table."""
+    yield "What is the best restaurant?", f"{SELECT}{where()} ORDER BY `rating` DESC LIMIT 5"
+    for city in CITIES:
+        in_city = f"`city` = '{city}'"
+        yield f"What is the best restaurant in {city}?", f"{SELECT}{where(in_city)} ORDER BY `rating` DESC LIMIT 5"
+        yield f"What is the worst rated restaurant in {city}?", f"{SELECT}{where(in_city)} ORDER BY `rating` ASC LIMIT 5"
+    in_first_city = f"`city` = '{CITIES[0]}'"
+    for cuisine in CUISINES:
+        of_cuisine = f"`cuisine` = '{cuisine}'"
+        yield f"Which {cuisine} restaurant has the best rating?", f"{SELECT}{where(of_cuisine)} ORDER BY `rating` DESC LIMIT 5"
+        yield (f"Any cheap {cuisine} places in {CITIES[0]}?",
+               f"{SELECT}{where(in_first_city, of_cuisine, CHEAP)} ORDER BY `rating` DESC LIMIT 5")
+
+
+class LLMUsage:
+    """Span exporter that adds up LLM calls and tokens per stage."""
+
+    def __init__(self):
+        self.stages = defaultdict(lambda: {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+
+    def export(self, span):
+        if span.name.startswith("llm."):
+            stage = self.stages[span.name[len("llm."):]]
+            stage["calls"] += 1
+            stage["prompt_tokens"] += span.attributes.get("prompt_tokens", 0)
+            stage["completion_tokens"] += span.attributes.get("completion_tokens", 0)
+
+    def total(self, key: str) -> int:
+        return sum(stage[key] for stage in self.stages.values())
+
+
+def run_mode(mode: str, db_manager: DatabaseManager, llm_manager, questions) -> dict:
+    workflow = Workflow(use_async=False, memory=None, mode=mode)
+    workflow.sql_agent.db_manager = db_manager
+    workflow.sql_agent.llm_manager = llm_manager
+    graph = workflow.get_graph()
+    usage = LLMUsage()
+    tracer.exporters.append(usage)
+    latencies, correct = [], 0
+    try:
+        for i, (question, reference) in enumerate(questions):
+            expected = sorted(map(tuple, db_manager.execute_query(reference)))
+            started = time.perf_counter()
+            result = graph.invoke({"question": question, "uuid": f"bench-{i}"})
+            latencies.append(time.perf_counter() - started)
+            rows = result.get('results')
+            correct += isinstance(rows, list) and sorted(map(tuple, rows)) == expected
+    finally:
+        tracer.exporters.remove(usage)
+    latencies.sort()
+    return {
+        "mode": mode,
+        "questions": len(questions),
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "p95_ms": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] * 1000,
+        "llm_calls": usage.total("calls"),
+        "prompt_tokens": usage.total("prompt_tokens"),
+        "completion_tokens": usage.total("completion_tokens"),
+        "accuracy": correct / len(questions),
+        # Without conversation memory every parse_question in fast mode is a fallback from plan_sql
+        "fallbacks": usage.stages["parse_question"]["calls"] if mode == "fast" else 0,
+        "stages": dict(usage.stages),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--latency", type=float, default=0.3, help="fake LLM seconds per call")
+    parser.add_argument("--invalid-plan-rate", type=float, default=0.0, help="share of fake plan_sql responses that fail")
+    parser.add_argument("--live", action="store_true", help="use the real OpenAI model instead of the fake")
+    args = parser.parse_args()
+
+    db_path = create_restaurant_db(os.path.join(tempfile.mkdtemp(), "bench.db"), rows=args.rows)
+    db_manager = DatabaseManager(db_path)
+    questions = list(labeled_questions())
+
+    reports = []
+    for mode in WORKFLOW_MODES:
+        llm_manager = LLMManager(memo=None) if args.live else FakeLLMManager(args.latency, invalid_plan_rate=args.invalid_plan_rate)
+        reports.append(run_mode(mode, db_manager, llm_manager, questions))
+
+    source = "live model" if args.live else f"fake LLM, {args.latency * 1000:.0f} ms/call, invalid plans {args.invalid_plan_rate:.0%}"
+    print(f"{len(questions)} labeled questions, {args.rows:,} rows, {source}")
+    print(f"{'mode':8} {'mean ms':>9} {'p95 ms':>9} {'LLM calls':>10} {'prompt tok':>11} {'compl. tok':>11} {'accuracy':>9} {'fallbacks':>10}")
+    for report in reports:
+        print(f"{report['mode']:8} {report['mean_ms']:9.0f} {report['p95_ms']:9.0f} {report['llm_calls']:10} "
+              f"{report['prompt_tokens']:11} {report['completion_tokens']:11} {report['accuracy']:9.0%} {report['fallbacks']:10}")
+    staged, fast = reports
+    print(f"fast mode: {fast['mean_ms'] / staged['mean_ms']:.0%} of staged latency, "
+          f"{fast['prompt_tokens'] / max(1, staged['prompt_tokens']):.0%} of its prompt tokens")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Offline stand-ins shared by the benchmarks: a deterministic fake LLM and a
+synthetic restaurant database shaped like data_restaurants.
+"""
+import asyncio
+import json
+import random
+import re
+import sqlite3
+import time
+import zlib
+from typing import Iterable, List, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage
+
+from app.services.LLMManager import LLMManager
+from app.services.LLMMemo import LLMMemo
+from app.services.ModelRouter import ModelRouter, ModelUsage
+from app.services.PromptBudget import PromptTokenStats
+from app.services.SQLTemplates import NOT_MISSING
+
+CITIES = ["Madrid", "Barcelona", "Valencia", "Sevilla", "Bilbao"]
+CUISINES = ["Italian", "Spanish", "Japanese", "Mexican", "Vegan", "Indian"]
+PRICE_RANGES = ["€", "€€", "€€€", "€€€€"]
+
+
+def create_restaurant_db(path: str, rows: int = 1000, seed: int = 0) -> str:
+    """
+    Create (or replace) a data_restaurants table with `rows` synthetic rows;
+    1 in 50 has no rating, 1 in 50 no URL. The file is switched to WAL, as
+    the README asks of a deployed database.
+    """
+    rng = random.Random(seed)
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("DROP TABLE IF EXISTS data_restaurants")
+    connection.execute(
+        "CREATE TABLE data_restaurants ("
+        "name TEXT, rating REAL, user_ratings_total REAL, price_range TEXT, "
+        "cuisine TEXT, city TEXT, vicinity TEXT, url TEXT, overview TEXT)"
+    )
+    batch = []
+    for i in range(rows):
+        city = rng.choice(CITIES)
+        cuisine = rng.choice(CUISINES)
+        batch.append((
+            f"{cuisine} Place {i}",
+            round(rng.uniform(1, 5), 1) if i % 50 != 7 else None,
+            rng.randint(1, 5000),
+            rng.choice(PRICE_RANGES),
+            cuisine,
+            city,
+            f"Calle {rng.randint(1, 300)}, {city}",
+            f"https://maps.example.com/?cid={i}" if i % 50 != 23 else "N/A",
+            f"A {cuisine.lower()} restaurant in {city}.",
+        ))
+        if len(batch) >= 10000:
+            connection.executemany("INSERT INTO data_restaurants VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+            batch = []
+    connection.executemany("INSERT INTO data_restaurants VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+    connection.commit()
+    connection.close()
+    return path
+
+
+class FakeChatModel:
+    """
+    Chat model stand-in: answers each SQLAgent stage with a canned,
+    well-formed response after sleeping for ``latency`` seconds, and
+    reports token usage the way ChatOpenAI does. ``invalid_plan_rate`` is
+    the share of questions (chosen by hash, so repeatable) whose plan_sql
+    response fails its own check, to exercise the fast mode's fallback.
+    parse_question marks the questions in ``irrelevant_questions`` as not
+    relevant, the way a perfectly accurate model would.
+    """
+
+    def __init__(self, latency: float = 0.0, invalid_plan_rate: float = 0.0, irrelevant_questions: Iterable[str] = ()):
+        self.latency = latency
+        self.invalid_plan_rate = invalid_plan_rate
+        self.irrelevant_questions = set(irrelevant_questions)
+        self.calls = 0
+
+    @staticmethod
+    def _question(human: str) -> str:
+        match = re.search(r"===User question:\s*(.+?)(?:\n\s*\n|$)", human, re.DOTALL)
+        if match is None:
+            match = re.search(r"User question:\s*(.+?)(?:\n|$)", human)
+        return match.group(1).strip() if match else ""
+
+    @staticmethod
+    def _sql(question: str) -> str:
+        """A query that depends on the question, so replays exercise different plans."""
+        lowered = question.lower()
+        filters = [f"`city` = '{city}'" for city in CITIES if city.lower() in lowered]
+        filters += [f"`cuisine` = '{cuisine}'" for cuisine in CUISINES if cuisine.lower() in lowered]
+        if "cheap" in lowered:
+            filters.append("`price_range` = '€'")
+        where = f" WHERE {' AND '.join(filters + [NOT_MISSING])}"
+        order = "ASC" if "worst" in lowered else "DESC"
+        return f"SELECT `name`, `rating`, `url` FROM `data_restaurants`{where} ORDER BY `rating` {order} LIMIT 5"
+
+    def respond(self, system: str, human: str = "") -> str:
+        if "plans and checks SQL" in system:
+            question = self._question(human)
+            valid = zlib.crc32(question.encode()) % 1000 >= self.invalid_plan_rate * 1000
+            return json.dumps({
+                "is_relevant": True,
+                "relevant_tables": [{
+                    "table_name": "data_restaurants",
+                    "columns": ["name", "rating", "url", "city", "cuisine", "price_range"],
+                    "noun_columns": ["city", "cuisine"],
+                }],
+                "unique_nouns": [],
+                "sql_query": self._sql(question),
+                "valid": valid,
+                "issues": None if valid else "Not sure the filters match the question",
+            })
+        if "parse user questions" in system:
+            if self._question(human) in self.irrelevant_questions:
+                return json.dumps({"is_relevant": False, "relevant_tables": []})
+            return json.dumps({
+                "is_relevant": True,
+                "relevant_tables": [{
+                    "table_name": "data_restaurants",
+                    "columns": ["name", "rating", "url", "city", "cuisine", "price_range"],
+                    "noun_columns": ["city", "cuisine"],
+                }],
+            })
+        if "generates SQL queries" in system:
+            return self._sql(self._question(human))
+        if "validates and fixes SQL" in system:
+            return json.dumps({"valid": True, "issues": None, "corrected_query": "None"})
+        if "answers questions about restaurants" in system:
+            return json.dumps({
+                "answer": "The best rated restaurant is Italian Place 1.",
+                "recommendation": "Italian Place 1",
+                "reason": "It has the highest rating.",
+                "top_restaurants": [
+                    {"name": f"Italian Place {i}", "url": f"https://maps.example.com/?cid={i}",
+                     "description": "An italian restaurant."}
+                    for i in range(1, 6)
+                ],
+            })
+        return "NOT_ENOUGH_INFO"
+
+    def _answer(self, messages: List[BaseMessage]) -> AIMessage:
+        self.calls += 1
+        system = str(messages[0].content)
+        human = str(messages[-1].content) if len(messages) > 1 else ""
+        content = self.respond(system, human)
+        prompt_chars = sum(len(str(message.content)) for message in messages)
+        return AIMessage(content=content, usage_metadata={
+            "input_tokens": prompt_chars // 4,
+            "output_tokens": len(content) // 4,
+            "total_tokens": (prompt_chars + len(content)) // 4,
+        })
+
+    def invoke(self, messages: List[BaseMessage]) -> AIMessage:
+        time.sleep(self.latency)
+        return self._answer(messages)
+
+    async def ainvoke(self, messages: List[BaseMessage]) -> AIMessage:
+        await asyncio.sleep(self.latency)
+        return self._answer(messages)
+
+
+class FakeLLMManager(LLMManager):
+    """
+    LLMManager backed by FakeChatModel.
+
+    Only the chat model is replaced, so prompt formatting, token counting,
+    the memo (off unless one is passed) and tracing run exactly as in
+    production. Model routing is off unless a router is passed, e.g. one
+    pointing at benchmarks/stub_llm_api.py.
+    """
+
+    def __init__(self, latency: float = 0.0, memo: Optional[LLMMemo] = None, invalid_plan_rate: float = 0.0,
+                 router: Optional[ModelRouter] = None, usage: Optional[ModelUsage] = None,
+                 irrelevant_questions: Iterable[str] = ()):
+        self.model = "fake"
+        self.llm = FakeChatModel(latency, invalid_plan_rate, irrelevant_questions)
+        self.memo = memo
+        self.router = router
+        self.prompt_tokens = PromptTokenStats()
+        self.usage = usage or ModelUsage()
+
+    @property
+    def latency(self) -> float:
+        return self.llm.latency
+
+    @property
+    def calls(self) -> int:
+        return self.llm.calls
@@ -0,0 +1,92 @@
+"""
+Local stand-in for the WhatsApp Cloud API messages endpoint.
+
+Accepts POST /<version>/<phone_number_id>/messages over keep-alive
+HTTP/1.1, answers like the Graph API and can be told to throttle: every
+``fail_every``-th request gets a 429 with Retry-After (or a 503 when
+``server_errors`` is set). ``latency`` adds a fixed delay per request to
+stand in for the round trip to Meta. Point WhatsAppSender (or WHATSAPP_API_BASE_URL)
+at the URL returned by start_stub_server.
+"""
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+
+class StubGraphAPI(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, fail_every: int = 0, retry_after: float = 0.05, server_errors: bool = False,
+                 latency: float = 0.0):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.fail_every = fail_every
+        self.retry_after = retry_after
+        self.server_errors = server_errors
+        self.requests = 0
+        self.connections = 0
+        self.received = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Write status, headers and body in one segment; flushed after each request
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server._lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: dict, headers=()):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server = self.server
+        with server._lock:
+            server.requests += 1
+            count = server.requests
+            throttle = server.fail_every and count % server.fail_every == 0
+            if not throttle:
+                server.received.append(payload)
+                message_id = next(server._ids)
+        if server.latency:
+            time.sleep(server.latency)
+        if throttle and server.server_errors:
+            self._reply(503, {"error": {"message": "Service temporarily unavailable", "code": 2}})
+        elif throttle:
+            self._reply(
+                429,
+                {"error": {"message": "Rate limit hit", "code": 130429}},
+                [("Retry-After", str(server.retry_after))],
+            )
+        else:
+            self._reply(200, {
+                "messaging_product": "whatsapp",
+                "contacts": [{"input": payload.get("to"), "wa_id": payload.get("to")}],
+                "messages": [{"id": f"wamid.stub{message_id}"}],
+            })
+
+
+def start_stub_server(**options) -> Tuple[StubGraphAPI, str]:
+    """Serve the stub on a free localhost port in a daemon thread; returns the server and its base URL."""
+    server = StubGraphAPI(("127.0.0.1", 0), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
@@ -0,0 +1,92 @@
+"""
+Local stand-in for an OpenAI-compatible model server (vLLM, Ollama, ...).
+
+Answers POST .../chat/completions with FakeChatModel's canned responses,
+so the real ChatOpenAI client and ModelRouter's "local:<name>" models can
+be exercised offline. Each model name can get its own ``latency`` and
+``failure_rate``: that share of prompts (chosen by hash, so repeatable)
+gets an unusable free-text reply, which makes SQLAgent escalate to the
+next model. Point LLM_LOCAL_BASE_URL at the URL returned by
+start_stub_server.
+"""
+import itertools
+import json
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+
+from benchmarks.fakes import FakeChatModel
+
+UNUSABLE_REPLY = "I am not sure I can help with that."
+
+
+class StubLLMAPI(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, models: Dict[str, Dict[str, float]]):
+        super().__init__(address, _Handler)
+        self.models = models
+        self.fake = FakeChatModel()
+        self.requests = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server = self.server
+        model = payload.get("model", "")
+        options = server.models.get(model)
+        if not self.path.endswith("/chat/completions") or options is None:
+            self._reply(404, {"error": {"message": f"Unknown model or path: {model} {self.path}", "type": "invalid_request_error"}})
+            return
+        with server._lock:
+            server.requests += 1
+            completion_id = next(server._ids)
+        messages = payload.get("messages", [])
+        system = str(messages[0]["content"]) if messages else ""
+        human = str(messages[-1]["content"]) if len(messages) > 1 else ""
+        if zlib.crc32(f"{model}\n{human}".encode()) % 1000 < options.get("failure_rate", 0.0) * 1000:
+            content = UNUSABLE_REPLY
+        else:
+            content = server.fake.respond(system, human)
+        time.sleep(options.get("latency", 0.0))
+        prompt_tokens = sum(len(str(message["content"])) for message in messages) // 4
+        completion_tokens = len(content) // 4
+        self._reply(200, {
+            "id": f"chatcmpl-stub{completion_id}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+
+def start_stub_server(models: Dict[str, Dict[str, float]]) -> Tuple[StubLLMAPI, str]:
+    """Serve the stub on a free localhost port in a daemon thread; returns the server and its /v1 base URL."""
+    server = StubLLMAPI(("127.0.0.1", 0), models)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"